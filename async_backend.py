@@ -0,0 +1,198 @@
+"""
+Async data access for the app backend, on SQLAlchemy AsyncSession with the
+aiosqlite driver (optional dependency: pip install aiosqlite), so a slow
+import or log sync doesn't block every other request.
+
+Reads and writes reuse the sync code paths (the cached statements of
+repository.py, main.load_program_tree(), main.upsert_logs()...) through
+AsyncSession.run_sync(): the ORM runs in a greenlet and only waits on the
+aiosqlite connection thread, without blocking the event loop. CPU-heavy
+parsing (html and Excel files) runs in a process pool instead.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from database import DB_PATH, profile_pragmas, database_url, listen_pragmas
+from summaries import refresh_workout_summaries
+from lookup_cache import lookup_program_id
+import repository
+import main as gym
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
+from pathlib import Path
+import asyncio
+import weakref
+
+
+# Process pool for parsing (created on first use)
+_executor = None
+# Write lock of every engine (SQLite has a single writer anyway, so writers
+# wait here instead of in busy timeouts, where they may fail)
+_write_locks = weakref.WeakKeyDictionary()
+
+
+def get_async_engine(db_path: str = DB_PATH, profile: str = "serving",
+                     read_only: bool = False, pool_size: int = 5):
+    """
+    Returns a new async engine of a SQLite database tuned with a profile.
+    Unlike database.get_engine() it isn't cached, as its connections belong
+    to the event loop they were opened in (dispose it when done).
+
+        Parameters:
+            db_path (str): SQLite database file
+            profile (str): engine profile (see database.PROFILES)
+            read_only (bool): open connections in read-only mode
+            pool_size (int): pooled connections (each one is a thread of
+                             aiosqlite, so it bounds concurrent queries)
+
+        Returns:
+            engine (SQLAlchemy.ext.asyncio.AsyncEngine object)
+    """
+    pragmas = profile_pragmas(profile, read_only)
+
+    # Pooled connections, so pragmas (and mmap) are set once per connection
+    engine = create_async_engine(database_url(db_path, read_only, "sqlite+aiosqlite"),
+                                 poolclass=AsyncAdaptedQueuePool, pool_size=pool_size)
+    listen_pragmas(engine.sync_engine, pragmas)
+
+    return engine
+
+
+def get_async_sessionmaker(engine):
+    """
+    Returns a factory of AsyncSessions bound to the engine. Objects aren't
+    expired on commit, as their attributes can't be lazy loaded afterwards.
+    """
+    return sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def get_executor(workers: int = None):
+    """Returns the (shared) process pool used for parsing"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+
+    return _executor
+
+
+def _async_read(function):
+    """Async version of a sync read function taking the session first"""
+    @wraps(function)
+    async def read(session, *args, **kwargs):
+        return await session.run_sync(function, *args, **kwargs)
+
+    read.__doc__ = f"Async version of {function.__module__}.{function.__name__}()"
+    return read
+
+
+program_id_by_desc = _async_read(repository.program_id_by_desc)
+block_id_by_desc = _async_read(repository.block_id_by_desc)
+exercise_ids_by_desc = _async_read(repository.exercise_ids_by_desc)
+program_plan = _async_read(repository.program_plan)
+workout_sets = _async_read(repository.workout_sets)
+logs_by_date_range = _async_read(repository.logs_by_date_range)
+report = _async_read(repository.report)
+load_program_tree = _async_read(gym.load_program_tree)
+
+
+def _write_lock(session):
+    engine = session.bind.sync_engine
+    if engine not in _write_locks:
+        _write_locks[engine] = asyncio.Lock()
+
+    return _write_locks[engine]
+
+
+async def _commit(session, function, *args):
+    """
+    Runs a sync write function and commits (rolls back if it fails),
+    holding the write lock of the engine.
+    """
+    async with _write_lock(session):
+        try:
+            result = await session.run_sync(function, *args)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+    return result
+
+
+async def log_workout(session, workout_id: int, header: dict, sets: list):
+    """
+    Async version of main.write_workout_log(), in its own transaction.
+
+        Returns:
+            n_rows (int): number of log rows written
+    """
+    return await _commit(session, gym.write_workout_log, workout_id, header, sets)
+
+
+def _read_log_file(log_file):
+    return list(gym.stream_log_workouts(log_file))
+
+
+def _write_log_file(session, program_desc: str, workouts: list):
+    program_id = lookup_program_id(session, program_desc)
+    if program_id is None:
+        raise KeyError(f"No record for {program_desc}!")
+
+    _, block_workouts = gym.block_workout_ids(session, program_id)
+    log_workouts, log_sets = gym.log_rows(workouts, block_workouts)
+    n_rows = gym.upsert_logs(session, log_workouts, log_sets)
+    refresh_workout_summaries(session, [row["workout_id"] for row in log_workouts])
+
+    return n_rows
+
+
+async def sync_log_data(session, log_file, executor=None):
+    """
+    Async version of main.sync_log_data(): the log Excel file is read in
+    the process pool and its rows are upserted in one transaction.
+
+        Parameters:
+            session (SQLAlchemy.ext.asyncio.AsyncSession object)
+            log_file (str or path): the Excel file that contains the info
+            executor (concurrent.futures.Executor): executor to read the
+                                                    file in (get_executor()
+                                                    by default)
+
+        Returns:
+            n_rows (int): number of log rows written
+    """
+    loop = asyncio.get_running_loop()
+    workouts = await loop.run_in_executor(executor or get_executor(), _read_log_file,
+                                          str(log_file))
+
+    return await _commit(session, _write_log_file, Path(log_file).stem, workouts)
+
+
+async def add_block(session, source_file, program: str, parser: str = "html.parser",
+                    executor=None):
+    """
+    Async version of main.bulk_add_block(): the html file is parsed in the
+    process pool and the block is written in one transaction.
+
+        Parameters:
+            session (SQLAlchemy.ext.asyncio.AsyncSession object)
+            source_file (str or path): the .html file that contains the info
+            program (str): the gym program description name
+            parser (str): BeautifulSoup parser backend
+            executor (concurrent.futures.Executor): executor to parse the
+                                                    file in (get_executor()
+                                                    by default)
+
+        Returns:
+            stats (dict): as returned by main.bulk_add_block()
+    """
+    loop = asyncio.get_running_loop()
+    block_dict = await loop.run_in_executor(executor or get_executor(),
+                                            gym.get_data_from_html, str(source_file), parser)
+
+    # bulk_add_block() commits (or rolls back) itself
+    async with _write_lock(session):
+        return await session.run_sync(lambda sync_session: gym.bulk_add_block(
+            sync_session, program=program, block_dict=block_dict))
@@ -0,0 +1,188 @@
+"""
+Load test of the async backend (async_backend.py) against a local copy of
+a synthetic database: concurrent clients send a mix of reads (workout sets,
+logs by date range, program plan) and workout log writes, and throughput
+and latencies are reported for every concurrency level.
+
+Usage (from repo root, needs aiosqlite):
+    python -m benchmarks.async_load [--blocks 10 --sessions-per-block 12]
+                                    [--clients 1 4 16] [--requests 2000]
+                                    [--write-ratio 0.2] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import async_backend as backend
+import main as gym
+from database import get_session
+from models import Workout, Workout_set
+from benchmarks.synthetic import write_program_html
+
+
+PROGRAM = "Synthetic"
+# Read requests and their relative weight
+READS = {"workout_sets": 6, "logs_by_date_range": 3, "program_plan": 1}
+
+
+def build_database(tmp_dir: Path, n_blocks: int, sessions_per_block: int):
+    """
+    Loads a synthetic program into a new database.
+
+        Returns:
+            db (path): database file
+            workouts (list): (workout_id, date_workout, workout_set_ids) of
+                             every workout
+    """
+    db = tmp_dir / "reference.db"
+    gym.prepare_database(str(db))
+    session = get_session(str(db))
+    for file in write_program_html(tmp_dir / "html", n_blocks, sessions_per_block):
+        gym.bulk_add_block(session, file, PROGRAM)
+
+    workouts = {}
+    for workout_id, date_workout, workout_set_id in (
+            session.query(Workout.workout_id, Workout.date_workout, Workout_set.workout_set_id)
+            .join(Workout.workout_sets)
+            .order_by(Workout_set.workout_set_id)):
+        workouts.setdefault((workout_id, date_workout), []).append(workout_set_id)
+    session.close()
+
+    return db, [(workout_id, date_workout, set_ids)
+                for (workout_id, date_workout), set_ids in workouts.items()]
+
+
+def make_requests(workouts: list, program_id: int, n_requests: int, write_ratio: float,
+                  seed: int = 0):
+    """Random mix of requests, as (kind, function, args) tuples"""
+    rng = random.Random(seed)
+    dates = [date_workout for _, date_workout, _ in workouts]
+    requests = []
+    for _ in range(n_requests):
+        workout_id, date_workout, set_ids = rng.choice(workouts)
+        if rng.random() < write_ratio:
+            header = {"Fecha": datetime.combine(date_workout, datetime.min.time()),
+                      "Duración (min)": rng.choice([45, 60, 75]),
+                      "RPE general": rng.randint(6, 9),
+                      "Comentario general": None}
+            sets = [{"ID": set_id, "Repeticiones": rng.randint(3, 12), "Peso (kg)": None,
+                     "RPE": rng.randint(5, 10), "Comentarios": None}
+                    for set_id in set_ids if rng.random() < 0.8]
+            requests.append(("log_workout", backend.log_workout, (workout_id, header, sets)))
+            continue
+
+        kind = rng.choices(list(READS), weights=list(READS.values()))[0]
+        if kind == "workout_sets":
+            args = (workout_id,)
+        elif kind == "logs_by_date_range":
+            date_from = rng.choice(dates)
+            args = (date_from, date_from + timedelta(days=30))
+        else:
+            args = (program_id,)
+        requests.append((kind, getattr(backend, kind), args))
+
+    return requests
+
+
+async def run_clients(db: Path, requests: list, n_clients: int):
+    """
+    Sends the requests from n_clients concurrent clients, each request in
+    its own session (as a web handler would).
+
+        Returns:
+            seconds (float): wall time
+            latencies (dict): kind --> list of seconds
+            errors (int): failed requests
+    """
+    engine = backend.get_async_engine(str(db), "serving", pool_size=n_clients)
+    Session = backend.get_async_sessionmaker(engine)
+    pending = iter(requests)
+    latencies = {}
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for kind, function, args in pending:
+            start = time.perf_counter()
+            try:
+                async with Session() as session:
+                    await function(session, *args)
+            except Exception:
+                errors += 1
+                continue
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(n_clients)))
+    seconds = time.perf_counter() - start
+    await engine.dispose()
+
+    return seconds, latencies, errors
+
+
+def percentile(values: list, q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--blocks", type=int, default=10)
+    arg_parser.add_argument("--sessions-per-block", type=int, default=12)
+    arg_parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--write-ratio", type=float, default=0.2)
+    arg_parser.add_argument("--json", help="also save results to this json file")
+    args = arg_parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        reference_db, workouts = build_database(tmp_dir, args.blocks, args.sessions_per_block)
+        session = get_session(str(reference_db))
+        program_id = gym.get_program_id(session, PROGRAM)
+        session.close()
+        requests = make_requests(workouts, program_id, args.requests, args.write_ratio)
+        print(f"{len(workouts)} workouts, {args.requests} requests "
+              f"({args.write_ratio:.0%} log writes)")
+
+        for n_clients in args.clients:
+            # Every level starts from the same database
+            db = tmp_dir / f"clients_{n_clients}.db"
+            shutil.copy(reference_db, db)
+            seconds, latencies, errors = asyncio.run(run_clients(db, requests, n_clients))
+            reads = [s for kind, values in latencies.items() if kind != "log_workout"
+                     for s in values]
+            writes = latencies.get("log_workout", [])
+            results.append({"clients": n_clients,
+                            "seconds": seconds,
+                            "requests_per_sec": len(requests) / seconds,
+                            "errors": errors,
+                            "read_p50_ms": 1000 * percentile(reads, 0.5),
+                            "read_p95_ms": 1000 * percentile(reads, 0.95),
+                            "write_p50_ms": 1000 * percentile(writes, 0.5),
+                            "write_p95_ms": 1000 * percentile(writes, 0.95)})
+
+    print(f"{'clients':>8} {'req/s':>9} {'errors':>7} {'read p50':>9} {'read p95':>9} "
+          f"{'write p50':>10} {'write p95':>10}  (ms)")
+    for result in results:
+        print(f"{result['clients']:>8} {result['requests_per_sec']:>9.0f} "
+              f"{result['errors']:>7} {result['read_p50_ms']:>9.1f} "
+              f"{result['read_p95_ms']:>9.1f} {result['write_p50_ms']:>10.1f} "
+              f"{result['write_p95_ms']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"blocks": args.blocks, "sessions_per_block": args.sessions_per_block,
+                       "requests": args.requests, "write_ratio": args.write_ratio,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
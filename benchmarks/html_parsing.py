@@ -0,0 +1,77 @@
+"""
+Benchmark of the html planning extractors: BeautifulSoup tree (html.parser
+and lxml backends) vs the streaming extractor, on large synthetic exports.
+Each run happens in a fresh interpreter so peak RSS is measured per parser.
+
+Usage (from repo root):
+    python -m benchmarks.html_parsing [--sessions 2000 5000]
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import random_sessions, write_micro_html
+
+
+PARSERS = ["html.parser", "lxml", "stream"]
+
+
+def run_parser(parser: str, file):
+    """Parses file with the given backend, returns (seconds, sessions)"""
+    import main
+
+    start = time.perf_counter()
+    if parser == "stream":
+        # Consume the generator without materializing the sessions
+        n_sessions = sum(1 for _ in main.iter_sessions_from_html(file))
+    else:
+        n_sessions = len(next(iter(main.get_data_from_html(file, parser).values())))
+
+    return time.perf_counter() - start, n_sessions
+
+
+def measure(parser: str, file):
+    """Runs parser in a fresh interpreter, returns (seconds, peak RSS MB, sessions)"""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.html_parsing", "--run", parser, str(file)],
+        check=True, capture_output=True, text=True
+    ).stdout.split()
+
+    return float(output[0]), float(output[1]), int(output[2])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 5000])
+    arg_parser.add_argument("--run", nargs=2, metavar=("PARSER", "FILE"), help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run:
+        seconds, n_sessions = run_parser(*args.run)
+        # ru_maxrss is in KB on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(seconds, peak_mb, n_sessions)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'sessions':>9} {'size (MB)':>10} {'parser':>12} {'time (s)':>9} {'peak RSS (MB)':>14}")
+        for n_sessions in args.sessions:
+            file = Path(tmp_dir) / f"synthetic_{n_sessions}.html"
+            write_micro_html(file, random_sessions(n_sessions))
+            size_mb = file.stat().st_size / 2**20
+            for parser in PARSERS:
+                try:
+                    seconds, peak_mb, parsed = measure(parser, file)
+                except subprocess.CalledProcessError:
+                    print(f"{n_sessions:>9} {size_mb:>10.1f} {parser:>12} {'(not available)':>24}")
+                    continue
+                assert parsed == n_sessions
+                print(f"{n_sessions:>9} {size_mb:>10.1f} {parser:>12} {seconds:>9.2f} {peak_mb:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Stages of the pipeline on their own, over a synthetic program: html
+parsing, exercises curation, block loading, Excel export and log loading
+(the original functions, and their bulk/streaming versions). Every stage
+setup returns the function to time, against a fresh copy of its input.
+
+They are timed by the pytest-benchmark suite (tests/test_pipeline_benchmark.py),
+so runs on different commits can be saved and compared:
+
+    python -m pytest tests/test_pipeline_benchmark.py --benchmark-autosave
+    python -m pytest tests/test_pipeline_benchmark.py --benchmark-compare
+
+(BENCHMARK_BLOCKS and BENCHMARK_SESSIONS_PER_BLOCK set the scale.)
+"""
+import shutil
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+import main as gym
+from models import Base, Program
+from database import get_session
+from benchmarks.synthetic import write_program_html, fill_log_workbook
+
+
+PROGRAM = "Synthetic"
+
+
+class Fixture:
+    """Synthetic html files, parsed blocks, loaded database and filled log workbook"""
+
+    def __init__(self, tmp_dir: Path, n_blocks: int, sessions_per_block: int):
+        self.tmp_dir = tmp_dir
+        self.files = write_program_html(tmp_dir / "html", n_blocks, sessions_per_block)
+        self.blocks = gym.parse_html_files(self.files)
+        self.n_sets = 0
+
+        # Reference database (loaded in bulk) and its log workbook
+        self.db = tmp_dir / "reference.db"
+        session = self.new_session(self.db)
+        for block_dict in self.blocks:
+            stats = gym.bulk_add_block(session, program=PROGRAM, block_dict=block_dict)
+            self.n_sets += stats["sets"]
+        gym.generate_program_excel(session, PROGRAM, str(tmp_dir) + "/", write_only=True)
+        session.close()
+        self.log_file = tmp_dir / f"{PROGRAM}.xlsx"
+        fill_log_workbook(self.log_file)
+        self._copies = 0
+        # Last session and export directory handed to a stage (to check its results)
+        self.session = None
+        self.export_dir = None
+
+    def new_session(self, db: Path):
+        """Session of a new empty database with the program already created"""
+        Base.metadata.create_all(create_engine(f"sqlite:///{db}"))
+        session = get_session(str(db))
+        session.add(Program(program_desc=PROGRAM))
+        session.commit()
+        return session
+
+    def empty_session(self):
+        self._copies += 1
+        self.session = self.new_session(self.tmp_dir / f"empty_{self._copies}.db")
+        return self.session
+
+    def loaded_session(self):
+        """Session of a fresh copy of the reference database"""
+        self._copies += 1
+        db = self.tmp_dir / f"loaded_{self._copies}.db"
+        shutil.copy(self.db, db)
+        self.session = get_session(str(db))
+        return self.session
+
+    def output_dir(self):
+        self._copies += 1
+        output_dir = self.tmp_dir / f"export_{self._copies}"
+        output_dir.mkdir()
+        self.export_dir = output_dir
+        return str(output_dir) + "/"
+
+
+def setup_parse(fixture):
+    return lambda: [gym.get_data_from_html(file) for file in fixture.files]
+
+
+def setup_curate(fixture):
+    workouts = [wod for block_dict in fixture.blocks
+                for workouts_list in block_dict.values() for wod in workouts_list]
+    return lambda: [gym.curate_exercises_data(wod["exercises"], gym.COL_NAMES)
+                    for wod in workouts]
+
+
+def setup_add_block(fixture):
+    session = fixture.empty_session()
+    return lambda: [gym.add_block(session, file, PROGRAM) for file in fixture.files]
+
+
+def setup_bulk_add_block(fixture):
+    session = fixture.empty_session()
+    return lambda: [gym.bulk_add_block(session, file, PROGRAM) for file in fixture.files]
+
+
+def setup_export(fixture, write_only: bool = False):
+    session, output_dir = fixture.loaded_session(), fixture.output_dir()
+    return lambda: gym.generate_program_excel(session, PROGRAM, output_dir, write_only)
+
+
+def setup_load_log_data(fixture):
+    session = fixture.loaded_session()
+    return lambda: gym.load_log_data(session, fixture.log_file)
+
+
+def setup_sync_log_data(fixture):
+    session = fixture.loaded_session()
+    return lambda: gym.sync_log_data(session, fixture.log_file, streaming=True)
+
+
+# Stage name --> setup(fixture) returning the function to time
+STAGES = {
+    "get_data_from_html": setup_parse,
+    "curate_exercises_data": setup_curate,
+    "add_block": setup_add_block,
+    "bulk_add_block": setup_bulk_add_block,
+    "generate_program_excel": setup_export,
+    "generate_program_excel (write_only)": lambda fixture: setup_export(fixture, True),
+    "load_log_data": setup_load_log_data,
+    "sync_log_data (streaming)": setup_sync_log_data,
+}
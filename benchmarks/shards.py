@@ -0,0 +1,131 @@
+"""
+Write contention of the sharding mode (sharding.py): several athletes log
+workouts at the same time (one process each), either all into one shared
+database or each one into their own shard, and the write throughput and
+latencies are reported for every number of athletes.
+
+Usage (from repo root):
+    python -m benchmarks.shards [--blocks 5 --sessions-per-block 12]
+                                [--athletes 1 2 4 8] [--writes 200] [--json results.json]
+"""
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+
+import main as gym
+from database import get_session
+from sharding import ShardRouter
+from benchmarks.async_load import build_database, percentile
+
+
+def log_writes(db_path: str, workouts: list, n_writes: int, seed: int = 0):
+    """
+    Logs random workouts, one transaction each (run in a worker process).
+
+        Returns:
+            start, end (float): wall clock of first and last write
+            latencies (list): seconds of every successful write
+            errors (int): failed writes (database locked)
+    """
+    rng = random.Random(seed)
+    session = get_session(db_path, "serving")
+    latencies, errors = [], 0
+    start = time.time()
+    for _ in range(n_writes):
+        workout_id, date_workout, set_ids = rng.choice(workouts)
+        header = {"Fecha": datetime.combine(date_workout, datetime.min.time()),
+                  "Duración (min)": rng.choice([45, 60, 75]),
+                  "RPE general": rng.randint(6, 9)}
+        sets = [{"ID": set_id, "Repeticiones": rng.randint(3, 12), "RPE": rng.randint(5, 10)}
+                for set_id in set_ids if rng.random() < 0.8]
+        write_start = time.perf_counter()
+        try:
+            gym.write_workout_log(session, workout_id, header, sets)
+            session.commit()
+        except OperationalError:
+            session.rollback()
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - write_start)
+    end = time.time()
+    session.close()
+
+    return start, end, latencies, errors
+
+
+def run(db_paths: list, workouts: list, n_writes: int):
+    """
+    One writer process per database path (the same path for every athlete
+    in shared mode).
+
+        Returns:
+            result (dict): writes per second, errors and latencies (ms)
+    """
+    with ProcessPoolExecutor(max_workers=len(db_paths)) as executor:
+        # Every athlete logs their own workouts
+        results = list(executor.map(log_writes, db_paths,
+                                    [workouts[i::len(db_paths)] for i in range(len(db_paths))],
+                                    [n_writes] * len(db_paths), range(len(db_paths))))
+
+    seconds = max(end for _, end, _, _ in results) - min(start for start, _, _, _ in results)
+    latencies = [s for _, _, values, _ in results for s in values]
+
+    return {"writes_per_sec": len(latencies) / seconds,
+            "errors": sum(errors for *_, errors in results),
+            "p50_ms": 1000 * percentile(latencies, 0.5),
+            "p95_ms": 1000 * percentile(latencies, 0.95)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--blocks", type=int, default=5)
+    arg_parser.add_argument("--sessions-per-block", type=int, default=12)
+    arg_parser.add_argument("--athletes", type=int, nargs="+", default=[1, 2, 4, 8])
+    arg_parser.add_argument("--writes", type=int, default=200, help="writes of every athlete")
+    arg_parser.add_argument("--json", help="also save results to this json file")
+    args = arg_parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        reference_db, workouts = build_database(tmp_dir, args.blocks, args.sessions_per_block)
+        print(f"{len(workouts)} workouts, {args.writes} log writes per athlete")
+
+        for n_athletes in args.athletes:
+            shared_db = tmp_dir / f"shared_{n_athletes}.db"
+            shutil.copy(reference_db, shared_db)
+            router = ShardRouter(tmp_dir / f"shards_{n_athletes}")
+            shards = []
+            for athlete in range(n_athletes):
+                shard = router.shard_path(f"athlete_{athlete}")
+                shard.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy(reference_db, shard)
+                shards.append(str(shard))
+
+            for mode, db_paths in [("shared", [str(shared_db)] * n_athletes),
+                                   ("sharded", shards)]:
+                results.append({"athletes": n_athletes, "mode": mode,
+                                **run(db_paths, workouts, args.writes)})
+
+    print(f"{'athletes':>9} {'mode':>8} {'writes/s':>9} {'errors':>7} {'p50 (ms)':>9} "
+          f"{'p95 (ms)':>9}")
+    for result in results:
+        print(f"{result['athletes']:>9} {result['mode']:>8} {result['writes_per_sec']:>9.0f} "
+              f"{result['errors']:>7} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"blocks": args.blocks, "sessions_per_block": args.sessions_per_block,
+                       "writes": args.writes, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Synthetic coach html exports with the same structure as the real ones in
+data/ ("div.dia" sessions with "titulo", fecha and "cuerpo-boxdia" /
+"ejercicio*" divs), and log workbooks filled from their Excel export, to
+benchmark the pipeline at any scale.
+
+Usage (from repo root):
+    python -m benchmarks.synthetic OUTPUT_DIR [--blocks 1000 --sessions-per-block 50]
+"""
+import argparse
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from openpyxl import Workbook, load_workbook
+
+
+EXERCISES = ["Sentadilla", "Sentadilla excéntrica 3\"", "Peso muerto", "Peso muerto rumano",
+             "Press banca", "Press militar", "Dominadas", "Remo con barra", "Hip thrust",
+             "Extensión de cuadriceps", "Curl femoral", "Face pull", "Fondos",
+             "Curl de bíceps", "Press francés", "Zancadas", "Elevaciones laterales"]
+WORKOUTS = ["Pierna", "Torso", "Empuje", "Tirón", "Full body"]
+# Columns of the set rows of the log workbooks (main.LOG_SET_COLS)
+LOG_COLUMNS = ["ID", "Ejercicio", "Serie", "Repeticiones", "Peso (kg)", "% 1RM",
+               "RPE mín.", "RPE máx.", "Descanso (min)", "¿Hecho?", "RPE", "Comentarios"]
+
+HEAD = """<!DOCTYPE html>
+<html>
+<head>
+\t<meta charset="utf-8">
+\t<meta name="description" content="App programa de ejercicios">
+</head>
+<body>
+\t<div id="wrap">
+\t\t<div id="main">
+\t\t\t\t<div id="microciclo">{name}</div>
+\t\t\t\t<div id="boxDiasTrabajo">
+\t\t\t\t\t<div class='contenedor-boxdias'>
+"""
+
+SESSION_HEAD = """\t\t\t\t\t\t<div id='{session_id}' class='dia'>
+\t\t\t\t\t\t\t<div class="titulo-dia"><div class="titulo">{workout_desc} </div></div>
+\t\t\t\t\t\t\t<div class="calendario-dia">
+\t\t\t\t\t\t\t\t<div id='dia' class='fecha'>{day}</div><div id='mes' class='fecha'>{month}</div><div id='anyo' class='fecha'>{year}</div>
+\t\t\t\t\t\t\t</div>
+\t\t\t\t\t\t\t<div class='cabecera-boxdia'>
+\t\t\t\t\t\t\t\t<div class='nombre'>Ejercicio</div>
+\t\t\t\t\t\t\t\t<div class='series'>Series</div>
+\t\t\t\t\t\t\t\t<div class='cargas'>Cargas</div>
+\t\t\t\t\t\t\t\t<div class='kilos'>Kilos</div>
+\t\t\t\t\t\t\t\t<div class='repeticiones'>Repeticiones</div>
+\t\t\t\t\t\t\t\t<div class='rpe'>RPE</div>
+\t\t\t\t\t\t\t\t<div class='descanso'>Descanso</div>
+\t\t\t\t\t\t\t</div>
+\t\t\t\t\t\t\t<div class="cuerpo-boxdia">
+"""
+
+EXERCISE = """\t\t\t\t\t\t\t\t<div class='ejercicio{exercise_id}'>
+\t\t\t\t\t\t\t\t\t<div class="nombre">{nombre}</div>
+\t\t\t\t\t\t\t\t\t<div class="series">{series}</div>
+\t\t\t\t\t\t\t\t\t<div class="cargas">{cargas} %</div>
+\t\t\t\t\t\t\t\t\t<div class="kilos">{kilos} Kg</div>
+\t\t\t\t\t\t\t\t\t<div class="repeticiones">{repeticiones}</div>
+\t\t\t\t\t\t\t\t\t<div class="rpe">{rpe}</div>
+\t\t\t\t\t\t\t\t\t<div class="descanso">{descanso} min</div>
+\t\t\t\t\t\t\t\t</div>
+"""
+
+SESSION_TAIL = """\t\t\t\t\t\t\t</div>
+\t\t\t\t\t\t</div>
+"""
+
+TAIL = """\t\t\t\t\t</div>
+\t\t\t\t<div id="descanso">DIA DE DESCANSO</div>
+\t\t\t\t</div>
+\t\t</div>
+\t</div>
+</body>
+</html>
+"""
+
+
+def random_sessions(n_sessions: int, start_date: date = date(2021, 1, 4),
+                    exercises_per_session: tuple = (4, 7), seed: int = 0):
+    """
+    Generates random sessions (one every other day from start_date).
+
+        Parameters:
+            n_sessions (int): number of sessions
+            start_date (date): date of first session
+            exercises_per_session (tuple): min and max exercises per session
+            seed (int): random seed, for reproducible files
+
+        Returns:
+            sessions (list): dicts with workout_desc, date_workout and
+                             exercises (raw html field values)
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(n_sessions):
+        exercises = []
+        for name in rng.sample(EXERCISES, rng.randint(*exercises_per_session)):
+            exercises.append({
+                "nombre": name,
+                "series": rng.randint(1, 6),
+                "cargas": rng.choice([0, 60, 65, 70, 75, 80, 85]),
+                "kilos": rng.choice([0, 10, 20, 40, 60, 80, 100, 120]),
+                "repeticiones": rng.randint(3, 15),
+                "rpe": rng.randint(5, 10),
+                "descanso": rng.choice([0, 1, 2, 3])
+            })
+        sessions.append({"workout_desc": rng.choice(WORKOUTS),
+                         "date_workout": start_date + timedelta(days=2 * i),
+                         "exercises": exercises})
+
+    return sessions
+
+
+def write_micro_html(output_file, sessions: list, name: str = None):
+    """
+    Writes sessions as a coach html export (microcycle).
+
+        Parameters:
+            output_file (str or path): html file to write
+            sessions (list): sessions as returned by random_sessions()
+            name (str): microcycle name (file stem by default)
+    """
+    output_file = Path(output_file)
+    exercise_id = 0
+    with open(output_file, "w") as f:
+        f.write(HEAD.format(name=name or output_file.stem))
+        for session_id, session in enumerate(sessions):
+            session_date = session["date_workout"]
+            f.write(SESSION_HEAD.format(session_id=session_id,
+                                        workout_desc=session["workout_desc"],
+                                        day=session_date.day,
+                                        month=session_date.month,
+                                        year=session_date.year))
+            for exercise in session["exercises"]:
+                exercise_id += 1
+                f.write(EXERCISE.format(exercise_id=exercise_id, **exercise))
+            f.write(SESSION_TAIL)
+        f.write(TAIL)
+
+
+def write_program_html(output_dir, n_blocks: int, sessions_per_block: int = 12,
+                       start_date: date = date(2021, 1, 4), seed: int = 0):
+    """
+    Writes a synthetic program: one html microcycle per block, with dates
+    following each other across blocks.
+
+        Parameters:
+            output_dir (str or path): directory to write the files into
+            n_blocks (int): number of blocks (files)
+            sessions_per_block (int): sessions of each block
+            start_date (date): date of first session of the program
+            seed (int): random seed, for reproducible files
+
+        Returns:
+            files (list): written html files, in block order
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for block in range(n_blocks):
+        sessions = random_sessions(sessions_per_block,
+                                   start_date + timedelta(days=2 * sessions_per_block * block),
+                                   seed=seed + block)
+        file = output_dir / f"Micro {block + 1:04d} Synthetic.html"
+        write_micro_html(file, sessions)
+        files.append(file)
+
+    return files
+
+
+def fill_log_workbook(program_file, output_file=None, done_ratio: float = 0.7, seed: int = 0):
+    """
+    Fills the log fields of a program workbook (as exported by
+    main.generate_program_excel()) as if the athlete had done the sessions.
+    Rows are streamed (read-only in, write-only out) so it works at any scale.
+
+        Parameters:
+            program_file (str or path): exported program .xlsx
+            output_file (str or path): filled log .xlsx (program_file itself
+                                       by default)
+            done_ratio (float): fraction of sets marked as done
+            seed (int): random seed, for reproducible files
+
+        Returns:
+            n_done (int): number of sets marked as done
+    """
+    rng = random.Random(seed)
+    program_file = Path(program_file)
+    output_file = Path(output_file or program_file)
+    tmp_file = output_file.with_name("~" + output_file.name)
+
+    book_in = load_workbook(program_file, read_only=True)
+    book_out = Workbook(write_only=True)
+    n_done = 0
+    for sheet_in in book_in.worksheets:
+        sheet_out = book_out.create_sheet(sheet_in.title)
+        columns = None
+        for row in sheet_in.iter_rows(values_only=True):
+            # Rows are only as wide as their last written cell
+            row = list(row) + [None] * (len(LOG_COLUMNS) - len(row))
+            if row[0] is None:
+                columns = None
+            elif row[0] == "ID":
+                columns = {column: i for i, column in enumerate(row)}
+            elif row[0] == "Duración (min)":
+                row[1] = rng.choice([None, 45, 60, 75, 90])
+            elif row[0] == "RPE general":
+                row[1] = rng.choice([None, 6, 7, 8, 9])
+            elif row[0] == "Comentario general":
+                row[1] = rng.choice([None, "Bien", "Cansado"])
+            elif columns and isinstance(row[0], int) and rng.random() < done_ratio:
+                row[columns["¿Hecho?"]] = "x"
+                row[columns["Repeticiones"]] = max(1, (row[columns["Repeticiones"]] or 8)
+                                                   + rng.randint(-2, 1))
+                row[columns["RPE"]] = rng.randint(5, 10)
+                if rng.random() < 0.1:
+                    row[columns["Comentarios"]] = "Técnica mejorable"
+                n_done += 1
+            sheet_out.append(row)
+    book_in.close()
+
+    book_out.save(tmp_file)
+    tmp_file.replace(output_file)
+
+    return n_done
+
+
+def main():
+    """Writes a synthetic program (html microcycles) at the given scale"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("output_dir", help="directory to write the html files into")
+    parser.add_argument("--blocks", type=int, default=10)
+    parser.add_argument("--sessions-per-block", type=int, default=12,
+                        help="~19 sets per session on average (50 --> ~1k sets per block)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = write_program_html(args.output_dir, args.blocks, args.sessions_per_block,
+                               seed=args.seed)
+    print(f"{len(files)} html files written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
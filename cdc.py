@@ -0,0 +1,354 @@
+"""
+Change data capture delta export, to keep a document-store mirror of the
+database in sync.
+
+Triggers (see migrations.change_triggers_ddl()) record every change of
+workout, workout_set, log_workout and log_set (and renames of blocks,
+programs and exercises) in change_log, with the workout it belongs to and
+an increasing sequence number. export_changes() turns the workouts changed
+since the checkpoint of a store into documents, a program --> block -->
+workout --> sets tree with their logs:
+
+    {"_id": "workout:12", "seq": 345, "program_id": 1, "program_desc": ...,
+     "block": {"block_id": 3, "block_desc": ...,
+               "workout": {"workout_id": 12, ..., "log": {...} or null,
+                           "sets": [{"workout_set_id": ..., "exercise_desc": ...,
+                                     "log": {...} or null}, ...]}}}
+
+({"_id": "workout:12", "seq": 345, "deleted": true} for deleted workouts),
+so keeping the mirror in sync costs O(changes) instead of O(database).
+Two stores stand in for the document database: a JSON-lines file and a
+SQLite database of JSON documents.
+"""
+from sqlalchemy import create_engine, select, text
+
+from models import (Program, Block, Workout, Workout_set, Exercise,
+                    Log_workout, Log_set, Change_log)
+from database import DB_PATH, get_session
+from instrumentation import timed
+
+from pathlib import Path
+import argparse
+import json
+import os
+
+
+# Workouts read per query
+CHUNK_SIZE = 500
+
+WORKOUT_COLUMNS = [Workout.workout_id, Workout.workout_desc, Workout.date_workout,
+                   Workout.week, Workout.day]
+SET_COLUMNS = [Workout_set.workout_set_id, Exercise.exercise_id, Exercise.exercise_desc,
+               Workout_set.set_id, Workout_set.no_reps, Workout_set.weight,
+               Workout_set.perc_rm, Workout_set.min_rpe, Workout_set.max_rpe,
+               Workout_set.rest_min]
+LOG_WORKOUT_COLUMNS = [Log_workout.log_workout_id, Log_workout.date_workout_done,
+                       Log_workout.duration_min, Log_workout.intensity,
+                       Log_workout.comment_workout]
+LOG_SET_COLUMNS = [Log_set.log_set_id, Log_set.no_reps_done, Log_set.weight_done,
+                   Log_set.rpe_done, Log_set.comment_set]
+
+
+def _document_id(workout_id: int):
+    return f"workout:{workout_id}"
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _fields(row, columns: list):
+    return {column.name: _json_value(value) for column, value in zip(columns, row)}
+
+
+def last_sequence(session):
+    """
+    Sequence number of the last change (0 if none), from sqlite_sequence
+    (change_log is AUTOINCREMENT): unlike max(change_id), it doesn't go
+    back when changes are pruned.
+    """
+    return session.execute(text("SELECT coalesce(max(seq), 0) FROM sqlite_sequence "
+                                "WHERE name = :table"),
+                           {"table": Change_log.__tablename__}).scalar()
+
+
+def changed_workouts(session, since: int, until: int):
+    """Ids of the workouts changed after sequence number since, up to until"""
+    return sorted(row[0] for row in session.execute(
+        select(Change_log.workout_id).distinct()
+        .where(Change_log.change_id > since, Change_log.change_id <= until,
+               Change_log.workout_id.is_not(None))
+    ))
+
+
+def workout_documents(session, workout_ids: list, seq: int):
+    """
+    Builds the documents of the given workouts, in three queries (workouts,
+    sets and log workouts) whatever their number.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            workout_ids (list): ids of the workouts (at most a few hundred,
+                                see CHUNK_SIZE)
+            seq (int): sequence number the documents are up to date with
+
+        Returns:
+            documents (list): documents in workout_ids order (deleted ones
+                              for workouts that no longer exist)
+    """
+    workouts = {
+        row[0]: row for row in session.execute(
+            select(*WORKOUT_COLUMNS, Block.block_id, Block.block_desc,
+                   Program.program_id, Program.program_desc)
+            .join(Block, Block.block_id == Workout.block_id)
+            .join(Program, Program.program_id == Block.program_id)
+            .where(Workout.workout_id.in_(workout_ids))
+        )
+    }
+    sets = {}
+    for row in session.execute(
+            select(Workout_set.workout_id, *SET_COLUMNS, *LOG_SET_COLUMNS)
+            .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+            .outerjoin(Log_set, Log_set.workout_set_id == Workout_set.workout_set_id)
+            .where(Workout_set.workout_id.in_(workout_ids))
+            .order_by(Workout_set.workout_set_id)):
+        workout_set = _fields(row[1:], SET_COLUMNS)
+        log_set = row[1 + len(SET_COLUMNS):]
+        workout_set["log"] = _fields(log_set, LOG_SET_COLUMNS) if log_set[0] is not None else None
+        sets.setdefault(row[0], []).append(workout_set)
+    logs = {
+        row[0]: _fields(row[1:], LOG_WORKOUT_COLUMNS) for row in session.execute(
+            select(Log_workout.workout_id, *LOG_WORKOUT_COLUMNS)
+            .where(Log_workout.workout_id.in_(workout_ids))
+        )
+    }
+
+    documents = []
+    for workout_id in workout_ids:
+        if workout_id not in workouts:
+            documents.append({"_id": _document_id(workout_id), "seq": seq, "deleted": True})
+            continue
+        row = workouts[workout_id]
+        workout = _fields(row, WORKOUT_COLUMNS)
+        workout["log"] = logs.get(workout_id)
+        workout["sets"] = sets.get(workout_id, [])
+        block_id, block_desc, program_id, program_desc = row[len(WORKOUT_COLUMNS):]
+        documents.append({"_id": _document_id(workout_id), "seq": seq,
+                          "program_id": program_id, "program_desc": program_desc,
+                          "block": {"block_id": block_id, "block_desc": block_desc,
+                                    "workout": workout}})
+
+    return documents
+
+
+class JsonLinesStore:
+    """
+    Mirror as a JSON-lines file: every export appends its documents (the
+    last one of an _id wins) and the checkpoint is kept in a side file,
+    written once the documents are on disk.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.checkpoint_path = self.path.with_name(self.path.name + ".checkpoint")
+
+    def checkpoint(self):
+        """Sequence number the mirror is up to date with (None if empty)"""
+        if not self.checkpoint_path.is_file():
+            return None
+        return json.loads(self.checkpoint_path.read_text())["seq"]
+
+    def write(self, documents: list, seq: int = None):
+        """Appends documents and moves the checkpoint to seq (if not None)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for document in documents:
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if seq is None:
+            return
+        tmp_path = self.checkpoint_path.with_name("~" + self.checkpoint_path.name)
+        tmp_path.write_text(json.dumps({"seq": seq}))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def reset(self):
+        self.path.unlink(missing_ok=True)
+        self.checkpoint_path.unlink(missing_ok=True)
+
+    def documents(self):
+        """Current documents of the mirror, by _id (replaying the file)"""
+        documents = {}
+        if self.path.is_file():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    document = json.loads(line)
+                    if document.get("deleted"):
+                        documents.pop(document["_id"], None)
+                    else:
+                        documents[document["_id"]] = document
+
+        return documents
+
+
+class SqliteJsonStore:
+    """
+    Mirror as a SQLite database of JSON documents (queryable with the JSON1
+    functions, e.g. json_extract(body, '$.block.workout.date_workout')):
+    documents are upserted (or deleted) and the checkpoint is updated in
+    the same transaction.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.engine = create_engine(f"sqlite:///{self.path}")
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE IF NOT EXISTS documents ("
+                                    "doc_id TEXT PRIMARY KEY, seq INTEGER NOT NULL, "
+                                    "body TEXT NOT NULL CHECK (json_valid(body)))"))
+            connection.execute(text("CREATE TABLE IF NOT EXISTS mirror_state ("
+                                    "name TEXT PRIMARY KEY, value INTEGER)"))
+
+    def checkpoint(self):
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text("SELECT value FROM mirror_state WHERE name = 'seq'")).scalar()
+
+    def write(self, documents: list, seq: int = None):
+        """Upserts/deletes documents and moves the checkpoint to seq (if not None)"""
+        upserts = [{"doc_id": document["_id"], "seq": document["seq"],
+                    "body": json.dumps(document, ensure_ascii=False)}
+                   for document in documents if not document.get("deleted")]
+        deletes = [{"doc_id": document["_id"]} for document in documents
+                   if document.get("deleted")]
+        with self.engine.begin() as connection:
+            if upserts:
+                connection.execute(text(
+                    "INSERT INTO documents (doc_id, seq, body) VALUES (:doc_id, :seq, :body) "
+                    "ON CONFLICT (doc_id) DO UPDATE SET seq = excluded.seq, body = excluded.body"
+                ), upserts)
+            if deletes:
+                connection.execute(text("DELETE FROM documents WHERE doc_id = :doc_id"), deletes)
+            if seq is None:
+                return
+            connection.execute(text(
+                "INSERT INTO mirror_state (name, value) VALUES ('seq', :seq) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value"
+            ), {"seq": seq})
+
+    def reset(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("DELETE FROM documents"))
+            connection.execute(text("DELETE FROM mirror_state"))
+
+    def documents(self):
+        with self.engine.connect() as connection:
+            return {doc_id: json.loads(body) for doc_id, body in connection.execute(
+                text("SELECT doc_id, body FROM documents"))}
+
+
+STORES = {"jsonl": JsonLinesStore, "sqlite": SqliteJsonStore}
+
+
+def open_store(spec: str):
+    """Store of a "jsonl:path" or "sqlite:path" spec"""
+    kind, _, path = spec.partition(":")
+    if kind not in STORES or not path:
+        raise KeyError(f"Unknown store ({spec})! Use one of "
+                       f"{[kind + ':PATH' for kind in STORES]}")
+
+    return STORES[kind](path)
+
+
+@timed()
+def export_changes(session, store, full: bool = False, chunk_size: int = CHUNK_SIZE):
+    """
+    Writes the documents of the workouts changed since the checkpoint of the
+    store (every workout if the store has no checkpoint, or full), chunk by
+    chunk, and moves the checkpoint forward with the last chunk.
+
+    The last sequence number is read before the documents, so a change
+    committed meanwhile is exported again next time (documents are
+    idempotent), never lost.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            store (JsonLinesStore or SqliteJsonStore)
+            full (bool): export every workout, whatever the checkpoint
+            chunk_size (int): workouts per query and write
+
+        Returns:
+            stats (dict): sequence numbers from and to, and documents
+                          written and deleted
+    """
+    since = None if full else store.checkpoint()
+    # The checkpoint never goes back
+    until = max(last_sequence(session), since or 0)
+    if since is None:
+        store.reset()
+        workout_ids = sorted(row[0] for row in session.execute(select(Workout.workout_id)))
+    else:
+        workout_ids = changed_workouts(session, since, until)
+
+    stats = {"from": since, "to": until, "written": 0, "deleted": 0}
+    for i in range(0, len(workout_ids), chunk_size):
+        documents = workout_documents(session, workout_ids[i:i + chunk_size], until)
+        # The checkpoint only moves (to until) with the last chunk, so an
+        # export that fails halfway starts again from the previous one (from
+        # scratch if full, the store has no checkpoint after reset())
+        last = i + chunk_size >= len(workout_ids)
+        store.write(documents, until if last else None)
+        n_deleted = sum(1 for document in documents if document.get("deleted"))
+        stats["deleted"] += n_deleted
+        stats["written"] += len(documents) - n_deleted
+    if not workout_ids and since != until:
+        store.write([], until)
+
+    return stats
+
+
+def prune_changes(session, seq: int):
+    """
+    Deletes the changes up to a sequence number (once every mirror is past
+    it) and commits.
+
+        Returns:
+            n_deleted (int): number of changes deleted
+    """
+    n_deleted = session.execute(
+        Change_log.__table__.delete().where(Change_log.change_id <= seq)
+    ).rowcount
+    session.commit()
+
+    return n_deleted
+
+
+def main():
+    """Exports the workouts changed since last export to a document store mirror"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export changes since the store checkpoint")
+    export.add_argument("store", help="jsonl:PATH (JSON-lines file) or sqlite:PATH "
+                                      "(SQLite JSON documents)")
+    export.add_argument("--full", action="store_true", help="export every workout again")
+    export.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    prune = commands.add_parser("prune", help="delete the changes stores are past")
+    prune.add_argument("stores", nargs="+", help="every store mirroring the database")
+    args = parser.parse_args()
+
+    session = get_session(args.db)
+    if args.command == "export":
+        stats = export_changes(session, open_store(args.store), args.full, args.chunk_size)
+        print(f"Changes {stats['from']} --> {stats['to']}: {stats['written']} documents "
+              f"written, {stats['deleted']} deleted")
+    else:
+        checkpoints = [open_store(spec).checkpoint() for spec in args.stores]
+        if None in checkpoints:
+            raise ValueError("Every store must have been exported once!")
+        print(f"{prune_changes(session, min(checkpoints))} changes pruned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Columnar export of the denormalized plan and log view (every workout_set
+with its exercise, workout, block and program, and its log_set/log_workout
+if done), partitioned by program and block:
+
+    output_dir/program_id=1/block_id=3/part-0.parquet (or .arrow)
+
+Parquet files are compressed, for analysis tools; Arrow IPC files are
+uncompressed so load_view() can memory-map them (zero-copy reads).
+Requires pyarrow (optional dependency of the project).
+"""
+from sqlalchemy import select
+
+from models import Program, Block, Workout, Workout_set, Exercise, Log_workout, Log_set
+from database import DB_PATH, get_session
+from instrumentation import timed
+
+from itertools import groupby
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+STATE_FILE = "_export_state.json"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Columns of the view: (name, column, arrow type)
+VIEW_COLUMNS = [
+    ("program_id", Program.program_id, "int64"),
+    ("program_desc", Program.program_desc, "string"),
+    ("block_id", Block.block_id, "int64"),
+    ("block_desc", Block.block_desc, "string"),
+    ("workout_id", Workout.workout_id, "int64"),
+    ("workout_desc", Workout.workout_desc, "string"),
+    ("date_workout", Workout.date_workout, "date32"),
+    ("week", Workout.week, "int64"),
+    ("day", Workout.day, "int64"),
+    ("workout_set_id", Workout_set.workout_set_id, "int64"),
+    ("exercise_id", Exercise.exercise_id, "int64"),
+    ("exercise_desc", Exercise.exercise_desc, "string"),
+    ("set_id", Workout_set.set_id, "int64"),
+    ("no_reps", Workout_set.no_reps, "int64"),
+    ("weight", Workout_set.weight, "float64"),
+    ("perc_rm", Workout_set.perc_rm, "float64"),
+    ("min_rpe", Workout_set.min_rpe, "int64"),
+    ("max_rpe", Workout_set.max_rpe, "int64"),
+    ("rest_min", Workout_set.rest_min, "float64"),
+    ("log_workout_id", Log_workout.log_workout_id, "int64"),
+    ("date_workout_done", Log_workout.date_workout_done, "date32"),
+    ("duration_min", Log_workout.duration_min, "float64"),
+    ("intensity", Log_workout.intensity, "float64"),
+    ("comment_workout", Log_workout.comment_workout, "string"),
+    ("log_set_id", Log_set.log_set_id, "int64"),
+    ("no_reps_done", Log_set.no_reps_done, "int64"),
+    ("weight_done", Log_set.weight_done, "float64"),
+    ("rpe_done", Log_set.rpe_done, "int64"),
+    ("comment_set", Log_set.comment_set, "string"),
+]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Columnar export needs pyarrow (pip install pyarrow)!")
+
+
+def view_schema():
+    """Arrow schema of the view"""
+    _require_pyarrow()
+    return pa.schema([(name, getattr(pa, arrow_type)()) for name, _, arrow_type in VIEW_COLUMNS])
+
+
+def view_select(program_ids=None):
+    """Ordered (by program, block and set) select of the view"""
+    stmt = (
+        select(*[column.label(name) for name, column, _ in VIEW_COLUMNS])
+        .select_from(Workout_set)
+        .join(Workout, Workout.workout_id == Workout_set.workout_id)
+        .join(Block, Block.block_id == Workout.block_id)
+        .join(Program, Program.program_id == Block.program_id)
+        .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .outerjoin(Log_set, Log_set.workout_set_id == Workout_set.workout_set_id)
+        .outerjoin(Log_workout, Log_workout.log_workout_id == Log_set.log_workout_id)
+        .order_by(Program.program_id, Block.block_id, Workout_set.workout_set_id)
+    )
+    if program_ids is not None:
+        stmt = stmt.where(Program.program_id.in_(program_ids))
+
+    return stmt
+
+
+def _partition_dir(output_dir: Path, program_id: int, block_id: int):
+    return output_dir / f"program_id={program_id}" / f"block_id={block_id}"
+
+
+def _remove_partitions(output_dir: Path, suffix: str):
+    """Removes the partition files of a format (e.g. after a format change)"""
+    for file in output_dir.glob(f"program_id=*/block_id=*/part-0{suffix}"):
+        file.unlink()
+
+
+def _write_partition(rows: list, schema, file: Path, file_format: str):
+    """Writes the rows of a block as one file (through a temp file)"""
+    table = pa.Table.from_pydict(
+        {name: [row[i] for row in rows] for i, name in enumerate(schema.names)}, schema
+    )
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_name("~" + file.name)
+    if file_format == "parquet":
+        pq.write_table(table, tmp_file)
+    else:
+        with pa.OSFile(str(tmp_file), "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+    os.replace(tmp_file, file)
+
+
+@timed()
+def export_view(session, output_dir, file_format: str = "parquet", incremental: bool = False,
+                program_ids=None):
+    """
+    Exports the view to one file per block, streaming the rows block by
+    block. Partitions of blocks no longer in the database are removed.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            output_dir (str or path): root directory of the partitions
+            file_format (str): "parquet" or "arrow" (IPC file)
+            incremental (bool): only rewrite blocks whose rows changed since
+                                the last export (a hash of the rows of every
+                                block is kept in output_dir/_export_state.json).
+                                The whole view is still read and hashed: it
+                                saves writes, not reads
+            program_ids (iterable): only export these programs
+
+        Returns:
+            stats (dict): number of blocks written, unchanged and removed,
+                          and rows written
+    """
+    _require_pyarrow()
+    if file_format not in FORMATS:
+        raise KeyError(f"Unknown file format ({file_format})! Use one of {list(FORMATS)}")
+
+    output_dir = Path(output_dir)
+    state_file = output_dir / STATE_FILE
+    state = {"format": file_format, "blocks": {}}
+    if state_file.is_file():
+        previous = json.loads(state_file.read_text())
+        # Hashes are only valid for files of the same format
+        if previous.get("format") == file_format:
+            state = previous
+        else:
+            _remove_partitions(output_dir, FORMATS[previous["format"]])
+    exported = dict(state["blocks"]) if incremental else {}
+
+    schema = view_schema()
+    file_name = "part-0" + FORMATS[file_format]
+    stats = {"written": 0, "unchanged": 0, "removed": 0, "rows": 0}
+    seen = set()
+    result = session.execute(view_select(program_ids))
+    for (program_id, block_id), rows in groupby(result, key=lambda row: (row[0], row[2])):
+        rows = [tuple(row) for row in rows]
+        key = f"{program_id}/{block_id}"
+        seen.add(key)
+        rows_hash = hashlib.sha256(repr(rows).encode()).hexdigest()
+        file = _partition_dir(output_dir, program_id, block_id) / file_name
+        if exported.get(key) == rows_hash and file.is_file():
+            stats["unchanged"] += 1
+            continue
+        _write_partition(rows, schema, file, file_format)
+        state["blocks"][key] = rows_hash
+        stats["written"] += 1
+        stats["rows"] += len(rows)
+
+    # Blocks deleted (or emptied) since last export
+    for key in list(state["blocks"]):
+        program_id, block_id = key.split("/")
+        if key in seen or (program_ids is not None and int(program_id) not in program_ids):
+            continue
+        shutil.rmtree(_partition_dir(output_dir, program_id, block_id), ignore_errors=True)
+        del state["blocks"][key]
+        stats["removed"] += 1
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_file.write_text(json.dumps(state, indent=2))
+
+    return stats
+
+
+def load_view(output_dir, program_ids=None, block_ids=None, columns: list = None):
+    """
+    Loads exported partitions (of the format of the last export) as one
+    Arrow table. Arrow IPC files are memory-mapped, so their columns are
+    read without copies (the OS pages in only what is used); Parquet files
+    are decoded from a memory map.
+
+        Parameters:
+            output_dir (str or path): root directory of the partitions
+            program_ids (iterable): only load these programs
+            block_ids (iterable): only load these blocks
+            columns (list): only load these columns
+
+        Returns:
+            table (pyarrow.Table): view rows, in program, block and set order
+    """
+    _require_pyarrow()
+    program_ids = set(program_ids) if program_ids is not None else None
+    block_ids = set(block_ids) if block_ids is not None else None
+
+    output_dir = Path(output_dir)
+    state_file = output_dir / STATE_FILE
+    suffixes = set(FORMATS.values())
+    if state_file.is_file():
+        suffixes = {FORMATS[json.loads(state_file.read_text())["format"]]}
+
+    tables = []
+    partitions = []
+    for file in output_dir.glob("program_id=*/block_id=*/part-0.*"):
+        if file.suffix not in suffixes:
+            continue
+        program_id, block_id = (int(part.split("=")[1]) for part in file.parts[-3:-1])
+        if ((program_ids is None or program_id in program_ids)
+                and (block_ids is None or block_id in block_ids)):
+            partitions.append((program_id, block_id, file))
+
+    for _, _, file in sorted(partitions):
+        if file.suffix == FORMATS["arrow"]:
+            with pa.memory_map(str(file)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+        else:
+            table = pq.ParquetFile(file, memory_map=True).read(columns=columns)
+        tables.append(table)
+
+    if not tables:
+        schema = view_schema()
+        return schema.empty_table() if columns is None else schema.empty_table().select(columns)
+
+    return pa.concat_tables(tables)
+
+
+def main():
+    """Exports the plan and log view to partitioned Parquet/Arrow files"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--output-dir", default="data/columnar",
+                        help="root directory of the partitions")
+    parser.add_argument("--format", default="parquet", choices=list(FORMATS))
+    parser.add_argument("--incremental", action="store_true",
+                        help="only rewrite blocks changed since last export")
+    parser.add_argument("--program", type=int, nargs="+", dest="program_ids",
+                        help="only export these program ids")
+    args = parser.parse_args()
+
+    stats = export_view(get_session(args.db, "serving", read_only=True), args.output_dir,
+                        args.format, args.incremental, args.program_ids)
+    print(f"{stats['written']} blocks written ({stats['rows']} rows), "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed")
+
+
+if __name__ == "__main__":
+    main()
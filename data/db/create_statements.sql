@@ -31,6 +31,14 @@ CREATE TABLE exercise (
     exercise_desc VARCHAR NOT NULL
 );
 
+CREATE TABLE exercise_alias (
+    alias_id INTEGER NOT NULL PRIMARY KEY,
+    alias_desc VARCHAR NOT NULL,
+    exercise_id INTEGER NOT NULL REFERENCES exercise ON DELETE CASCADE,
+    similarity REAL,
+    date_reg DATE NOT NULL DEFAULT (DATE('now'))
+);
+
 CREATE TABLE workout_set (
     workout_set_id INTEGER NOT NULL PRIMARY KEY,
     workout_id INTEGER NOT NULL REFERENCES workout ON DELETE CASCADE,
@@ -75,6 +83,7 @@ CREATE TABLE historic_pr (
     exercise_id INTEGER NOT NULL REFERENCES exercise,
     no_reps_pr INTEGER NOT NULL CHECK (no_reps_pr > 0),
     weight_pr REAL NOT NULL CHECK (weight_pr > 0),
+    estimated_1rm REAL,
     date_reg DATE NOT NULL DEFAULT (DATE('now')),
     CHECK ( date_pr <= date_reg )
 );
@@ -89,3 +98,166 @@ CREATE TABLE exercise_muscle (
     exercise_id INTEGER NOT NULL REFERENCES exercise ON DELETE CASCADE,
     muscle_id INTEGER NOT NULL REFERENCES muscle ON DELETE CASCADE
 );
+
+CREATE TABLE ingest_manifest (
+    manifest_id INTEGER NOT NULL PRIMARY KEY,
+    file_path VARCHAR UNIQUE NOT NULL,
+    content_hash VARCHAR NOT NULL,
+    mtime REAL NOT NULL,
+    block_id INTEGER REFERENCES block ON DELETE SET NULL
+);
+
+CREATE TABLE log_sheet_manifest (
+    sheet_manifest_id INTEGER NOT NULL PRIMARY KEY,
+    block_id INTEGER UNIQUE NOT NULL REFERENCES block ON DELETE CASCADE,
+    sheet_crc INTEGER NOT NULL,
+    next_date DATE
+);
+
+CREATE INDEX ix_program_program_desc ON program (program_desc);
+CREATE INDEX ix_block_program_id_block_desc ON block (program_id, block_desc);
+CREATE UNIQUE INDEX ix_exercise_exercise_desc ON exercise (exercise_desc);
+CREATE UNIQUE INDEX ix_exercise_alias_alias_desc ON exercise_alias (alias_desc);
+CREATE INDEX ix_workout_set_workout_id ON workout_set (workout_id);
+CREATE INDEX ix_workout_set_exercise_id ON workout_set (exercise_id);
+CREATE INDEX ix_log_set_log_workout_id ON log_set (log_workout_id);
+
+-- Trigram index of exercise names and aliases (exercise_matching.py)
+CREATE VIRTUAL TABLE exercise_search USING fts5(name, exercise_id UNINDEXED, tokenize = 'trigram');
+
+CREATE TRIGGER exercise_search_exercise_insert AFTER INSERT ON exercise BEGIN
+    INSERT INTO exercise_search (name, exercise_id) VALUES (NEW.exercise_desc, NEW.exercise_id);
+END;
+
+CREATE TRIGGER exercise_search_exercise_update AFTER UPDATE ON exercise BEGIN
+    DELETE FROM exercise_search WHERE exercise_id = OLD.exercise_id AND name = OLD.exercise_desc;
+    INSERT INTO exercise_search (name, exercise_id) VALUES (NEW.exercise_desc, NEW.exercise_id);
+END;
+
+CREATE TRIGGER exercise_search_exercise_delete AFTER DELETE ON exercise BEGIN
+    DELETE FROM exercise_search WHERE exercise_id = OLD.exercise_id AND name = OLD.exercise_desc;
+END;
+
+CREATE TRIGGER exercise_search_exercise_alias_insert AFTER INSERT ON exercise_alias BEGIN
+    INSERT INTO exercise_search (name, exercise_id) VALUES (NEW.alias_desc, NEW.exercise_id);
+END;
+
+CREATE TRIGGER exercise_search_exercise_alias_update AFTER UPDATE ON exercise_alias BEGIN
+    DELETE FROM exercise_search WHERE exercise_id = OLD.exercise_id AND name = OLD.alias_desc;
+    INSERT INTO exercise_search (name, exercise_id) VALUES (NEW.alias_desc, NEW.exercise_id);
+END;
+
+CREATE TRIGGER exercise_search_exercise_alias_delete AFTER DELETE ON exercise_alias BEGIN
+    DELETE FROM exercise_search WHERE exercise_id = OLD.exercise_id AND name = OLD.alias_desc;
+END;
+
+CREATE TABLE exercise_week_summary (
+    exercise_week_summary_id INTEGER NOT NULL PRIMARY KEY,
+    exercise_id INTEGER NOT NULL REFERENCES exercise ON DELETE CASCADE,
+    week_start DATE NOT NULL,
+    planned_sets INTEGER NOT NULL DEFAULT 0,
+    planned_reps INTEGER NOT NULL DEFAULT 0,
+    planned_tonnage REAL NOT NULL DEFAULT 0,
+    done_sets INTEGER NOT NULL DEFAULT 0,
+    done_reps INTEGER NOT NULL DEFAULT 0,
+    done_tonnage REAL NOT NULL DEFAULT 0,
+    done_rpe_sum REAL NOT NULL DEFAULT 0,
+    done_rpe_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(exercise_id, week_start) ON CONFLICT ABORT
+);
+
+CREATE TABLE block_summary (
+    block_summary_id INTEGER NOT NULL PRIMARY KEY,
+    block_id INTEGER UNIQUE NOT NULL REFERENCES block ON DELETE CASCADE,
+    planned_sets INTEGER NOT NULL DEFAULT 0,
+    planned_reps INTEGER NOT NULL DEFAULT 0,
+    planned_tonnage REAL NOT NULL DEFAULT 0,
+    done_sets INTEGER NOT NULL DEFAULT 0,
+    done_reps INTEGER NOT NULL DEFAULT 0,
+    done_tonnage REAL NOT NULL DEFAULT 0,
+    done_rpe_sum REAL NOT NULL DEFAULT 0,
+    done_rpe_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE muscle_week_summary (
+    muscle_week_summary_id INTEGER NOT NULL PRIMARY KEY,
+    muscle_id INTEGER NOT NULL REFERENCES muscle ON DELETE CASCADE,
+    week_start DATE NOT NULL,
+    planned_sets INTEGER NOT NULL DEFAULT 0,
+    planned_reps INTEGER NOT NULL DEFAULT 0,
+    planned_tonnage REAL NOT NULL DEFAULT 0,
+    done_sets INTEGER NOT NULL DEFAULT 0,
+    done_reps INTEGER NOT NULL DEFAULT 0,
+    done_tonnage REAL NOT NULL DEFAULT 0,
+    done_rpe_sum REAL NOT NULL DEFAULT 0,
+    done_rpe_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(muscle_id, week_start) ON CONFLICT ABORT
+);
+
+CREATE TABLE change_log (
+    change_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    table_name VARCHAR NOT NULL,
+    row_id INTEGER NOT NULL,
+    workout_id INTEGER,
+    operation VARCHAR(1) NOT NULL CHECK (operation IN ('I', 'U', 'D'))
+);
+
+CREATE TRIGGER change_log_workout_insert AFTER INSERT ON workout BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout', NEW.workout_id, NEW.workout_id, 'I');
+END;
+
+CREATE TRIGGER change_log_workout_update AFTER UPDATE ON workout WHEN OLD.workout_id IS NOT NEW.workout_id OR OLD.workout_desc IS NOT NEW.workout_desc OR OLD.block_id IS NOT NEW.block_id OR OLD.date_workout IS NOT NEW.date_workout OR OLD.week IS NOT NEW.week OR OLD.day IS NOT NEW.day BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout', NEW.workout_id, NEW.workout_id, 'U');
+END;
+
+CREATE TRIGGER change_log_workout_delete AFTER DELETE ON workout BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout', OLD.workout_id, OLD.workout_id, 'D');
+END;
+
+CREATE TRIGGER change_log_workout_set_insert AFTER INSERT ON workout_set BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout_set', NEW.workout_set_id, NEW.workout_id, 'I');
+END;
+
+CREATE TRIGGER change_log_workout_set_update AFTER UPDATE ON workout_set WHEN OLD.workout_set_id IS NOT NEW.workout_set_id OR OLD.workout_id IS NOT NEW.workout_id OR OLD.exercise_id IS NOT NEW.exercise_id OR OLD.set_id IS NOT NEW.set_id OR OLD.no_reps IS NOT NEW.no_reps OR OLD.weight IS NOT NEW.weight OR OLD.perc_rm IS NOT NEW.perc_rm OR OLD.min_rpe IS NOT NEW.min_rpe OR OLD.max_rpe IS NOT NEW.max_rpe OR OLD.rest_min IS NOT NEW.rest_min BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout_set', NEW.workout_set_id, NEW.workout_id, 'U');
+END;
+
+CREATE TRIGGER change_log_workout_set_delete AFTER DELETE ON workout_set BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('workout_set', OLD.workout_set_id, OLD.workout_id, 'D');
+END;
+
+CREATE TRIGGER change_log_log_workout_insert AFTER INSERT ON log_workout BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_workout', NEW.log_workout_id, NEW.workout_id, 'I');
+END;
+
+CREATE TRIGGER change_log_log_workout_update AFTER UPDATE ON log_workout WHEN OLD.log_workout_id IS NOT NEW.log_workout_id OR OLD.workout_id IS NOT NEW.workout_id OR OLD.date_workout_done IS NOT NEW.date_workout_done OR OLD.duration_min IS NOT NEW.duration_min OR OLD.intensity IS NOT NEW.intensity OR OLD.comment_workout IS NOT NEW.comment_workout BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_workout', NEW.log_workout_id, NEW.workout_id, 'U');
+END;
+
+CREATE TRIGGER change_log_log_workout_delete AFTER DELETE ON log_workout BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_workout', OLD.log_workout_id, OLD.workout_id, 'D');
+END;
+
+CREATE TRIGGER change_log_log_set_insert AFTER INSERT ON log_set BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_set', NEW.log_set_id, (SELECT workout_id FROM workout_set WHERE workout_set_id = NEW.workout_set_id), 'I');
+END;
+
+CREATE TRIGGER change_log_log_set_update AFTER UPDATE ON log_set WHEN OLD.log_set_id IS NOT NEW.log_set_id OR OLD.workout_set_id IS NOT NEW.workout_set_id OR OLD.log_workout_id IS NOT NEW.log_workout_id OR OLD.no_reps_done IS NOT NEW.no_reps_done OR OLD.weight_done IS NOT NEW.weight_done OR OLD.rpe_done IS NOT NEW.rpe_done OR OLD.comment_set IS NOT NEW.comment_set BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_set', NEW.log_set_id, (SELECT workout_id FROM workout_set WHERE workout_set_id = NEW.workout_set_id), 'U');
+END;
+
+CREATE TRIGGER change_log_log_set_delete AFTER DELETE ON log_set BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) VALUES ('log_set', OLD.log_set_id, (SELECT workout_id FROM workout_set WHERE workout_set_id = OLD.workout_set_id), 'D');
+END;
+
+CREATE TRIGGER change_log_block_update AFTER UPDATE ON block WHEN OLD.block_desc IS NOT NEW.block_desc OR OLD.program_id IS NOT NEW.program_id BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) SELECT 'block', NEW.block_id, workout_id, 'U' FROM workout WHERE block_id = NEW.block_id;
+END;
+
+CREATE TRIGGER change_log_program_update AFTER UPDATE ON program WHEN OLD.program_desc IS NOT NEW.program_desc BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) SELECT 'program', NEW.program_id, workout_id, 'U' FROM workout JOIN block USING (block_id) WHERE block.program_id = NEW.program_id;
+END;
+
+CREATE TRIGGER change_log_exercise_update AFTER UPDATE ON exercise WHEN OLD.exercise_desc IS NOT NEW.exercise_desc BEGIN
+    INSERT INTO change_log (table_name, row_id, workout_id, operation) SELECT DISTINCT 'exercise', NEW.exercise_id, workout_id, 'U' FROM workout_set WHERE exercise_id = NEW.exercise_id;
+END;
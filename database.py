@@ -0,0 +1,125 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from functools import lru_cache
+from pathlib import Path
+
+
+DB_PATH = "data/db/gym_database.db"
+
+# PRAGMAs applied to every new connection of each engine profile
+PROFILES = {
+    # Durability first (commits are fsync'ed)
+    "safe": {
+        "foreign_keys": "ON",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    # Big imports: no fsync (safe against application crashes only; an OS
+    # crash or power loss can corrupt the database, so re-run the import from
+    # the source files) and a large page cache (256 MB)
+    "bulk_load": {
+        "journal_mode": "WAL",
+        "foreign_keys": "ON",
+        "synchronous": "OFF",
+        "cache_size": -262144,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    # Readers don't block on the writer (WAL) and pages are memory-mapped
+    "serving": {
+        "journal_mode": "WAL",
+        "foreign_keys": "ON",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "busy_timeout": 5000,
+    },
+}
+
+# Profile used by each stage of the pipeline in main.py
+STAGE_PROFILES = {
+    "ingest": "bulk_load",
+    "export": "serving",
+    "sync_logs": "serving",
+}
+
+
+def profile_pragmas(profile: str = "safe", read_only: bool = False):
+    """Returns the PRAGMAs of an engine profile (see PROFILES) as a dict"""
+    if profile not in PROFILES:
+        raise KeyError(f"Unknown engine profile ({profile})! Use one of {list(PROFILES)}")
+
+    pragmas = dict(PROFILES[profile])
+    if read_only:
+        # journal_mode can't be changed from a read-only connection
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = "ON"
+
+    return pragmas
+
+
+def database_url(db_path: str = DB_PATH, read_only: bool = False, driver: str = "sqlite"):
+    """Returns the URL of a SQLite database file (read-only URI if asked)"""
+    if read_only:
+        return f"{driver}:///file:{Path(db_path).as_posix()}?mode=ro&uri=true"
+
+    return f"{driver}:///{db_path}"
+
+
+def listen_pragmas(engine, pragmas: dict):
+    """Sets the pragmas on every new DBAPI connection of the engine"""
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+
+def create_sqlite_engine(db_path: str = DB_PATH, profile: str = "safe",
+                         read_only: bool = False):
+    """
+    Returns a new engine of a SQLite database tuned with a profile.
+
+        Parameters:
+            db_path (str): SQLite database file
+            profile (str): "safe", "bulk_load" or "serving" (see PROFILES)
+            read_only (bool): open connections in read-only mode (any number
+                              of them can read concurrently with a WAL db)
+
+        Returns:
+            engine (SQLAlchemy.engine object)
+    """
+    pragmas = profile_pragmas(profile, read_only)
+
+    # Pooled connections, so pragmas (and mmap) are set once per connection
+    engine = create_engine(database_url(db_path, read_only), poolclass=QueuePool,
+                           connect_args={"check_same_thread": False})
+    listen_pragmas(engine, pragmas)
+
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_engine(db_path: str = DB_PATH, profile: str = "safe", read_only: bool = False):
+    """Returns the (cached) engine of create_sqlite_engine()"""
+    return create_sqlite_engine(db_path, profile, read_only)
+
+
+def get_session(db_path: str = DB_PATH, profile: str = "safe", read_only: bool = False):
+    """
+    Returns a new session bound to the engine of get_engine().
+
+        Parameters:
+            db_path (str): SQLite database file
+            profile (str): engine profile (see PROFILES)
+            read_only (bool): read-only connections
+
+        Returns:
+            session (SQLAlchemy.session object)
+    """
+    Session = sessionmaker(bind=get_engine(db_path, profile, read_only))
+
+    return Session()
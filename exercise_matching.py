@@ -0,0 +1,276 @@
+"""
+Approximate matching of exercise names, so spelling variants of the coach
+html files ("apertura"/"aperturas", "extensión"/"extension", "exc3\""/
+"exc 3\""...) are merged into one canonical exercise instead of adding new
+ones to the Exercise lookup table.
+
+Exercise names and aliases are indexed in an FTS5 table with the trigram
+tokenizer (kept up to date by triggers), which returns a few candidates
+sharing trigrams with a name; they are scored by trigram similarity of
+their normalized names (lowercase, no accents), refusing names with
+different numbers ("+10kg" vs "+15kg", "30\"" vs "40\""). A name matching
+an exercise above the threshold is recorded as an alias of it.
+"""
+from sqlalchemy import select, func, text, inspect
+
+from models import (Exercise, Exercise_alias, Workout_set, Historic_pr, exercise_muscle,
+                    Exercise_week_summary)
+from database import DB_PATH, get_engine, get_session
+from migrations import SEARCH_TABLE, create_indexes
+from lookup_cache import get_lookup_cache
+from summaries import rebuild_summaries
+
+from functools import lru_cache
+import argparse
+import re
+import unicodedata
+
+
+# Minimum similarity to merge a name into an exercise: high enough to
+# merge only spelling variants (accents, spaces, plurals...), as different
+# exercises may differ in one word ("hiperextensiones libres 15º" and
+# "hiperextensiones 15º" score 0.78)
+MATCH_THRESHOLD = 0.85
+_SEARCH = text(f"SELECT exercise_id, name FROM {SEARCH_TABLE} "
+               f"WHERE {SEARCH_TABLE} MATCH :query")
+_NUMBERS = re.compile(r"\d+")
+
+
+def normalize_name(name: str):
+    """Lowercase name without accents and with single spaces"""
+    name = unicodedata.normalize("NFKD", name.lower())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+
+    return " ".join(name.split())
+
+
+@lru_cache(maxsize=4096)
+def _features(name: str):
+    """Normalized name, its numbers and its trigrams (padded as a word)"""
+    name = normalize_name(name)
+    padded = f"  {name} "
+
+    return (name, sorted(_NUMBERS.findall(name)),
+            frozenset(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+def similarity(name: str, other: str):
+    """
+    Trigram similarity (Jaccard index of their trigram sets, 0 to 1) of two
+    normalized names; 0 if their numbers differ.
+    """
+    name, name_numbers, name_trigrams = _features(name)
+    other, other_numbers, other_trigrams = _features(other)
+    if name == other:
+        return 1.0
+    if name_numbers != other_numbers:
+        return 0.0
+
+    return len(name_trigrams & other_trigrams) / len(name_trigrams | other_trigrams)
+
+
+def _has_search_index(session):
+    if "exercise_search" not in session.info:
+        session.info["exercise_search"] = inspect(session.get_bind()).has_table(SEARCH_TABLE)
+
+    return session.info["exercise_search"]
+
+
+def candidates(session, name: str):
+    """
+    Exercise names and aliases sharing some trigram with a name (every one
+    of them if there is no index). They aren't ranked by the index (bm25
+    takes longer than scoring them all with similarity()).
+
+        Returns:
+            rows (list): (exercise_id, name) rows
+    """
+    if not _has_search_index(session):
+        return session.execute(
+            select(Exercise.exercise_id, Exercise.exercise_desc)
+            .union_all(select(Exercise_alias.exercise_id, Exercise_alias.alias_desc))
+        ).all()
+
+    # Unpadded trigrams (as the tokenizer splits the indexed names) of the
+    # name as is and normalized, quoted as FTS5 strings
+    trigrams = set()
+    for variant in (name.lower(), normalize_name(name)):
+        trigrams.update(variant[i:i + 3] for i in range(len(variant) - 2))
+    if not trigrams:
+        return []
+    query = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in sorted(trigrams))
+
+    return session.execute(_SEARCH, {"query": query}).all()
+
+
+def match_exercise(session, name: str, threshold: float = MATCH_THRESHOLD,
+                   exercise_ids=None):
+    """
+    Finds the exercise a name is most similar to.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            name (str): exercise name
+            threshold (float): minimum similarity (0 to 1)
+            exercise_ids (set): only match these exercises
+
+        Returns:
+            match (tuple): (exercise_id, matched name, similarity) of the best
+                           match, None if no exercise reaches the threshold
+    """
+    best = None
+    for exercise_id, candidate in candidates(session, name):
+        if exercise_ids is not None and exercise_id not in exercise_ids:
+            continue
+        score = similarity(name, candidate)
+        if score >= threshold and (best is None or (-score, exercise_id) < (-best[2], best[0])):
+            best = (exercise_id, candidate, score)
+
+    return best
+
+
+def resolve_new_names(session, names, threshold: float = MATCH_THRESHOLD):
+    """
+    Resolves names not found as exercises or aliases: each one is merged
+    into its best match (as a new alias) or inserted as a new exercise, one
+    by one, so variants of each other in the same batch are merged too.
+    Every alias created is appended to session.info["exercise_aliases"], as
+    (alias, exercise_id, matched name, similarity), for the caller to report.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            names (iterable): exercise descriptions
+            threshold (float): minimum similarity to merge a name
+
+        Returns:
+            exercise_ids (dict): map name --> exercise_id
+    """
+    cache = get_lookup_cache(session)
+    aliases = session.info.setdefault("exercise_aliases", [])
+    exercise_ids = {}
+    for name in sorted(names):
+        match = match_exercise(session, name, threshold)
+        if match is not None:
+            exercise_ids[name] = match[0]
+            session.execute(Exercise_alias.__table__.insert().values(
+                alias_desc=name, exercise_id=match[0], similarity=match[2]
+            ))
+            aliases.append((name, *match))
+        else:
+            exercise_ids[name] = session.execute(
+                Exercise.__table__.insert().values(exercise_desc=name)
+            ).inserted_primary_key[0]
+            cache.put(("exercise", name), exercise_ids[name])
+
+    return exercise_ids
+
+
+def find_variants(session, threshold: float = MATCH_THRESHOLD):
+    """
+    Finds exercises of the table that are variants of another one. They are
+    visited from the most used (more sets) to the least, and each one either
+    is kept as canonical or is a variant of its best match among the
+    canonical ones visited before.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            threshold (float): minimum similarity to merge two exercises
+
+        Returns:
+            merges (list): (variant_id, variant_desc, exercise_id,
+                           exercise_desc, similarity) of every variant
+    """
+    exercises = session.execute(
+        select(Exercise.exercise_id, Exercise.exercise_desc)
+        .outerjoin(Workout_set, Workout_set.exercise_id == Exercise.exercise_id)
+        .group_by(Exercise.exercise_id)
+        .order_by(func.count(Workout_set.workout_set_id).desc(), Exercise.exercise_id)
+    ).all()
+
+    canonical, merges = {}, []
+    for exercise_id, exercise_desc in exercises:
+        match = match_exercise(session, exercise_desc, threshold, set(canonical))
+        if match is None:
+            canonical[exercise_id] = exercise_desc
+        else:
+            merges.append((exercise_id, exercise_desc, match[0], canonical[match[0]], match[2]))
+
+    return merges
+
+
+def merge_exercises(session, merges: list):
+    """
+    Merges exercises into others: their sets, personal records, muscles and
+    aliases are moved to the canonical exercise, their name becomes an alias
+    of it and they are deleted. Volume summaries are rebuilt and everything
+    is committed.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            merges (list): as returned by find_variants()
+
+        Returns:
+            n_merged (int): number of exercises merged
+    """
+    try:
+        for variant_id, variant_desc, exercise_id, _, score in merges:
+            for table in (Workout_set.__table__, Historic_pr.__table__,
+                          Exercise_alias.__table__):
+                session.execute(table.update()
+                                .where(table.c.exercise_id == variant_id)
+                                .values(exercise_id=exercise_id))
+            # Muscles of the variant the exercise doesn't have yet
+            muscle_ids = select(exercise_muscle.c.muscle_id).where(
+                exercise_muscle.c.exercise_id == exercise_id)
+            session.execute(exercise_muscle.update()
+                            .where(exercise_muscle.c.exercise_id == variant_id,
+                                   exercise_muscle.c.muscle_id.not_in(muscle_ids))
+                            .values(exercise_id=exercise_id))
+            # Summaries are rebuilt below
+            for table in (exercise_muscle, Exercise_week_summary.__table__):
+                session.execute(table.delete().where(table.c.exercise_id == variant_id))
+            session.execute(Exercise.__table__.delete()
+                            .where(Exercise.exercise_id == variant_id))
+            session.execute(Exercise_alias.__table__.insert().values(
+                alias_desc=variant_desc, exercise_id=exercise_id, similarity=score
+            ))
+        # Exercise week summaries of the merged exercises
+        rebuild_summaries(session)
+    except Exception:
+        session.rollback()
+        raise
+
+    return len(merges)
+
+
+def main():
+    """Approximate matching of exercise names and merging of variants"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD,
+                        help="minimum similarity (0 to 1)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    match = commands.add_parser("match", help="show the exercise each name would be merged into")
+    match.add_argument("names", nargs="+")
+    merge = commands.add_parser("merge", help="merge variants of the exercise table")
+    merge.add_argument("--dry-run", action="store_true", help="only list the merges")
+    args = parser.parse_args()
+
+    create_indexes(get_engine(args.db))
+    session = get_session(args.db)
+    if args.command == "match":
+        for name in args.names:
+            match = match_exercise(session, name, args.threshold)
+            print(f"{name} --> " + (f"{match[1]} (id {match[0]}, {match[2]:.2f})"
+                                    if match else "new exercise"))
+    else:
+        merges = find_variants(session, args.threshold)
+        for variant_id, variant_desc, exercise_id, exercise_desc, score in merges:
+            print(f"{variant_desc} ({variant_id}) --> {exercise_desc} ({exercise_id}): "
+                  f"{score:.2f}")
+        if not args.dry_run:
+            print(f"{merge_exercises(session, merges)} exercises merged")
+
+
+if __name__ == "__main__":
+    main()
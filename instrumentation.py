@@ -0,0 +1,256 @@
+"""
+Pipeline instrumentation: wall time of every stage of main.py, SQL
+statements (count, rows and time, grouped by normalized statement) and ORM
+flushes, reported to console or as json, with an optional cProfile dump.
+
+Switched on with the --profile flag of main.py or the GYM_PROFILE
+environment variable ("console" or "json"; GYM_PROFILE_OUTPUT and
+GYM_CPROFILE set the report and cProfile files). When off, the stage
+timers only cost a global lookup.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import inspect
+import json
+import os
+import re
+import time
+
+
+# Profiler collecting the measures (None when instrumentation is off)
+_active = None
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LISTS = re.compile(r"\bIN \(\?(?:, \?)+\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str):
+    """Statement with literals replaced and IN (?, ?, ...) lists collapsed"""
+    statement = _SPACES.sub(" ", statement).strip()
+    statement = _LITERALS.sub("?", statement)
+    return _PARAM_LISTS.sub("IN (?, ...)", statement)
+
+
+class Profiler:
+    """Measures of one instrumented run"""
+
+    def __init__(self, cprofile_file=None):
+        self.stages = {}
+        self.statements = {}
+        self.cprofile_file = cprofile_file
+        self._cprofile = cProfile.Profile() if cprofile_file else None
+        self._start = None
+
+    def add_stage(self, name: str, seconds: float):
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+
+    def add_statement(self, statement: str, rows: int, seconds: float):
+        measure = self.statements.setdefault(normalize_statement(statement),
+                                             {"count": 0, "rows": 0, "seconds": 0.0})
+        measure["count"] += 1
+        measure["rows"] += rows
+        measure["seconds"] += seconds
+
+    def report(self, top: int = 20):
+        """
+        Returns the measures as a dict: total seconds, stages (inclusive time,
+        nested stages are also counted in their callers) and the top
+        statements by time.
+        """
+        statements = sorted(self.statements.items(), key=lambda item: -item[1]["seconds"])
+        return {
+            "seconds": time.perf_counter() - self._start if self._start else 0.0,
+            "stages": dict(sorted(self.stages.items(), key=lambda item: -item[1]["seconds"])),
+            "sql": {
+                "statements": sum(measure["count"] for measure in self.statements.values()),
+                "seconds": sum(measure["seconds"] for measure in self.statements.values()),
+                "top": [dict(statement=statement, **measure)
+                        for statement, measure in statements[:top]],
+            },
+        }
+
+    def print_report(self, top: int = 20):
+        report = self.report(top)
+        print(f"\nTotal: {report['seconds']:.3f} s")
+        print(f"\n{'stage':>32} {'calls':>7} {'seconds':>9}")
+        for name, stage in report["stages"].items():
+            print(f"{name:>32} {stage['calls']:>7} {stage['seconds']:>9.3f}")
+        print(f"\nSQL: {report['sql']['statements']} statements, "
+              f"{report['sql']['seconds']:.3f} s")
+        print(f"{'count':>7} {'rows':>8} {'seconds':>9}  statement")
+        for measure in report["sql"]["top"]:
+            statement = measure["statement"]
+            if len(statement) > 100:
+                statement = statement[:97] + "..."
+            print(f"{measure['count']:>7} {measure['rows']:>8} {measure['seconds']:>9.3f}  "
+                  f"{statement}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    if _active is not None:
+        rows = len(parameters) if executemany else 1
+        _active.add_statement(statement, rows, seconds)
+
+
+def _before_flush(session, flush_context, instances):
+    session.info["flush_start"] = time.perf_counter()
+
+
+def _after_flush(session, flush_context):
+    start = session.info.pop("flush_start", None)
+    if _active is not None and start is not None:
+        _active.add_stage("orm flush", time.perf_counter() - start)
+
+
+_LISTENERS = [(Engine, "before_cursor_execute", _before_cursor_execute),
+              (Engine, "after_cursor_execute", _after_cursor_execute),
+              (Session, "before_flush", _before_flush),
+              (Session, "after_flush_postexec", _after_flush)]
+
+
+def enable(cprofile_file=None):
+    """
+    Starts instrumenting every engine and session (and cProfile, if a dump
+    file is given).
+
+        Parameters:
+            cprofile_file (str or path): file to dump cProfile stats into
+
+        Returns:
+            profiler (Profiler)
+    """
+    global _active
+    if _active is not None:
+        return _active
+
+    for target, identifier, listener in _LISTENERS:
+        event.listen(target, identifier, listener)
+    _active = Profiler(cprofile_file)
+    _active._start = time.perf_counter()
+    if _active._cprofile:
+        _active._cprofile.enable()
+
+    return _active
+
+
+def disable():
+    """Stops instrumenting, dumps cProfile stats and returns the profiler"""
+    global _active
+    profiler, _active = _active, None
+    if profiler is None:
+        return None
+
+    for target, identifier, listener in _LISTENERS:
+        event.remove(target, identifier, listener)
+    if profiler._cprofile:
+        profiler._cprofile.disable()
+        profiler._cprofile.dump_stats(profiler.cprofile_file)
+
+    return profiler
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block as a pipeline stage (no-op when instrumentation is off)"""
+    if _active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _active is not None:
+            _active.add_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str = None):
+    """Decorator version of stage() (stage named after the function by default)"""
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        # Generators only add the time spent producing items, not the time
+        # of the consumer between them
+        if inspect.isgeneratorfunction(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                if _active is None:
+                    return (yield from generator)
+                seconds = 0.0
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(generator)
+                        except StopIteration as stop:
+                            return stop.value
+                        finally:
+                            seconds += time.perf_counter() - start
+                        yield item
+                finally:
+                    generator.close()
+                    if _active is not None:
+                        _active.add_stage(stage_name, seconds)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if _active is None:
+                    return function(*args, **kwargs)
+                with stage(stage_name):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def profiling(report_format: str = None, output_file=None, cprofile_file=None):
+    """
+    Instruments the block and reports at the end. Arguments not given are
+    read from GYM_PROFILE, GYM_PROFILE_OUTPUT and GYM_CPROFILE environment
+    variables; without a report format (or cProfile file) it does nothing.
+
+        Parameters:
+            report_format (str): "console" or "json"
+            output_file (str or path): file to write the json report into
+                                       (stdout by default)
+            cprofile_file (str or path): file to dump cProfile stats into
+    """
+    report_format = report_format or os.environ.get("GYM_PROFILE")
+    output_file = output_file or os.environ.get("GYM_PROFILE_OUTPUT")
+    cprofile_file = cprofile_file or os.environ.get("GYM_CPROFILE")
+    if report_format not in (None, "", "console", "json"):
+        raise KeyError(f"Unknown profile report format ({report_format})! "
+                       f"Use 'console' or 'json'")
+    if not report_format and not cprofile_file:
+        yield None
+        return
+
+    profiler = enable(cprofile_file)
+    try:
+        yield profiler
+    finally:
+        disable()
+        if report_format == "json":
+            report = json.dumps(profiler.report(), indent=2)
+            if output_file:
+                with open(output_file, "w") as f:
+                    f.write(report)
+            else:
+                print(report)
+        elif report_format == "console":
+            profiler.print_report()
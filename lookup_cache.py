@@ -0,0 +1,188 @@
+from sqlalchemy import event, inspect
+
+from models import Program, Block, Exercise
+import repository
+
+from collections import OrderedDict
+
+
+# Cached name --> id lookups: table name, model and its key attributes
+LOOKUPS = {
+    "program": (Program, ("program_desc",)),
+    "block": (Block, ("program_id", "block_desc")),
+    "exercise": (Exercise, ("exercise_desc",)),
+}
+
+
+class LookupCache:
+    """
+    Bounded LRU map of (table, *key) --> id. Entries added inside a
+    transaction are dropped if it is rolled back.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = set()
+
+    def get(self, key):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._pending.add(key)
+        if len(self._entries) > self.maxsize:
+            oldest, _ = self._entries.popitem(last=False)
+            self._pending.discard(oldest)
+
+    def evict(self, table: str, value=None):
+        """Drops entries of a table (only the ones pointing to value, if given)"""
+        for key in [key for key, cached in self._entries.items()
+                    if key[0] == table and (value is None or cached == value)]:
+            del self._entries[key]
+            self._pending.discard(key)
+
+    def commit(self):
+        self._pending.clear()
+
+    def rollback(self):
+        for key in self._pending:
+            self._entries.pop(key, None)
+        self._pending.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def _lookup_key(obj):
+    """Cache key of a Program, Block or Exercise object (None for other objects)"""
+    for table, (model, attributes) in LOOKUPS.items():
+        if isinstance(obj, model):
+            return (table,) + tuple(getattr(obj, attribute) for attribute in attributes)
+    return None
+
+
+def _primary_key(obj):
+    """Primary key value of a (flushed) object"""
+    return inspect(obj).mapper.primary_key_from_instance(obj)[0]
+
+
+def get_lookup_cache(session, maxsize: int = 4096):
+    """
+    Returns the lookup cache of the session, creating it (and the session
+    event listeners that keep it consistent) on first use.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            maxsize (int): max number of cached ids
+
+        Returns:
+            cache (LookupCache)
+    """
+    cache = session.info.get("lookup_cache")
+    if cache is not None:
+        return cache
+
+    cache = session.info["lookup_cache"] = LookupCache(maxsize)
+
+    @event.listens_for(session, "after_flush")
+    def cache_flushed(session, flush_context):
+        for obj in session.new:
+            key = _lookup_key(obj)
+            if key is not None and None not in key:
+                cache.put(key, _primary_key(obj))
+        # Renamed or deleted objects: drop whatever points to them
+        for obj in list(session.dirty) + list(session.deleted):
+            key = _lookup_key(obj)
+            if key is not None:
+                cache.evict(key[0], _primary_key(obj))
+
+    @event.listens_for(session, "do_orm_execute")
+    def cache_bulk_statement(orm_execute_state):
+        # Bulk UPDATE/DELETE statements could change any cached row
+        table = getattr(orm_execute_state.statement, "table", None)
+        if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+                and table is not None and table.name in LOOKUPS):
+            cache.evict(table.name)
+
+    @event.listens_for(session, "after_commit")
+    def cache_commit(session):
+        cache.commit()
+
+    @event.listens_for(session, "after_rollback")
+    def cache_rollback(session):
+        cache.rollback()
+
+    return cache
+
+
+def lookup_program_id(session, program_desc: str):
+    """Returns id of the program with the given description (None if not found)"""
+    cache = get_lookup_cache(session)
+    program_id = cache.get(("program", program_desc))
+    if program_id is None:
+        program_id = repository.program_id_by_desc(session, program_desc)
+        if program_id is not None:
+            cache.put(("program", program_desc), program_id)
+
+    return program_id
+
+
+def lookup_block_id(session, program_id: int, block_desc: str):
+    """Returns id of the block of a program with the given description (None if not found)"""
+    cache = get_lookup_cache(session)
+    block_id = cache.get(("block", program_id, block_desc))
+    if block_id is None:
+        block_id = repository.block_id_by_desc(session, program_id, block_desc)
+        if block_id is not None:
+            cache.put(("block", program_id, block_desc), block_id)
+
+    return block_id
+
+
+def lookup_exercise_ids(session, exercise_descs):
+    """
+    Resolves exercise descriptions to ids, querying only the ones not cached
+    (in a single query).
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            exercise_descs (iterable): exercise descriptions
+
+        Returns:
+            exercise_ids (dict): exercise_desc --> exercise_id of the ones found
+    """
+    cache = get_lookup_cache(session)
+    exercise_ids, missing = {}, set()
+    for exercise_desc in set(exercise_descs):
+        exercise_id = cache.get(("exercise", exercise_desc))
+        if exercise_id is None:
+            missing.add(exercise_desc)
+        else:
+            exercise_ids[exercise_desc] = exercise_id
+
+    if missing:
+        for exercise_desc, exercise_id in repository.exercise_ids_by_desc(session, missing):
+            cache.put(("exercise", exercise_desc), exercise_id)
+            exercise_ids[exercise_desc] = exercise_id
+
+    return exercise_ids
+
+
+def lookup_exercise_id(session, exercise_desc: str):
+    """Returns id of the exercise with the given description (None if not found)"""
+    return lookup_exercise_ids(session, [exercise_desc]).get(exercise_desc)
@@ -1,31 +1,183 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql.functions import current_timestamp
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 
 from models import (Program, Block, Workout, Workout_set,
-                    Exercise, Log_workout, Log_set)
+                    Exercise, Log_workout, Log_set, Ingest_manifest,
+                    Log_sheet_manifest, Block_summary)
+from migrations import create_indexes
+from database import DB_PATH, PROFILES, STAGE_PROFILES, get_engine, get_session
+from summaries import (summary_keys, refresh_summaries, refresh_workout_summaries,
+                       rebuild_summaries)
+from prs import update_prs
+from exercise_matching import MATCH_THRESHOLD, resolve_new_names
+from sharding import SHARDS_DIR, ShardRouter
+from instrumentation import timed, profiling
+from lookup_cache import (get_lookup_cache, lookup_program_id, lookup_block_id,
+                          lookup_exercise_ids)
+import repository
 
 from pathlib import Path
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
 import re
+import hashlib
+from html.parser import HTMLParser
 from datetime import datetime
+from itertools import chain, groupby, repeat
+from operator import itemgetter
+import os
+import zipfile
+import zlib
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+import multiprocessing
+import threading
+import queue
+import time
+import argparse
+
+
+COL_NAMES = ["Ejercicio", "Series", "Cargas (%)",
+             "Kilos", "Repeticiones", "RPE", "Descanso (min)"]
+WORKOUT_SET_COLS = ["workout_id", "exercise_id", "set_id", "no_reps",
+                    "weight", "perc_rm", "max_rpe", "rest_min"]
+SET_BATCH_COLS = ["workout_idx", "exercise_desc", "set_id", "no_reps",
+                  "weight", "perc_rm", "max_rpe", "rest_min"]
+LOG_HEADER_ROWS = ["Fecha", "Descripción", "Duración (min)",
+                   "RPE general", "Comentario general"]
+LOG_SET_COLS = ["ID", "Ejercicio", "Serie", "Repeticiones", "Peso (kg)", "% 1RM",
+                "RPE mín.", "RPE máx.", "Descanso (min)", "¿Hecho?", "RPE", "Comentarios"]
+# Excel sheet names: at most 31 characters, none of these ones
+SHEET_TITLE_LENGTH = 31
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+class _SessionsHTMLParser(HTMLParser):
+    """
+    Event based parser for the coach html export. Only keeps state for the
+    session ("div.dia") being read, and leaves every finished session dict
+    in self.sessions for the caller to consume.
+    """
+    DATE_IDS = ("dia", "mes", "anyo")
+
+    def __init__(self):
+        super().__init__()
+        self.sessions = []
+        self._divs = []          # role of every open div
+        self._buffers = []       # text buffers being captured
+        self._session = None
+        self._exercise = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "div":
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        role = None
+
+        if self._session is None:
+            if "dia" in classes:
+                role = "dia"
+                self._session = {"titulo": None, "exercises": []}
+        elif self._exercise is not None:
+            # Every div inside the exercise is one of its fields
+            if classes:
+                role = ("field", classes[0])
+        elif "titulo" in classes and self._session["titulo"] is None:
+            role = "titulo"
+        elif attrs.get("id") in self.DATE_IDS and attrs["id"] not in self._session:
+            role = ("date", attrs["id"])
+        elif "cuerpo-boxdia" in classes:
+            role = "cuerpo"
+        elif "cuerpo" in self._divs and any(re.search("ejercicio", c) for c in classes):
+            role = "ejercicio"
+            self._exercise = {}
+
+        self._divs.append(role)
+        # Titles, dates and exercise fields keep their (nested) text
+        if role == "titulo" or isinstance(role, tuple):
+            self._buffers.append([])
+
+    def handle_endtag(self, tag):
+        if tag != "div" or not self._divs:
+            return
+        role = self._divs.pop()
+
+        if role == "titulo":
+            self._session["titulo"] = "".join(self._buffers.pop())
+        elif isinstance(role, tuple):
+            text = "".join(self._buffers.pop())
+            if role[0] == "field":
+                self._exercise[role[1]] = text.strip()
+            else:
+                self._session[role[1]] = int(text)
+        elif role == "ejercicio":
+            self._session["exercises"].append(self._exercise)
+            self._exercise = None
+        elif role == "dia":
+            session = self._session
+            self._session = None
+            self.sessions.append({
+                "workout_desc": session["titulo"].lower().strip(),
+                "date_workout": datetime(session["anyo"], session["mes"], session["dia"]).date(),
+                "exercises": session["exercises"]
+            })
+
+    def handle_data(self, data):
+        for buffer in self._buffers:
+            buffer.append(data)
+
+
+def iter_sessions_from_html(file, chunk_size: int = 1 << 16):
+    """
+    Streams the sessions of a html file, yielding one session dict at a time
+    (same format as the ones in get_data_from_html()). The file is read in
+    chunks, so memory doesn't grow with file size.
+
+        Parameters:
+            file (str or path): html file containing the info
+            chunk_size (int): number of characters fed to the parser at once
 
+        Yields:
+            session_dict (dict): workout_desc, date_workout and exercises
+    """
+    parser = _SessionsHTMLParser()
+    with open(file) as html_file:
+        for chunk in iter(lambda: html_file.read(chunk_size), ""):
+            parser.feed(chunk)
+            yield from parser.sessions
+            parser.sessions.clear()
+    parser.close()
+    yield from parser.sessions
 
-def get_data_from_html(file):
+
+@timed()
+def get_data_from_html(file, parser: str = "html.parser"):
     """
     Gets planning data from html file and returns dict with microcycle.
 
         Parameters:
             file (str or path): html file containing the info
+            parser (str): BeautifulSoup parser backend ("html.parser" or
+                          "lxml", the latter only if lxml is installed), or
+                          "stream" to use the low-memory streaming extractor
 
         Returns:
             micro_dict (dict): dict containing same info organised
     """
-    with open(file) as html_file:
-        soup = BeautifulSoup(html_file, "html.parser")
+    if parser == "stream":
+        sessions_list = list(iter_sessions_from_html(file))
+    else:
+        with open(file) as html_file:
+            soup = BeautifulSoup(html_file, parser)
 
         sessions_list = []
         sessions = soup.find_all("div", class_="dia")
@@ -55,17 +207,46 @@ def get_data_from_html(file):
 
             sessions_list.append(session_dict)
 
-        # # We have changed this in order to make it easier to manually modify Micro name
-        # block_name = soup.find(id="microciclo").text.strip()
-        if isinstance(file, Path):
-            block_name = file.stem.strip()
-        else:
-            block_name = Path(file).stem.strip()
-        micro_dict = {block_name: sessions_list}
+    # # We have changed this in order to make it easier to manually modify Micro name
+    # block_name = soup.find(id="microciclo").text.strip()
+    if isinstance(file, Path):
+        block_name = file.stem.strip()
+    else:
+        block_name = Path(file).stem.strip()
+    micro_dict = {block_name: sessions_list}
 
     return micro_dict
 
 
+@timed()
+def parse_html_files(files: list, workers: int = None, parser: str = "html.parser"):
+    """
+    Parses several html files in parallel (one process per core by default).
+    Results are returned in the same order as the input files, so the later
+    database writes are deterministic.
+
+        Parameters:
+            files (list): html files (str or path) to parse
+            workers (int): number of worker processes (None for all cores,
+                           1 to parse in current process)
+            parser (str): BeautifulSoup parser backend
+
+        Returns:
+            micro_dicts (list): list of dicts as returned by get_data_from_html()
+    """
+    files = list(files)
+    parsers = [parser] * len(files)
+
+    if workers == 1 or len(files) <= 1:
+        return list(map(get_data_from_html, files, parsers))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        micro_dicts = list(executor.map(get_data_from_html, files, parsers))
+
+    return micro_dicts
+
+
+@timed()
 def curate_exercises_data(exercises: list, col_names: list):
     """
     Apply some column transformations to make exercise data from workout
@@ -108,6 +289,7 @@ def curate_exercises_data(exercises: list, col_names: list):
     return df_exercises
 
 
+@timed()
 def add_block(session, source_file=None, program: str = None):
     """
     Adds block of program from personal coach html file
@@ -118,19 +300,10 @@ def add_block(session, source_file=None, program: str = None):
             program (str): the gym program description name
     """
 
-    COL_NAMES = ["Ejercicio", "Series", "Cargas (%)",
-                 "Kilos", "Repeticiones", "RPE", "Descanso (min)"]
-
     # Check if program description already exists
-    if program:
-        program = (
-            session.query(Program)
-            .filter(Program.program_desc == program)
-            .one_or_none()
-        )
-        program_id = program.program_id
+    program_id = lookup_program_id(session, program) if program else None
     # If not (or not provided), create new generic program
-    if program is None:
+    if program_id is None:
         program = Program()
         session.add(program)
         # If new, the program_id will be last element added
@@ -138,19 +311,15 @@ def add_block(session, source_file=None, program: str = None):
 
     block_dict = get_data_from_html(source_file)
 
+    new_blocks = []
     for block_name, workouts_list in block_dict.items():
         # Check if block already exist (matching both name and program)
-        block = (
-            session.query(Block)
-            .filter(Block.block_desc == block_name, Block.program_id == program_id)
-            .one_or_none()
-        )
-        if block:
-            block_id = block.block_id
+        block_id = lookup_block_id(session, program_id, block_name)
         # If not, create it
-        if block is None:
+        if block_id is None:
             block = Block(block_desc=block_name, program_id=program_id)
             session.add(block)
+            new_blocks.append(block)
             # If new, the block_id will be last element added
             block_id = session.query(Block).count()
 
@@ -165,12 +334,9 @@ def add_block(session, source_file=None, program: str = None):
                 workout_id = session.query(Workout).count()
                 df_exercises = curate_exercises_data(wod["exercises"], COL_NAMES)
 
-                # If exercise is not in Exercise lookup table, add it previously
-                data_ex = df_exercises["Ejercicio"].unique()
-                db_ex = [i[0] for i in session.query(Exercise.exercise_desc).all()]
-                for new_exercise in list(set(data_ex) - set(db_ex)):
-                    exercise = Exercise(exercise_desc=new_exercise)
-                    session.add(exercise)
+                # If exercise is not in Exercise lookup table (nor a variant
+                # of one), add it previously
+                exercise_ids = get_exercise_ids(session, df_exercises["Ejercicio"].unique())
 
                 # Then, insert row by row the results (exploding for as many series
                 # per exercise there are)
@@ -179,9 +345,7 @@ def add_block(session, source_file=None, program: str = None):
                         set_id = wod_set + 1
                         workout_set = Workout_set(
                             workout_id=workout_id,
-                            exercise_id=session.query(Exercise.exercise_id)
-                                               .filter_by(exercise_desc=row["Ejercicio"])
-                                               .scalar(),
+                            exercise_id=exercise_ids[row["Ejercicio"]],
                             set_id=set_id,
                             no_reps=row["Repeticiones"],
                             weight=row["Kilos"],
@@ -191,11 +355,812 @@ def add_block(session, source_file=None, program: str = None):
                         )
                         session.add(workout_set)
 
+    # Update volume summaries of the new blocks
+    session.flush()
+    refresh_summaries(session, [block.block_id for block in new_blocks])
+
+    session.commit()
+
+
+def get_program_id(session, program: str = None):
+    """
+    Returns the id of the program with the given description, creating it
+    if it doesn't exist (or a generic one if no description is provided).
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program (str): the gym program description name
+
+        Returns:
+            program_id (int): real primary key of the program
+    """
+    if program:
+        program_id = lookup_program_id(session, program)
+        if program_id is not None:
+            return program_id
+
+    program_id = session.execute(
+        Program.__table__.insert().values(program_desc=program)
+    ).inserted_primary_key[0]
+    if program:
+        get_lookup_cache(session).put(("program", program), program_id)
+
+    return program_id
+
+
+def get_exercise_ids(session, exercise_names):
+    """
+    Resolves exercise names to ids in a single query (and another one for
+    the names that are aliases). Names not yet in Exercise lookup table are
+    inserted with one executemany. If session.info["match_threshold"] is
+    set (None by default), they are first matched against the existing
+    exercises and merged into the one they are a variant of, if any (see
+    exercise_matching.py).
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            exercise_names (iterable): exercise descriptions (lowercase)
+
+        Returns:
+            exercise_ids (dict): map exercise_desc --> exercise_id
+    """
+    names = set(exercise_names)
+
+    exercise_ids = lookup_exercise_ids(session, names)
+    new_exercises = names - set(exercise_ids)
+    if new_exercises:
+        exercise_ids.update(repository.exercise_ids_by_alias(session, new_exercises))
+        new_exercises -= set(exercise_ids)
+    if not new_exercises:
+        return exercise_ids
+
+    threshold = session.info.get("match_threshold")
+    if threshold is not None:
+        exercise_ids.update(resolve_new_names(session, new_exercises, threshold))
+    else:
+        session.execute(Exercise.__table__.insert(),
+                        [{"exercise_desc": name} for name in sorted(new_exercises)])
+        exercise_ids.update(lookup_exercise_ids(session, new_exercises))
+
+    return exercise_ids
+
+
+@timed()
+def curate_block_data(workouts_list: list, col_names: list = COL_NAMES):
+    """
+    Block-wide (vectorized) version of curate_exercises_data(). Exercises of
+    every workout are concatenated in one frame, all numeric columns are
+    parsed in a single pass and series are exploded into one row per set.
+
+        Parameters:
+            workouts_list (list): workouts as parsed by get_data_from_html()
+            col_names (list): list of standardized names of exercise fields
+
+        Returns:
+            df_sets (pandas.DataFrame): one row per set, with the workout
+                                        position in workouts_list
+                                        ("workout_idx") and workout_set
+                                        columns ready to insert
+    """
+    n_exercises = [len(wod["exercises"]) for wod in workouts_list]
+    df_block = pd.DataFrame.from_records(
+        [exercise for wod in workouts_list for exercise in wod["exercises"]]
+    )
+    if df_block.empty:
+        return pd.DataFrame(columns=SET_BATCH_COLS)
+    # Standard names (fields are positional, same as in curate_exercises_data())
+    df_block = df_block.iloc[:, :len(col_names)]
+    df_block.columns = col_names
+
+    # Convert to numbers ("Series", "Cargas", "Kilos", "Repeticiones", "RPE",
+    # "Descanso") in one pass over all cells
+    values = (
+        pd.Series(df_block[col_names[1:]].to_numpy(dtype=object).ravel())
+        .str.extract(r"(\d+)", expand=False)
+        .astype(float)
+        .to_numpy()
+        .reshape(len(df_block), len(col_names) - 1)
+    )
+    series, perc_rm, weight, no_reps, rpe, rest_min = values.T
+    if np.isnan(values[:, [0, 3, 4]]).any():
+        raise ValueError("Series, Repeticiones and RPE must be numbers in every exercise!")
+    # In "Cargas (%)", "Kilos" and "Descanso (min)" change 0 --> NULL
+    for column in (perc_rm, weight, rest_min):
+        column[column == 0] = np.nan
+
+    # Explode every exercise in as many sets as series
+    exercise_idx = np.repeat(np.arange(len(df_block)), series.astype(int))
+    df_sets = pd.DataFrame({
+        "workout_idx": np.repeat(np.arange(len(workouts_list)), n_exercises)[exercise_idx],
+        "exercise_desc": df_block.iloc[:, 0].str.lower().to_numpy()[exercise_idx],
+        "set_id": pd.Series(exercise_idx).groupby(exercise_idx).cumcount().to_numpy() + 1,
+        "no_reps": no_reps[exercise_idx].astype(int),
+        "weight": weight[exercise_idx],
+        "perc_rm": perc_rm[exercise_idx],
+        "max_rpe": rpe[exercise_idx].astype(int),
+        "rest_min": rest_min[exercise_idx]
+    })
+
+    return df_sets
+
+
+def _batch_records(df_sets, columns: list):
+    """Columnar batch --> list of row dicts with python types (NaN --> None)"""
+    values = []
+    for col in columns:
+        col_values = df_sets[col].tolist()
+        if df_sets[col].dtype.kind == "f":
+            col_values = [None if value != value else value for value in col_values]
+        values.append(col_values)
+
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def _set_records(df_sets, workout_ids: list, exercise_ids: dict):
+    """Adds workout and exercise ids to curated batch and returns its rows"""
+    df_sets = df_sets.assign(
+        workout_id=np.asarray(workout_ids, dtype=int)[df_sets["workout_idx"].to_numpy(dtype=int)],
+        exercise_id=df_sets["exercise_desc"].map(exercise_ids)
+    )
+
+    return _batch_records(df_sets, WORKOUT_SET_COLS)
+
+
+def _insert_workout(session, block_id: int, wod: dict):
+    """Inserts workout header and returns its real primary key"""
+    return session.execute(
+        Workout.__table__.insert().values(workout_desc=wod["workout_desc"],
+                                          block_id=block_id,
+                                          date_workout=wod["date_workout"])
+    ).inserted_primary_key[0]
+
+
+def delete_workout_sets(session, workout_set_ids: list):
+    """
+    Deletes workout sets together with their logs (foreign keys are not
+    enforced by SQLite, so ON DELETE CASCADE can't be relied on).
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            workout_set_ids (list): ids of the sets to delete
+    """
+    if not workout_set_ids:
+        return
+    session.execute(Log_set.__table__.delete()
+                    .where(Log_set.workout_set_id.in_(workout_set_ids)))
+    session.execute(Workout_set.__table__.delete()
+                    .where(Workout_set.workout_set_id.in_(workout_set_ids)))
+
+
+def delete_workouts(session, workout_ids: list):
+    """
+    Deletes workouts together with their sets and logs.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            workout_ids (list): ids of the workouts to delete
+    """
+    if not workout_ids:
+        return
+    workout_set_ids = [
+        i[0] for i in (session.query(Workout_set.workout_set_id)
+                              .filter(Workout_set.workout_id.in_(workout_ids)))
+    ]
+    delete_workout_sets(session, workout_set_ids)
+    session.execute(Log_workout.__table__.delete()
+                    .where(Log_workout.workout_id.in_(workout_ids)))
+    session.execute(Workout.__table__.delete()
+                    .where(Workout.workout_id.in_(workout_ids)))
+
+
+def _sync_workouts(session, block_id: int, workouts_list: list, df_sets, exercise_ids: dict):
+    """
+    Diffs the workouts of an existing block against the (curated) ones from
+    file. Workouts are matched by date and sets by exercise and set number,
+    so the logs of unchanged sets are kept. Returns number of set rows
+    inserted or updated.
+    """
+    ws = Workout_set.__table__
+
+    db_workouts = dict(
+        session.query(Workout.date_workout, Workout.workout_id)
+        .filter(Workout.block_id == block_id)
+    )
+    file_dates = {wod["date_workout"] for wod in workouts_list}
+    delete_workouts(session, [workout_id for date, workout_id in db_workouts.items()
+                              if date not in file_dates])
+
+    # All sets of the block in one query, grouped by workout and matching key
+    db_sets = {}
+    for db_set in session.execute(
+        select(ws).join(Workout.__table__).where(Workout.block_id == block_id)
+        .order_by(ws.c.workout_set_id)
+    ).mappings():
+        key = (db_set["workout_id"], db_set["exercise_id"], db_set["set_id"])
+        db_sets.setdefault(key, []).append(db_set)
+
+    workout_ids = []
+    for wod in workouts_list:
+        workout_id = db_workouts.get(wod["date_workout"])
+        if workout_id is None:
+            workout_id = _insert_workout(session, block_id, wod)
+        else:
+            session.execute(Workout.__table__.update()
+                            .where(Workout.workout_id == workout_id)
+                            .values(workout_desc=wod["workout_desc"]))
+        workout_ids.append(workout_id)
+
+    new_sets, changed_sets = [], []
+    for row in _set_records(df_sets, workout_ids, exercise_ids):
+        # If an exercise is repeated within the workout, match in order
+        matches = db_sets.get((row["workout_id"], row["exercise_id"], row["set_id"]))
+        if not matches:
+            new_sets.append(row)
+            continue
+        db_set = matches.pop(0)
+        if any(db_set[col] != value for col, value in row.items()):
+            changed_sets.append({"b_workout_set_id": db_set["workout_set_id"], **row})
+
+    # Sets left unmatched are no longer in file
+    delete_workout_sets(session, [db_set["workout_set_id"]
+                                  for matches in db_sets.values() for db_set in matches])
+    if changed_sets:
+        session.execute(ws.update().where(ws.c.workout_set_id == bindparam("b_workout_set_id")),
+                        changed_sets)
+    if new_sets:
+        session.execute(ws.insert(), new_sets)
+
+    return len(new_sets) + len(changed_sets)
+
+
+@timed()
+def write_block(session, program_id: int, block_name: str, workouts_list: list,
+                update_existing: bool = False, df_sets=None):
+    """
+    Writes one block (microcycle) with bulk statements, without committing.
+    Exercise ids are resolved once for the whole block and all its new sets
+    are inserted with one executemany.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): id of the program the block belongs to
+            block_name (str): block description
+            workouts_list (list): workouts as parsed by get_data_from_html()
+            update_existing (bool): if block already exists, diff its workouts
+                                    against the given ones (else it is skipped)
+            df_sets (pandas.DataFrame): curate_block_data() of workouts_list,
+                                        if already done
+
+        Returns:
+            block_id (int): id of the (new or existing) block
+            n_sets (int): number of workout_set rows written
+    """
+    # Check if block already exist (matching both name and program)
+    block_id = lookup_block_id(session, program_id, block_name)
+    if block_id is not None and not update_existing:
+        return block_id, 0
+
+    if df_sets is None:
+        df_sets = curate_block_data(workouts_list)
+    exercise_ids = get_exercise_ids(session, df_sets["exercise_desc"].unique())
+
+    if block_id is not None:
+        old_keys = summary_keys(session, [block_id])
+        n_sets = _sync_workouts(session, block_id, workouts_list, df_sets, exercise_ids)
+        refresh_summaries(session, [block_id], old_keys)
+        return block_id, n_sets
+
+    block_id = session.execute(
+        Block.__table__.insert().values(block_desc=block_name, program_id=program_id)
+    ).inserted_primary_key[0]
+    get_lookup_cache(session).put(("block", program_id, block_name), block_id)
+
+    workout_ids = [_insert_workout(session, block_id, wod) for wod in workouts_list]
+    sets = _set_records(df_sets, workout_ids, exercise_ids)
+    if sets:
+        session.execute(Workout_set.__table__.insert(), sets)
+    refresh_summaries(session, [block_id])
+
+    return block_id, len(sets)
+
+
+@timed()
+def bulk_add_block(session, source_file=None, program: str = None, block_dict: dict = None,
+                   update_existing: bool = False):
+    """
+    Bulk version of add_block(). Exercise ids are resolved once per block,
+    workouts get their real primary keys back from the insert and all sets
+    of a block are written with one executemany, everything inside a single
+    transaction.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            source_file (str or path): the .html file that contains the info
+            program (str): the gym program description name
+            block_dict (dict): already parsed microcycle (as returned by
+                               get_data_from_html()), to skip the parsing
+            update_existing (bool): diff existing blocks instead of skipping them
+
+        Returns:
+            stats (dict): number of sets written, elapsed seconds and
+                          rows per second
+    """
+    start = time.perf_counter()
+    n_sets = 0
+
+    if block_dict is None:
+        block_dict = get_data_from_html(source_file)
+
+    try:
+        program_id = get_program_id(session, program)
+        for block_name, workouts_list in block_dict.items():
+            _, block_sets = write_block(session, program_id, block_name, workouts_list,
+                                        update_existing)
+            n_sets += block_sets
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+
+    return {"sets": n_sets,
+            "seconds": elapsed,
+            "rows_per_sec": n_sets / elapsed if elapsed else 0.0}
+
+
+def file_hash(file):
+    """Returns sha256 hex digest of file content"""
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@timed()
+def ingest_html_files(session, files: list, program: str = None, workers: int = None,
+                      parser: str = "html.parser"):
+    """
+    Incremental ingest of html files using the ingest manifest. Files whose
+    mtime (or, if touched, content hash) matches the manifest are skipped
+    without parsing. New files are loaded and changed ones are diffed
+    against the block previously loaded from them.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            files (list): html files (str or path) to ingest
+            program (str): the gym program description name
+            workers (int): number of parsing processes (see parse_html_files())
+            parser (str): BeautifulSoup parser backend
+
+        Returns:
+            stats (dict): number of files skipped and loaded, sets written,
+                          elapsed seconds and rows per second
+    """
+    start = time.perf_counter()
+
+    to_load, touched = [], []
+    files = list(files)
+    for file, path, mtime, content_hash, changed in iter_changed_files(read_manifest(session),
+                                                                       files):
+        if changed:
+            to_load.append((file, path, mtime, content_hash))
+        else:
+            touched.append({"b_file_path": path, "mtime": mtime})
+    touch_manifest(session, touched)
+
+    n_sets = 0
+    micro_dicts = parse_html_files([file for file, *_ in to_load], workers, parser)
+    try:
+        if to_load:
+            program_id = get_program_id(session, program)
+        for (file, path, mtime, content_hash), micro_dict in zip(to_load, micro_dicts):
+            n_sets += write_ingested_file(session, program_id, path, mtime, content_hash,
+                                          [(block_name, workouts_list, None)
+                                           for block_name, workouts_list in micro_dict.items()])
+    except Exception:
+        session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+
+    return {"skipped": len(files) - len(to_load),
+            "loaded": len(to_load),
+            "sets": n_sets,
+            "seconds": elapsed,
+            "rows_per_sec": n_sets / elapsed if elapsed else 0.0}
+
+
+def read_manifest(session):
+    """Returns the ingest manifest entries by file path"""
+    return {
+        row.file_path: row for row in
+        session.query(Ingest_manifest.file_path, Ingest_manifest.mtime,
+                      Ingest_manifest.content_hash)
+    }
+
+
+def iter_changed_files(manifest: dict, files: list):
+    """
+    Yields the files (in name order) whose mtime differs from the manifest,
+    hashing their content to tell touched files from changed ones.
+
+        Parameters:
+            manifest (dict): as returned by read_manifest()
+            files (list): html files (str or path)
+
+        Yields:
+            file (Path), path (str), mtime (float), content_hash (str),
+            changed (bool): False if only the mtime changed
+    """
+    for file in sorted(Path(f) for f in files):
+        path = file.as_posix()
+        mtime = file.stat().st_mtime
+        entry = manifest.get(path)
+        if entry and entry.mtime == mtime:
+            continue
+        content_hash = file_hash(file)
+        yield file, path, mtime, content_hash, not (entry and entry.content_hash == content_hash)
+
+
+def touch_manifest(session, touched: list):
+    """Updates the mtime of manifest entries of touched (unchanged) files and commits"""
+    if touched:
+        manifest_table = Ingest_manifest.__table__
+        session.execute(manifest_table.update()
+                        .where(manifest_table.c.file_path == bindparam("b_file_path")),
+                        touched)
+        session.commit()
+
+
+def write_ingested_file(session, program_id: int, path: str, mtime: float, content_hash: str,
+                        blocks: list):
+    """
+    Writes the blocks of one html file (diffing existing ones) and its
+    manifest entry, and commits: one transaction per file, so the manifest
+    always matches db content.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): id of the program of the blocks
+            path, mtime, content_hash: manifest entry of the file
+            blocks (list): (block_name, workouts_list, df_sets) tuples, df_sets
+                           being None if not curated yet
+
+        Returns:
+            n_sets (int): number of workout_set rows written
+    """
+    n_sets, block_id = 0, None
+    for block_name, workouts_list, df_sets in blocks:
+        block_id, block_sets = write_block(session, program_id, block_name, workouts_list,
+                                           update_existing=True, df_sets=df_sets)
+        n_sets += block_sets
+    values = {"content_hash": content_hash, "mtime": mtime, "block_id": block_id}
+    session.execute(
+        sqlite_insert(Ingest_manifest.__table__).values(file_path=path, **values)
+        .on_conflict_do_update(index_elements=["file_path"], set_=values)
+    )
     session.commit()
 
+    return n_sets
+
+
+# End of the items of a pipeline stage
+_DONE = object()
+
+
+class _StageError:
+    """Exception raised in a pipeline stage thread, re-raised to the consumer"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _threaded(items, queue_size: int, stop):
+    """
+    Iterates items in a background thread, handing them over through a
+    bounded queue: the thread waits while queue_size items are pending, and
+    quits when stop is set (e.g. the consumer failed).
+    """
+    handover = queue.Queue(queue_size)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                handover.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_StageError(e))
+            return
+        put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while not stop.is_set():
+        try:
+            item = handover.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.exception
+        yield item
+
+
+def _parse_changed_files(changed_files, executor, parser: str, in_flight: int):
+    """
+    Parses the changed files of iter_changed_files() items in the process
+    pool (in the current process if None), with up to in_flight files being
+    parsed at once. Yields (item, micro_dict) in input order, micro_dict
+    being None for touched files.
+    """
+    pending = deque()
+    for item in changed_files:
+        file, changed = item[0], item[-1]
+        if not changed:
+            pending.append((item, None))
+        elif executor is None:
+            pending.append((item, get_data_from_html(file, parser)))
+        else:
+            pending.append((item, executor.submit(get_data_from_html, file, parser)))
+        while len(pending) > in_flight:
+            item, result = pending.popleft()
+            yield item, result.result() if isinstance(result, Future) else result
+    while pending:
+        item, result = pending.popleft()
+        yield item, result.result() if isinstance(result, Future) else result
+
+
+def _curate_parsed_files(parsed_files):
+    """Adds curate_block_data() of every block to _parse_changed_files() items"""
+    for item, micro_dict in parsed_files:
+        blocks = None
+        if micro_dict is not None:
+            blocks = [(block_name, workouts_list, curate_block_data(workouts_list))
+                      for block_name, workouts_list in micro_dict.items()]
+        yield item, blocks
+
+
+@timed()
+def pipelined_ingest_html_files(session, files: list, program: str = None, workers: int = None,
+                                parser: str = "html.parser", queue_size: int = 4):
+    """
+    Pipelined version of ingest_html_files(): instead of running each stage
+    over all files before the next one, stages overlap and hand files over
+    through bounded queues (so at most a few files per stage are in memory):
+
+        1. file reads: mtime check and content hash against the manifest (thread)
+        2. html parsing (process pool, started with forkserver where available)
+        3. curation of the sets of every block (thread)
+        4. db writes (calling thread, one transaction per file)
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            files (list): html files (str or path) to ingest
+            program (str): the gym program description name
+            workers (int): number of parsing processes (None for all cores,
+                           1 to parse in the curation thread)
+            parser (str): BeautifulSoup parser backend
+            queue_size (int): max files waiting between two stages
+
+        Returns:
+            stats (dict): same as ingest_html_files()
+    """
+    start = time.perf_counter()
+    manifest = read_manifest(session)
+    files = list(files)
+
+    stop = threading.Event()
+    executor = None
+    if workers != 1:
+        # Workers are started by the first submit(), in the curation thread
+        # while the reader thread runs: forking this multi-threaded process
+        # may deadlock them, so they are forked from a clean server process
+        start_method = ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                        else "spawn")
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context(start_method))
+    # Keep every worker busy while the next stages catch up
+    in_flight = max(queue_size, workers or os.cpu_count() or 1)
+    n_loaded, n_sets, touched, program_id = 0, 0, [], None
+    try:
+        changed_files = _threaded(iter_changed_files(manifest, files), queue_size, stop)
+        parsed_files = _parse_changed_files(changed_files, executor, parser, in_flight)
+        curated_files = _threaded(_curate_parsed_files(parsed_files), queue_size, stop)
+        for (file, path, mtime, content_hash, changed), blocks in curated_files:
+            if not changed:
+                touched.append({"b_file_path": path, "mtime": mtime})
+                continue
+            if program_id is None:
+                program_id = get_program_id(session, program)
+            n_sets += write_ingested_file(session, program_id, path, mtime, content_hash, blocks)
+            n_loaded += 1
+        touch_manifest(session, touched)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        stop.set()
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+
+    return {"skipped": len(files) - n_loaded,
+            "loaded": n_loaded,
+            "sets": n_sets,
+            "seconds": elapsed,
+            "rows_per_sec": n_sets / elapsed if elapsed else 0.0}
+
+
+def sheet_titles(block_descs):
+    """
+    Sheet title of every block in the log file of its program. Excel sheet
+    names are case-insensitive (openpyxl silently renames a sheet to
+    "<name>1" if another one only differs in case), so blocks whose names
+    clash get a " (2)", " (3)"... suffix, in block order. Log files are
+    written and read with the same titles.
+
+        Parameters:
+            block_descs (iterable): block descriptions, in block_id order
+
+        Returns:
+            titles (dict): block_desc --> sheet title
+    """
+    titles, used = {}, set()
+    for block_desc in block_descs:
+        if block_desc in titles:
+            continue
+        base = INVALID_SHEET_CHARS.sub("_", block_desc)[:SHEET_TITLE_LENGTH]
+        title, n = base, 1
+        while title.lower() in used:
+            n += 1
+            suffix = f" ({n})"
+            title = base[:SHEET_TITLE_LENGTH - len(suffix)] + suffix
+        used.add(title.lower())
+        titles[block_desc] = title
+
+    return titles
+
+
+def program_sheet_titles(session, program_id: int):
+    """sheet_titles() of the blocks of a program"""
+    return sheet_titles(row[0] for row in session.execute(
+        select(Block.block_desc).where(Block.program_id == program_id).order_by(Block.block_id)
+    ))
+
+
+def _check_sheet_title(title: str, sheet_names):
+    """Raises ValueError if a sheet only differing in case is already in the book"""
+    for sheet_name in sheet_names:
+        if sheet_name != title and sheet_name.lower() == title.lower():
+            raise ValueError(f"Sheet {title} clashes with sheet {sheet_name} of the log file "
+                             f"(sheet names are case-insensitive)! Rename one of them.")
+
+
+@timed()
+def stream_program_excel(session, program_id: int, file):
+    """
+    Writes the program planning Excel file (same layout as the one from
+    generate_program_excel()) pulling every set of the program in one ordered
+    query and writing sheets with a write-only (constant memory) workbook.
+    Sheets already in the file are kept as they are (rows are streamed into
+    the new file), so logs filled in them are not lost.
 
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): Program identifier
+            file (str or path): Excel file to (re)write
+    """
+    file = Path(file)
+    tmp_file = file.with_name(f"~{file.name}")
+    book = Workbook(write_only=True)
+    bold = Font(bold=True)
+
+    def bold_cells(sheet, values):
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = bold
+            cells.append(cell)
+        return cells
+
+    # Copy existing sheets row by row (read-only mode doesn't load the whole book)
+    existing_sheets = set()
+    if file.is_file():
+        old_book = load_workbook(file, read_only=True)
+        for old_sheet in old_book.worksheets:
+            sheet = book.create_sheet(old_sheet.title)
+            for row in old_sheet.iter_rows(values_only=True):
+                sheet.append(row)
+            existing_sheets.add(old_sheet.title)
+        old_book.close()
+
+    rows = session.execute(
+        select(Block.block_id, Block.block_desc, Workout.workout_id,
+               Workout.date_workout, Workout.workout_desc,
+               Workout_set.workout_set_id, Exercise.exercise_desc, Workout_set.set_id,
+               Workout_set.no_reps, Workout_set.weight, Workout_set.perc_rm,
+               Workout_set.min_rpe, Workout_set.max_rpe, Workout_set.rest_min)
+        .select_from(Block)
+        .join(Workout, Workout.block_id == Block.block_id)
+        .outerjoin(Workout_set, Workout_set.workout_id == Workout.workout_id)
+        .outerjoin(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .where(Block.program_id == program_id)
+        .order_by(Block.block_id, Workout.workout_id, Workout_set.workout_set_id)
+    )
+
+    titles = program_sheet_titles(session, program_id)
+    for (_, block_name), block_rows in groupby(rows, key=itemgetter(0, 1)):
+        title = titles[block_name]
+        if title in existing_sheets:
+            continue
+        _check_sheet_title(title, existing_sheets)
+        sheet = book.create_sheet(title)
+        for n_workout, (_, wod_rows) in enumerate(groupby(block_rows, key=itemgetter(2))):
+            wod_rows = list(wod_rows)
+            # Empty row between workouts
+            if n_workout:
+                sheet.append([])
+            date_workout, workout_desc = wod_rows[0][3:5]
+            for label, value in zip(LOG_HEADER_ROWS, [date_workout, workout_desc]):
+                sheet.append(bold_cells(sheet, [label]) + [value])
+            for label in LOG_HEADER_ROWS[2:]:
+                sheet.append(bold_cells(sheet, [label]))
+            sheet.append(bold_cells(sheet, LOG_SET_COLS))
+            for row in wod_rows:
+                # Workout without sets (outer join)
+                if row[5] is not None:
+                    sheet.append(row[5:])
+
+    book.save(tmp_file)
+    os.replace(tmp_file, file)
+
+
+def load_program_tree(session, program: int or str):
+    """
+    Loads a program with its blocks, workouts, sets (with their exercise
+    and log set) and workout logs in a fixed number of queries, one per
+    level (selectinload), whatever the size of the program. The tree can
+    then be walked (and printed) without further queries.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program (int or str): Program identifier integer or description
+
+        Returns:
+            program (Program): program with all its relationships loaded
+    """
+    program_id = lookup_program_id(session, program) if isinstance(program, str) else program
+
+    workouts = selectinload(Program.blocks).selectinload(Block.workouts)
+    program = session.execute(
+        select(Program)
+        .where(Program.program_id == program_id)
+        .options(workouts.selectinload(Workout.workout_sets).selectinload(Workout_set.log_set),
+                 workouts.selectinload(Workout.log_workout).selectinload(Log_workout.log_sets))
+    ).unique().scalar_one_or_none()
+    if program is None:
+        raise KeyError(f"Program ({program_id}) doesn't exist!")
+
+    return program
+
+
+@timed()
 def generate_program_excel(session, program: int or str,
-                           output_dir="/mnt/c/Users/gonza/OneDrive/Gym/routines_log/"):
+                           output_dir="/mnt/c/Users/gonza/OneDrive/Gym/routines_log/",
+                           write_only: bool = False):
     """
     Generates Excel file (.xlsx) with Program planning. Each program block
     is a different sheet with all the corresponding workouts.
@@ -205,63 +1170,60 @@ def generate_program_excel(session, program: int or str,
             program (int or str): Program identifier integer or description
                                   from database
             output_dir (str): Directory to store generated file
+            write_only (bool): use stream_program_excel() (one query and
+                               constant memory) instead of pandas
     """
     # If program description provided, get id
     if isinstance(program, str):
-        program_id = (
-            session.query(Program.program_id)
-            .filter_by(program_desc=program)
-            .scalar()
-        )
+        program_id = lookup_program_id(session, program)
     # If numeric or otherwise
     else:
         program_id = program
 
     # To check if valid id
-    try:
-        program = session.query(Program).filter_by(program_id=program_id).one()
-    except NoResultFound:
-        raise KeyError(f"Program_id ({program_id}) doesn't exist!")
+    if write_only:
+        try:
+            program = session.query(Program).filter_by(program_id=program_id).one()
+        except NoResultFound:
+            raise KeyError(f"Program_id ({program_id}) doesn't exist!")
+    else:
+        # Whole program in a few queries, instead of one per block and workout
+        program = load_program_tree(session, program_id)
 
     program_name = program.program_desc if program.program_desc else f"Program_{program.program_id}"
 
     file = output_dir + program_name + ".xlsx"
 
+    if write_only:
+        return stream_program_excel(session, program_id, file)
+
     if Path(file).is_file():
         # raise FileExistsError(f"{file.name} already exists in {file.parent}!")
         book = load_workbook(file)
     else:
         book = None
 
+    titles = sheet_titles(program_block.block_desc for program_block in program.blocks)
     with pd.ExcelWriter(file, engine="openpyxl") as writer:
-        program_blocks = session.query(Block).filter_by(program_id=program_id).all()
-        for program_block in program_blocks:
-            block_name = program_block.block_desc
+        for program_block in program.blocks:
+            block_name = titles[program_block.block_desc]
             # Load existing excel file into current if exists...
             if book:
                 writer.book = book
             if block_name not in writer.book.sheetnames:
+                _check_sheet_title(block_name, writer.book.sheetnames)
                 start_row = 0
                 for workout in program_block.workouts:
                     df_workout_header = pd.DataFrame([workout.date_workout, workout.workout_desc,
                                                       None, None, None],
                                                      index=["Fecha", "Descripción", "Duración (min)",
                                                             "RPE general", "Comentario general"])
-                    df_workout = pd.read_sql(
-                        session.query(Workout_set.workout_set_id.label("ID"),
-                                      Exercise.exercise_desc.label("Ejercicio"),
-                                      Workout_set.set_id.label("Serie"),
-                                      Workout_set.no_reps.label("Repeticiones"),
-                                      Workout_set.weight.label("Peso (kg)"),
-                                      Workout_set.perc_rm.label("% 1RM"),
-                                      Workout_set.min_rpe.label("RPE mín."),
-                                      Workout_set.max_rpe.label("RPE máx."),
-                                      Workout_set.rest_min.label("Descanso (min)"))
-                        .join(Exercise.workout_sets)
-                        .filter(Workout_set.workout_id == workout.workout_id)
-                        .order_by(Workout_set.workout_set_id)
-                        .statement,
-                        session.bind)
+                    df_workout = pd.DataFrame(
+                        [(ws.workout_set_id, ws.exercise.exercise_desc, ws.set_id, ws.no_reps,
+                          ws.weight, ws.perc_rm, ws.min_rpe, ws.max_rpe, ws.rest_min)
+                         for ws in workout.workout_sets],
+                        columns=LOG_SET_COLS[:9]
+                    )
 
                     # Add log fields (the No. Sets, No. Reps, Weight and RPE should be replaced
                     # if needed)
@@ -277,6 +1239,7 @@ def generate_program_excel(session, program: int or str,
                     start_row += (df_workout.shape[0] + 2)
 
 
+@timed()
 def load_log_data(session, log_file):
     """
     Load log data from Excel file (containing whole program) into db.
@@ -289,11 +1252,20 @@ def load_log_data(session, log_file):
     # 1st. Get log file name to assign to correct Program
     program_desc = Path(log_file).stem
 
-    if not session.query(Program).filter(Program.program_desc == program_desc).one_or_none():
+    program_id = lookup_program_id(session, program_desc)
+    if program_id is None:
         raise KeyError(f"No record for {program_desc}!")
+    # Block of every sheet title
+    sheet_blocks = {title: block_desc for block_desc, title
+                    in program_sheet_titles(session, program_id).items()}
 
     # 2nd. Iterate through blocks
-    for block_desc, df_block in pd.read_excel(log_file, sheet_name=None, header=None).items():
+    logged_workout_ids = []
+    for sheet_title, df_block in pd.read_excel(log_file, sheet_name=None, header=None).items():
+        if sheet_title not in sheet_blocks:
+            raise KeyError(f"Sheet {sheet_title} of the log file matches no block of the "
+                           f"program! Blocks: {list(sheet_blocks)}")
+        block_desc = sheet_blocks[sheet_title]
 
         # Now we separate between header and body info (to log_workout and log_set, respectively)
         idx = df_block.index[df_block.isna().all(axis=1)].tolist()
@@ -317,6 +1289,7 @@ def load_log_data(session, log_file):
                                              Program.program_desc == program_desc)
                                      .order_by(Workout.workout_id)
                                      .all()[i].workout_id)
+                logged_workout_ids.append(workout_id)
 
                 # If log exists for workout_id, update the info
                 log_workout = (session.query(Log_workout)
@@ -367,31 +1340,695 @@ def load_log_data(session, log_file):
                                           comment_set=row["Comentarios"])
                         session.add(log_set)
 
+    # Update volume summaries of the logged blocks
+    session.flush()
+    refresh_workout_summaries(session, logged_workout_ids)
+
     session.commit()
 
 
-def main():
-    """Main entry point of the program"""
+def _to_python(value):
+    """Casts numpy/pandas scalar to python type (NaN/NaT --> None)"""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def iter_log_workouts(df_block):
+    """
+    Splits a block sheet of the log Excel file (read with header=None) into
+    its workouts, the same way load_log_data() does, skipping the ones with
+    a future date.
+
+        Parameters:
+            df_block (pandas.DataFrame): sheet of the log file
+
+        Yields:
+            i (int): position of the workout in the sheet
+            df_wod_header (pandas.Series): workout header (log_workout info)
+            df_exer_done (pandas.DataFrame): sets marked as done (log_set info)
+    """
+    idx = df_block.index[df_block.isna().all(axis=1)].tolist()
+    idx_mod = [-1] + idx + [len(df_block)]
+
+    for i in range(len(idx_mod)-1):
+        df_wod = df_block.iloc[idx_mod[i]+1:idx_mod[i+1]]
+
+        df_wod_header = (df_wod.loc[df_wod.iloc[:, 2:].isna().all(axis=1)]
+                               .dropna(axis=1, how="all")
+                               .set_index(0).squeeze())
+        if not df_wod_header["Fecha"] <= datetime.today():
+            continue
+
+        df_wod_exer = df_wod.loc[df_wod.iloc[:, 2:].notna().any(axis=1)]
+        df_wod_exer.columns = df_wod_exer.iloc[0]
+        df_wod_exer = df_wod_exer.iloc[1:]
+        df_exer_done = df_wod_exer.loc[df_wod_exer[["¿Hecho?", "RPE"]].notnull().any(axis=1)]
+
+        yield i, df_wod_header, df_exer_done
+
+
+@timed()
+def read_log_workouts(log_file):
+    """
+    Reads workouts of the log Excel file with pandas (every sheet is loaded
+    as a whole DataFrame).
+
+        Parameters:
+            log_file (str or path): the Excel file that contains the info
+
+        Yields:
+            sheet_title (str): sheet title (block, see sheet_titles())
+            i (int): position of the workout in the sheet
+            header (dict): workout header (log_workout info)
+            sets (list): dicts of sets marked as done (log_set info)
+    """
+    with pd.ExcelFile(log_file) as excel:
+        for sheet_title in excel.sheet_names:
+            df_block = excel.parse(sheet_title, header=None)
+            for i, df_wod_header, df_exer_done in iter_log_workouts(df_block):
+                yield sheet_title, i, df_wod_header.to_dict(), df_exer_done.to_dict("records")
+
+
+@timed()
+def stream_log_workouts(log_file, skip_sheets=(), next_dates: dict = None):
+    """
+    Streaming version of read_log_workouts(), built on openpyxl read-only
+    iter_rows. Workouts are split on blank rows while reading and, as they
+    are sorted by date, a sheet stops being read at the first future workout.
+
+        Parameters:
+            log_file (str or path): the Excel file that contains the info
+            skip_sheets (iterable): names of sheets not to read
+            next_dates (dict): if provided, filled with the date of the first
+                               future workout of every sheet read (None if
+                               all are past)
+
+        Yields:
+            same as read_log_workouts()
+    """
+    today = datetime.today()
+    if next_dates is None:
+        next_dates = {}
+
+    book = load_workbook(log_file, read_only=True)
+    try:
+        for sheet in book.worksheets:
+            if sheet.title in skip_sheets:
+                continue
+            next_dates[sheet.title] = None
+            i, header, columns, sets = 0, {}, None, []
+            # Empty row at the end to close the last workout
+            for row in chain(sheet.iter_rows(values_only=True), [()]):
+                if all(value is None for value in row):
+                    if header or columns:
+                        if header.get("Fecha") is not None:
+                            yield sheet.title, i, header, sets
+                        i += 1
+                    header, columns, sets = {}, None, []
+                # Header rows only have label and value (log_workout info)...
+                elif all(value is None for value in row[2:]):
+                    header[row[0]] = row[1] if len(row) > 1 else None
+                    if row[0] == "Fecha" and row[1] is not None and row[1] > today:
+                        next_dates[sheet.title] = row[1]
+                        break
+                # ... and body rows are the sets (log_set info)
+                elif columns is None:
+                    columns = row
+                else:
+                    # Trailing empty cells may not be in the row
+                    set_row = dict(zip(columns, chain(row, repeat(None))))
+                    if set_row.get("¿Hecho?") is not None or set_row.get("RPE") is not None:
+                        sets.append(set_row)
+    finally:
+        book.close()
+
+
+def sheet_checksums(excel_file):
+    """
+    Returns a CRC32 of each sheet of an .xlsx file (a zip archive), by sheet
+    name: the CRC of its xml part combined with the one of the shared
+    strings part, as text cells only hold an index into it (editing a
+    comment may leave the sheet part unchanged). It only reads the zip
+    directory, not the sheets.
+    """
+    main_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    rel_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+    def part_path(target):
+        return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+    with zipfile.ZipFile(excel_file) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+        shared_strings_crc = 0
+        for rel in rels:
+            if rel.get("Type", "").endswith("/sharedStrings"):
+                shared_strings_crc = archive.getinfo(part_path(rel.get("Target"))).CRC
+
+        checksums = {}
+        for sheet in workbook.iter(f"{main_ns}sheet"):
+            sheet_crc = archive.getinfo(part_path(targets[sheet.get(f"{rel_ns}id")])).CRC
+            checksums[sheet.get("name")] = zlib.crc32(sheet_crc.to_bytes(4, "little"),
+                                                      shared_strings_crc)
+
+    return checksums
+
+
+def _log_workout_row(workout_id: int, header: dict):
+    """log_workout row of a workout header of the log file"""
+    return {"workout_id": workout_id,
+            "date_workout_done": _to_python(header["Fecha"]),
+            "duration_min": _to_python(header.get("Duración (min)")),
+            "intensity": _to_python(header.get("RPE general")),
+            "comment_workout": _to_python(header.get("Comentario general"))}
+
+
+def _log_set_row(workout_id: int, row: dict):
+    """log_set row (with workout_id, see upsert_logs()) of a set of the log file"""
+    return {"workout_id": workout_id,
+            "workout_set_id": int(row["ID"]),
+            "no_reps_done": _to_python(row.get("Repeticiones")),
+            "weight_done": _to_python(row.get("Peso (kg)")),
+            "rpe_done": _to_python(row.get("RPE")),
+            "comment_set": _to_python(row.get("Comentarios"))}
+
+
+def block_workout_ids(session, program_id: int):
+    """
+    Ordered workout ids of every block of a program (the i-th workout of a
+    sheet of the log file is the i-th workout of its block), by sheet title
+    (see sheet_titles()).
+
+        Returns:
+            block_ids (dict): sheet title --> block_id
+            block_workouts (dict): sheet title --> list of workout ids
+    """
+    titles = program_sheet_titles(session, program_id)
+    block_ids, block_workouts = {}, {}
+    for block_desc, block_id, workout_id in (session.query(Block.block_desc, Block.block_id,
+                                                           Workout.workout_id)
+                                                    .join(Workout.block)
+                                                    .filter(Block.program_id == program_id)
+                                                    .order_by(Workout.workout_id)):
+        block_ids[titles[block_desc]] = block_id
+        block_workouts.setdefault(titles[block_desc], []).append(workout_id)
+
+    return block_ids, block_workouts
 
-    MACRO_NAME = "Macro Pisano"
-    LOGS_DIR = "/mnt/c/Users/gonza/OneDrive/Gym/routines_log/"
 
-    # Connect to the database using SQLAlchemy
-    # sqlite_filepath = Path("./../gym_database.db").resolve()
-    engine = create_engine(f"sqlite:///data/db/gym_database.db")
-    Session = sessionmaker(bind=engine)
-    session = Session()
+def log_rows(workouts, block_workouts: dict):
+    """
+    log_workout and log_set rows (see upsert_logs()) of the workouts read
+    from a log file.
+
+        Parameters:
+            workouts (iterable): items of read_log_workouts() or
+                                 stream_log_workouts()
+            block_workouts (dict): as returned by block_workout_ids()
+
+        Returns:
+            log_workouts (list), log_sets (list): row dicts
+    """
+    log_workouts, log_sets = [], []
+    for sheet_title, i, header, sets in workouts:
+        if sheet_title not in block_workouts:
+            raise KeyError(f"Sheet {sheet_title} of the log file matches no block of the "
+                           f"program! Blocks: {list(block_workouts)}")
+        if i >= len(block_workouts[sheet_title]):
+            raise KeyError(f"Sheet {sheet_title} of the log file has more workouts than its "
+                           f"block ({len(block_workouts[sheet_title])})!")
+        workout_id = block_workouts[sheet_title][i]
+        log_workouts.append(_log_workout_row(workout_id, header))
+        log_sets.extend(_log_set_row(workout_id, row) for row in sets)
+
+    return log_workouts, log_sets
+
+
+@timed()
+def upsert_logs(session, log_workouts: list, log_sets: list):
+    """
+    Writes log_workout and log_set rows with INSERT ... ON CONFLICT DO UPDATE
+    batches (on the unique workout_id and workout_set_id, respectively),
+    without committing.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            log_workouts (list): log_workout row dicts (with workout_id)
+            log_sets (list): log_set row dicts, with the workout_id of their
+                             workout instead of log_workout_id
 
-    # Add blocks (html files) from "data/" folder
-    html_files = [x for x in Path("data/").glob("*.html") if x.is_file()]
-    for file in html_files:
-        add_block(session, file, MACRO_NAME)
+        Returns:
+            n_rows (int): number of log rows written
+    """
+    if log_workouts:
+        lw = Log_workout.__table__
+        stmt = sqlite_insert(lw)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[lw.c.workout_id],
+                set_={"date_workout_done": stmt.excluded.date_workout_done,
+                      "duration_min": stmt.excluded.duration_min,
+                      "intensity": stmt.excluded.intensity,
+                      "comment_workout": stmt.excluded.comment_workout,
+                      "date_reg": current_timestamp()}
+            ),
+            log_workouts
+        )
+
+    if log_sets:
+        # Real log_workout ids of the (new or updated) log workouts in one query
+        log_workout_ids = dict(
+            session.query(Log_workout.workout_id, Log_workout.log_workout_id)
+            .filter(Log_workout.workout_id.in_({row["workout_id"] for row in log_sets}))
+        )
+        ls = Log_set.__table__
+        stmt = sqlite_insert(ls)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[ls.c.workout_set_id],
+                set_={col: stmt.excluded[col]
+                      for col in ("log_workout_id", "no_reps_done", "weight_done",
+                                  "rpe_done", "comment_set")}
+            ),
+            [{"log_workout_id": log_workout_ids[row["workout_id"]],
+              **{col: value for col, value in row.items() if col != "workout_id"}}
+             for row in log_sets]
+        )
+
+    return len(log_workouts) + len(log_sets)
 
-    # Create excel for macrocycle recording
-    generate_program_excel(session, MACRO_NAME, LOGS_DIR)
 
-    # Load excel records into db
-    load_log_data(session, LOGS_DIR + MACRO_NAME + ".xlsx")
+def write_workout_log(session, workout_id: int, header: dict, sets: list):
+    """
+    Upserts the log of one workout (as an app would post it) and refreshes
+    the summaries of its block, without committing.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            workout_id (int): logged workout
+            header (dict): workout header, with the labels of the log file
+                           ("Fecha", "Duración (min)", "RPE general",
+                           "Comentario general")
+            sets (list): dicts of the sets done, with the labels of the log
+                         file ("ID", "Repeticiones", "Peso (kg)", "RPE",
+                         "Comentarios")
+
+        Returns:
+            n_rows (int): number of log rows written
+    """
+    set_ids = {int(row["ID"]) for row in sets}
+    workout_set_ids = {
+        row[0] for row in
+        session.query(Workout_set.workout_set_id).filter(Workout_set.workout_id == workout_id)
+    }
+    if not workout_set_ids:
+        raise KeyError(f"Workout ({workout_id}) doesn't exist!")
+    if not set_ids <= workout_set_ids:
+        raise ValueError(f"Sets {sorted(set_ids - workout_set_ids)} "
+                         f"aren't sets of workout {workout_id}!")
+    if header.get("Fecha") is None or pd.Timestamp(header["Fecha"]) > datetime.today():
+        raise ValueError(f"Workout {workout_id} can't be logged "
+                         f"with date {header.get('Fecha')}!")
+
+    n_rows = upsert_logs(session, [_log_workout_row(workout_id, header)],
+                         [_log_set_row(workout_id, row) for row in sets])
+    refresh_workout_summaries(session, [workout_id])
+
+    return n_rows
+
+
+@timed()
+def sync_log_data(session, log_file, streaming: bool = False, skip_unchanged: bool = False):
+    """
+    Bulk version of load_log_data(). Ordered workout ids of every block are
+    resolved in one query and all log_workout/log_set changes are applied
+    with INSERT ... ON CONFLICT DO UPDATE batches in one transaction.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            log_file (str or path): the Excel file that contains the info
+            streaming (bool): read the file with stream_log_workouts() instead
+                              of pandas
+            skip_unchanged (bool): skip sheets whose content is unchanged since
+                                   last sync, unless some of their workouts
+                                   have become past since (streaming only)
+
+        Returns:
+            stats (dict): number of log rows written, sheets skipped, elapsed
+                          seconds and rows per second
+    """
+    if skip_unchanged and not streaming:
+        raise ValueError("skip_unchanged is only available with streaming reader!")
+
+    start = time.perf_counter()
+
+    # 1st. Get log file name to assign to correct Program
+    program_desc = Path(log_file).stem
+    program_id = lookup_program_id(session, program_desc)
+    if program_id is None:
+        raise KeyError(f"No record for {program_desc}!")
+
+    # 2nd. Ordered workout ids of every block of the program
+    block_ids, block_workouts = block_workout_ids(session, program_id)
+
+    # Sheets unchanged since last sync (and with no workout become past)
+    skip_sheets, next_dates = set(), {}
+    if streaming:
+        checksums = sheet_checksums(log_file)
+    if skip_unchanged:
+        synced = {
+            row.block_id: row for row in
+            session.query(Log_sheet_manifest)
+            .filter(Log_sheet_manifest.block_id.in_(block_ids.values()))
+        }
+        for sheet_title, block_id in block_ids.items():
+            entry = synced.get(block_id)
+            if (entry and entry.sheet_crc == checksums.get(sheet_title)
+                    and (entry.next_date is None or entry.next_date > datetime.today().date())):
+                skip_sheets.add(sheet_title)
+
+    if streaming:
+        workouts = stream_log_workouts(log_file, skip_sheets, next_dates)
+    else:
+        workouts = read_log_workouts(log_file)
+
+    # 3rd. Collect log rows of every (past) workout of every block
+    log_workouts, log_sets = log_rows(workouts, block_workouts)
+
+    # 4th. Apply everything in one transaction
+    try:
+        n_rows = upsert_logs(session, log_workouts, log_sets)
+        refresh_workout_summaries(session, [row["workout_id"] for row in log_workouts])
+        if streaming:
+            manifest_table = Log_sheet_manifest.__table__
+            for sheet_title, next_date in next_dates.items():
+                if sheet_title not in block_ids:
+                    continue
+                values = {"sheet_crc": checksums[sheet_title],
+                          "next_date": next_date.date() if next_date else None}
+                session.execute(
+                    sqlite_insert(manifest_table)
+                    .values(block_id=block_ids[sheet_title], **values)
+                    .on_conflict_do_update(index_elements=["block_id"], set_=values)
+                )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+
+    return {"rows": n_rows,
+            "skipped_sheets": len(skip_sheets),
+            "seconds": elapsed,
+            "rows_per_sec": n_rows / elapsed if elapsed else 0.0}
+
+
+def read_flat_log_chunks(log_file, chunk_size: int = 10000):
+    """
+    Reads a flat log file (.csv, or .parquet if pyarrow is installed) in
+    chunks, so files of any size are read in bounded memory.
+
+        Parameters:
+            log_file (str or path): the .csv or .parquet log file
+            chunk_size (int): rows per chunk
+
+        Yields:
+            df_chunk (pandas.DataFrame): next chunk_size rows of the file
+    """
+    suffix = Path(log_file).suffix.lower()
+    if suffix == ".csv":
+        yield from pd.read_csv(log_file, chunksize=chunk_size, parse_dates=["Fecha"])
+    elif suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet log files need pyarrow (pip install pyarrow)!")
+        for batch in pq.ParquetFile(log_file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unknown flat log file format ({suffix})! Use .csv or .parquet")
+
+
+def iter_flat_log_workouts(log_file, chunk_size: int = 10000):
+    """
+    Splits a flat log file into workouts. The file has one row per set,
+    keyed by workout_set_id ("ID" column, with "Repeticiones", "Peso (kg)",
+    "RPE" and "Comentarios" of the log), and before the sets of every
+    workout a header row without "ID" ("Fecha", "Duración (min)",
+    "RPE general" and "Comentario general"). Other columns are ignored, and
+    if there is a "¿Hecho?" column only sets marked as done (or with RPE)
+    are kept, like in the Excel file.
+
+        Parameters:
+            log_file (str or path): the .csv or .parquet log file
+            chunk_size (int): rows read at once (see read_flat_log_chunks())
+
+        Yields:
+            header (dict): workout header (log_workout info)
+            sets (list): dicts of sets of the workout (log_set info), all
+                         of them (done or not) for the first one
+            done (list): dicts of sets marked as done
+    """
+    header, sets = None, []
+    for df_chunk in read_flat_log_chunks(log_file, chunk_size):
+        if "ID" not in df_chunk.columns or "Fecha" not in df_chunk.columns:
+            raise KeyError(f"{Path(log_file).name} needs 'ID' and 'Fecha' columns!")
+        has_done = "¿Hecho?" in df_chunk.columns
+        df_chunk = df_chunk.astype(object).where(df_chunk.notna(), None)
+        for row in df_chunk.to_dict("records"):
+            if row["ID"] is None:
+                if header is not None:
+                    yield header, sets, [r for r in sets if not has_done or _is_done(r)]
+                header, sets = row, []
+            elif header is None:
+                raise ValueError(f"Set {row['ID']} of {Path(log_file).name} "
+                                 f"has no workout header row before!")
+            else:
+                sets.append(row)
+    if header is not None:
+        yield header, sets, [r for r in sets if not has_done or _is_done(r)]
+
+
+def _is_done(row: dict):
+    return row.get("¿Hecho?") is not None or row.get("RPE") is not None
+
+
+def _upsert_flat_workouts(session, workouts: list):
+    """
+    Upserts a batch of iter_flat_log_workouts() items, resolving the workout
+    of every header from its sets in one query, without committing.
+
+        Returns:
+            n_rows (int): number of log rows written
+            workout_ids (list): ids of the logged workouts
+    """
+    set_ids = {int(row["ID"]) for _, sets, _ in workouts for row in sets}
+    set_workouts = dict(
+        session.query(Workout_set.workout_set_id, Workout_set.workout_id)
+        .filter(Workout_set.workout_set_id.in_(set_ids))
+    )
+    missing = set_ids - set(set_workouts)
+    if missing:
+        raise KeyError(f"No record for workout_set_id {sorted(missing)[:10]}!")
+
+    today = datetime.today()
+    log_workouts, log_sets = [], []
+    for header, sets, done in workouts:
+        # A header without sets can't be matched to its workout
+        if not sets:
+            continue
+        workout_id = set_workouts[int(sets[0]["ID"])]
+        if any(set_workouts[int(row["ID"])] != workout_id for row in sets):
+            raise ValueError(f"Sets of different workouts under the same header "
+                             f"(workout_set_id {sets[0]['ID']})!")
+        # Check if it is even possible to have a record (past date condition)
+        if header["Fecha"] is None or pd.Timestamp(header["Fecha"]) > today:
+            continue
+        log_workouts.append(_log_workout_row(workout_id, header))
+        log_sets.extend(_log_set_row(workout_id, row) for row in done)
+
+    return upsert_logs(session, log_workouts, log_sets), [row["workout_id"]
+                                                          for row in log_workouts]
+
+
+@timed()
+def sync_flat_log_data(session, log_file, chunk_size: int = 10000):
+    """
+    Loads a flat .csv or .parquet log file (see iter_flat_log_workouts())
+    into log_workout and log_set, without the Excel round trip. The file is
+    read in chunks and upserted in batches of about chunk_size rows, all in
+    one transaction.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            log_file (str or path): the .csv or .parquet log file
+            chunk_size (int): rows read and upserted at once (below the
+                              SQLite limit of bound parameters, 32766)
+
+        Returns:
+            stats (dict): number of log rows written, elapsed seconds and
+                          rows per second
+    """
+    start = time.perf_counter()
+
+    n_rows, workout_ids = 0, []
+    try:
+        batch, batch_rows = [], 0
+        for workout in chain(iter_flat_log_workouts(log_file, chunk_size), [None]):
+            if workout is not None:
+                batch.append(workout)
+                batch_rows += len(workout[1]) + 1
+            if batch and (workout is None or batch_rows >= chunk_size):
+                batch_n_rows, batch_workout_ids = _upsert_flat_workouts(session, batch)
+                n_rows += batch_n_rows
+                workout_ids += batch_workout_ids
+                batch, batch_rows = [], 0
+        refresh_workout_summaries(session, workout_ids)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+
+    return {"rows": n_rows,
+            "seconds": elapsed,
+            "rows_per_sec": n_rows / elapsed if elapsed else 0.0}
+
+
+def prepare_database(db_path: str = DB_PATH):
+    """
+    Creates the missing tables, columns and indexes (e.g. on older dbs) and
+    fills the volume summaries of a db loaded before they existed.
+    """
+    create_indexes(get_engine(db_path))
+    session = get_session(db_path)
+    if not session.query(Block_summary).first() and session.query(Block).first():
+        rebuild_summaries(session)
+    session.close()
+
+
+def command_ingest(args):
+    """Adds new or changed blocks (html files) of the data directory"""
+    session = get_session(args.db, args.engine_profile or STAGE_PROFILES["ingest"])
+    session.info["match_threshold"] = args.match_threshold if args.match else None
+    html_files = [x for x in Path(args.data_dir).glob("*.html") if x.is_file()]
+    if args.no_pipeline:
+        stats = ingest_html_files(session, html_files, args.program, args.workers, args.parser)
+    else:
+        stats = pipelined_ingest_html_files(session, html_files, args.program, args.workers,
+                                            args.parser, args.queue_size)
+    print(f"{stats['loaded']} files loaded, {stats['skipped']} unchanged: "
+          f"{stats['sets']} sets written ({stats['rows_per_sec']:.0f} rows/s)")
+    for alias, exercise_id, exercise_desc, score in session.info.get("exercise_aliases", []):
+        print(f"Exercise alias: {alias} --> {exercise_desc} (id {exercise_id}, {score:.2f})")
+
+
+def command_export(args):
+    """Creates (or completes) the Excel log file of the program"""
+    session = get_session(args.db, args.engine_profile or STAGE_PROFILES["export"])
+    generate_program_excel(session, args.program, os.path.join(args.logs_dir, ""),
+                           write_only=not args.pandas)
+
+
+def command_sync_logs(args):
+    """Loads the Excel log records of the program and updates personal records"""
+    session = get_session(args.db, args.engine_profile or STAGE_PROFILES["sync_logs"])
+    if getattr(args, "log_file", None):
+        stats = sync_flat_log_data(session, args.log_file, args.chunk_size)
+    else:
+        stats = sync_log_data(session, Path(args.logs_dir) / f"{args.program}.xlsx",
+                              streaming=not args.pandas, skip_unchanged=not args.pandas)
+    print(f"{stats['rows']} log rows synced ({stats['rows_per_sec']:.0f} rows/s)")
+
+    # Look for new personal records in the synced logs
+    print(f"{update_prs(session)} new personal records")
+
+
+def command_all(args):
+    """Ingests html files, exports the program and syncs its logs"""
+    command_ingest(args)
+    command_export(args)
+    command_sync_logs(args)
+
+
+def main():
+    """Gym programs database: html ingest, Excel log export and log sync"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--athlete",
+                        help="use the shard database of this athlete instead of --db "
+                             "(created if it doesn't exist)")
+    parser.add_argument("--shards-dir", default=SHARDS_DIR,
+                        help="directory of the athlete shard files")
+    parser.add_argument("--engine-profile", choices=list(PROFILES),
+                        help="engine profile of every stage (by default, the one of "
+                             "STAGE_PROFILES for each stage)")
+    parser.add_argument("--profile", choices=["console", "json"],
+                        help="report stage timings and SQL statements (or GYM_PROFILE)")
+    parser.add_argument("--profile-output", help="file for the json report (or GYM_PROFILE_OUTPUT)")
+    parser.add_argument("--cprofile", help="file to dump cProfile stats into (or GYM_CPROFILE)")
+
+    program_options = argparse.ArgumentParser(add_help=False)
+    program_options.add_argument("--program", required=True, help="program description")
+
+    ingest_options = argparse.ArgumentParser(add_help=False)
+    ingest_options.add_argument("--data-dir", default="data/",
+                                help="directory of the coach html files")
+    ingest_options.add_argument("--workers", type=int,
+                                help="html parsing processes (all cores by default)")
+    ingest_options.add_argument("--parser", default="html.parser",
+                                choices=["html.parser", "lxml", "stream"])
+    ingest_options.add_argument("--queue-size", type=int, default=4,
+                                help="max files waiting between two ingest stages")
+    ingest_options.add_argument("--no-pipeline", action="store_true",
+                                help="run ingest stages one after the other")
+    ingest_options.add_argument("--match", action="store_true",
+                                help="merge new exercise names into the existing exercise "
+                                     "they are a variant of (as aliases), instead of adding "
+                                     "them as new exercises")
+    ingest_options.add_argument("--match-threshold", type=float, default=MATCH_THRESHOLD,
+                                help="minimum similarity (0 to 1) to merge a name with --match")
+
+    logs_options = argparse.ArgumentParser(add_help=False)
+    logs_options.add_argument("--logs-dir", default=".",
+                              help="directory of the Excel log files")
+    logs_options.add_argument("--pandas", action="store_true",
+                              help="use pandas to write/read the log files instead of "
+                                   "streaming them")
+
+    flat_log_options = argparse.ArgumentParser(add_help=False)
+    flat_log_options.add_argument("--log-file",
+                                  help="flat .csv/.parquet log file to load instead of "
+                                       "the Excel one (one row per set, see "
+                                       "iter_flat_log_workouts())")
+    flat_log_options.add_argument("--chunk-size", type=int, default=10000,
+                                  help="rows of the flat log file read at once")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, command, parents in [
+        ("ingest", command_ingest, [program_options, ingest_options]),
+        ("export", command_export, [program_options, logs_options]),
+        ("sync-logs", command_sync_logs, [program_options, logs_options, flat_log_options]),
+        ("all", command_all, [program_options, ingest_options, logs_options]),
+    ]:
+        subparser = commands.add_parser(name, parents=parents, help=command.__doc__,
+                                        description=command.__doc__)
+        subparser.set_defaults(function=command)
+    args = parser.parse_args()
+
+    if args.athlete:
+        args.db = str(ShardRouter(args.shards_dir).shard_path(args.athlete))
+        Path(args.db).parent.mkdir(parents=True, exist_ok=True)
+    prepare_database(args.db)
+    with profiling(args.profile, args.profile_output, args.cprofile):
+        args.function(args)
 
 
 if __name__ == "__main__":
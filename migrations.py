@@ -0,0 +1,296 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
+
+from models import Base
+
+from pathlib import Path
+import argparse
+
+
+# Hot lookup paths of the ingest, export and log sync functions in main.py
+HOT_QUERIES = {
+    "program by desc": ("SELECT program_id FROM program WHERE program_desc = :desc",
+                        {"desc": ""}),
+    "block by program and desc": ("SELECT block_id FROM block "
+                                  "WHERE program_id = :program_id AND block_desc = :desc",
+                                  {"program_id": 0, "desc": ""}),
+    "exercise by desc": ("SELECT exercise_id FROM exercise WHERE exercise_desc = :desc",
+                         {"desc": ""}),
+    "workout by block": ("SELECT workout_id FROM workout WHERE block_id = :block_id",
+                         {"block_id": 0}),
+    "workout_set by workout": ("SELECT workout_set_id FROM workout_set "
+                               "WHERE workout_id = :workout_id",
+                               {"workout_id": 0}),
+    "log_set by log_workout": ("SELECT log_set_id FROM log_set "
+                               "WHERE log_workout_id = :log_workout_id",
+                               {"log_workout_id": 0}),
+    "report (select_statements.sql)": (
+        Path(__file__).parent.joinpath("data/db/select_statements.sql").read_text().rstrip(";\n "),
+        {}
+    ),
+}
+
+# Trigram index of exercise names and aliases (see exercise_matching.py):
+# an FTS5 table kept up to date by triggers on its source tables
+SEARCH_TABLE = "exercise_search"
+SEARCH_SOURCES = [("exercise", "exercise_desc"), ("exercise_alias", "alias_desc")]
+
+
+def search_index_ddl():
+    """CREATE statements of the exercise names index and its triggers"""
+    statements = [f"CREATE VIRTUAL TABLE {SEARCH_TABLE} "
+                  f"USING fts5(name, exercise_id UNINDEXED, tokenize = 'trigram')"]
+    for table, column in SEARCH_SOURCES:
+        insert = (f"INSERT INTO {SEARCH_TABLE} (name, exercise_id) "
+                  f"VALUES (NEW.{column}, NEW.exercise_id);")
+        delete = (f"DELETE FROM {SEARCH_TABLE} "
+                  f"WHERE exercise_id = OLD.exercise_id AND name = OLD.{column};")
+        statements += [
+            f"CREATE TRIGGER {SEARCH_TABLE}_{table}_insert AFTER INSERT ON {table} "
+            f"BEGIN {insert} END",
+            f"CREATE TRIGGER {SEARCH_TABLE}_{table}_update AFTER UPDATE ON {table} "
+            f"BEGIN {delete} {insert} END",
+            f"CREATE TRIGGER {SEARCH_TABLE}_{table}_delete AFTER DELETE ON {table} "
+            f"BEGIN {delete} END",
+        ]
+
+    return statements
+
+
+def create_search_index(engine):
+    """
+    Creates and fills the exercise names index, with its triggers, if
+    missing (idempotent). SQLite builds without FTS5 or its trigram
+    tokenizer (older than 3.34) are left without it, and exercise matching
+    falls back to scoring every name.
+
+        Parameters:
+            engine (SQLAlchemy.engine object)
+
+        Returns:
+            created (bool): whether the index was created
+    """
+    if inspect(engine).has_table(SEARCH_TABLE):
+        return False
+
+    try:
+        with engine.begin() as connection:
+            for statement in search_index_ddl():
+                connection.execute(text(statement))
+            connection.execute(text(
+                f"INSERT INTO {SEARCH_TABLE} (name, exercise_id) " +
+                " UNION ALL ".join(f"SELECT {column}, exercise_id FROM {table}"
+                                   for table, column in SEARCH_SOURCES)
+            ))
+    except OperationalError:
+        # DDL isn't transactional with pysqlite: drop what was created
+        with engine.begin() as connection:
+            for table, _ in SEARCH_SOURCES:
+                for trigger_event in ("insert", "update", "delete"):
+                    connection.execute(text(
+                        f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{table}_{trigger_event}"
+                    ))
+            connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+        return False
+
+    return True
+
+
+# Change data capture (see cdc.py): tables whose changes are recorded in
+# change_log by triggers --> (row id column, workout_id of a row, as SQL
+# over the NEW or OLD row)
+CHANGE_SOURCES = {
+    "workout": ("workout_id", "{row}.workout_id"),
+    "workout_set": ("workout_set_id", "{row}.workout_id"),
+    "log_workout": ("log_workout_id", "{row}.workout_id"),
+    # The log workout of a deleted log set may be gone already (cascades)
+    "log_set": ("log_set_id", "(SELECT workout_id FROM workout_set "
+                              "WHERE workout_set_id = {row}.workout_set_id)"),
+}
+# Columns whose updates aren't changes (refreshed by every log upsert)
+CHANGE_IGNORED_COLUMNS = {"date_reg"}
+
+
+def change_triggers_ddl():
+    """
+    CREATE statements of the change data capture triggers: inserts, deletes
+    and updates that change some value of CHANGE_SOURCES tables, and
+    renames of blocks, programs and exercises (copied into the workout
+    documents), logged for each of their workouts.
+
+        Returns:
+            statements (dict): trigger name --> CREATE TRIGGER statement
+    """
+    statements = {}
+    log = "INSERT INTO change_log (table_name, row_id, workout_id, operation)"
+    for table, (id_column, workout_id) in CHANGE_SOURCES.items():
+        changed = " OR ".join(f"OLD.{column.name} IS NOT NEW.{column.name}"
+                              for column in Base.metadata.tables[table].columns
+                              if column.name not in CHANGE_IGNORED_COLUMNS)
+        for operation, (trigger_event, row, when) in {
+            "I": ("INSERT", "NEW", ""),
+            "U": ("UPDATE", "NEW", f" WHEN {changed}"),
+            "D": ("DELETE", "OLD", ""),
+        }.items():
+            name = f"change_log_{table}_{trigger_event.lower()}"
+            statements[name] = (
+                f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {trigger_event} ON {table}{when} "
+                f"BEGIN {log} VALUES ('{table}', {row}.{id_column}, "
+                f"{workout_id.format(row=row)}, '{operation}'); END"
+            )
+
+    statements["change_log_block_update"] = (
+        f"CREATE TRIGGER IF NOT EXISTS change_log_block_update AFTER UPDATE ON block "
+        f"WHEN OLD.block_desc IS NOT NEW.block_desc OR OLD.program_id IS NOT NEW.program_id "
+        f"BEGIN {log} SELECT 'block', NEW.block_id, workout_id, 'U' FROM workout "
+        f"WHERE block_id = NEW.block_id; END"
+    )
+    statements["change_log_program_update"] = (
+        f"CREATE TRIGGER IF NOT EXISTS change_log_program_update AFTER UPDATE ON program "
+        f"WHEN OLD.program_desc IS NOT NEW.program_desc "
+        f"BEGIN {log} SELECT 'program', NEW.program_id, workout_id, 'U' FROM workout "
+        f"JOIN block USING (block_id) WHERE block.program_id = NEW.program_id; END"
+    )
+    statements["change_log_exercise_update"] = (
+        f"CREATE TRIGGER IF NOT EXISTS change_log_exercise_update AFTER UPDATE ON exercise "
+        f"WHEN OLD.exercise_desc IS NOT NEW.exercise_desc "
+        f"BEGIN {log} SELECT DISTINCT 'exercise', NEW.exercise_id, workout_id, 'U' "
+        f"FROM workout_set WHERE exercise_id = NEW.exercise_id; END"
+    )
+
+    return statements
+
+
+def create_change_triggers(engine):
+    """
+    Creates the missing change data capture triggers (idempotent).
+
+        Parameters:
+            engine (SQLAlchemy.engine object)
+
+        Returns:
+            created (list): names of the triggers created
+    """
+    with engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+        created = []
+        for name, statement in change_triggers_ddl().items():
+            if name not in existing:
+                connection.execute(text(statement))
+                created.append(name)
+
+    return created
+
+
+def add_columns(engine):
+    """
+    Adds the (nullable) columns declared on the models that are missing in
+    the tables of the database (idempotent).
+
+        Parameters:
+            engine (SQLAlchemy.engine object)
+
+        Returns:
+            added (list): "table.column" names of the columns added
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise ValueError(f"Can't add NOT NULL column {table.name}.{column.name}!")
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} "
+                                        f"ADD COLUMN {column.name} {column_type}"))
+                added.append(f"{table.name}.{column.name}")
+
+    return added
+
+
+def create_indexes(engine):
+    """
+    Creates the tables, columns and indexes declared on the models that are
+    missing in the database (idempotent, existing ones are left untouched),
+    with the exercise names index and the change data capture triggers.
+
+        Parameters:
+            engine (SQLAlchemy.engine object)
+
+        Returns:
+            created (list): names of the indexes (and triggers) created
+    """
+    # Missing tables are created with their indexes
+    Base.metadata.create_all(engine)
+    add_columns(engine)
+
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    # Trigram index of exercise names (exercise_matching.py)
+    if create_search_index(engine):
+        created.append(SEARCH_TABLE)
+    # Change data capture triggers (cdc.py)
+    created += create_change_triggers(engine)
+
+    return created
+
+
+def explain_hot_queries(engine):
+    """
+    Runs EXPLAIN QUERY PLAN over the hot lookup queries.
+
+        Parameters:
+            engine (SQLAlchemy.engine object)
+
+        Returns:
+            plans (dict): query name --> list of plan steps; a step starting
+                          with "SCAN" (without "USING") is a full table scan
+    """
+    plans = {}
+    with engine.connect() as connection:
+        for name, (query, params) in HOT_QUERIES.items():
+            plans[name] = [
+                row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {query}"), params)
+            ]
+
+    return plans
+
+
+def main():
+    """Adds missing indexes to an existing database and reports query plans"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default="data/db/gym_database.db",
+                        help="SQLite database file")
+    parser.add_argument("--explain-only", action="store_true",
+                        help="only report query plans, without creating indexes")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.db}")
+
+    if not args.explain_only:
+        created = create_indexes(engine)
+        print(f"Indexes created: {', '.join(created) if created else 'none (up to date)'}")
+
+    for name, steps in explain_hot_queries(engine).items():
+        # Scanning the driving table is expected for queries without filter
+        full_scan = any(step.startswith("SCAN") and "USING" not in step
+                        for step in (steps if "WHERE" in HOT_QUERIES[name][0] else steps[1:]))
+        print(f"\n{name}{'  <-- FULL SCAN' if full_scan else ''}")
+        for step in steps:
+            print(f"    {step}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from sqlalchemy import (Column, Integer, Float, Date, String,
-                        ForeignKey, Table, UniqueConstraint, CheckConstraint)
+                        ForeignKey, Table, UniqueConstraint, CheckConstraint, Index)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.functions import current_timestamp, now
@@ -24,6 +24,7 @@ class Program(Base):
         CheckConstraint("""date_start < date_end
                            OR
                            (date_start IS NULL OR date_end IS NULL)"""),
+        Index("ix_program_program_desc", "program_desc"),
     )
 
     program_id = Column(Integer, primary_key=True)
@@ -32,7 +33,10 @@ class Program(Base):
     date_end = Column(Date)
     objective = Column(String)
 
-    blocks = relationship("Block", cascade="all, delete-orphan", back_populates="program")
+    # Collections are loaded on access (or with load_program_tree() of
+    # main.py), always in insertion order
+    blocks = relationship("Block", cascade="all, delete-orphan", back_populates="program",
+                          order_by="Block.block_id")
 
     def __repr__(self):
         return (f"<Program(id={self.program_id}," +
@@ -44,14 +48,24 @@ class Program(Base):
 
 class Block(Base):
     __tablename__ = "block"
+    __table_args__ = (
+        Index("ix_block_program_id_block_desc", "program_id", "block_desc"),
+    )
 
     block_id = Column(Integer, primary_key=True)
     block_desc = Column(String)
     program_id = Column(Integer, ForeignKey("program.program_id"),
                         nullable=False)
 
-    program = relationship("Program", back_populates="blocks")
-    workouts = relationship("Workout", cascade="all, delete-orphan", back_populates="block")
+    # Small lookup parents are joined to the query of their children;
+    # other many-to-one parents are lazy, but come from the identity map
+    # (without queries) once loaded
+    program = relationship("Program", back_populates="blocks", lazy="joined", innerjoin=True)
+    workouts = relationship("Workout", cascade="all, delete-orphan", back_populates="block",
+                            order_by="Workout.workout_id")
+    ingest_manifest = relationship("Ingest_manifest", back_populates="block", uselist=False)
+    log_sheet_manifest = relationship("Log_sheet_manifest", back_populates="block",
+                                      uselist=False)
 
     def __repr__(self):
         return (f"<Block(id={self.block_id}," +
@@ -61,6 +75,7 @@ class Block(Base):
 
 class Workout(Base):
     __tablename__ = "workout"
+    # Lookups by block_id use the index of the unique constraints
     __table_args__ = (
         UniqueConstraint("block_id", "week", "day"),
         UniqueConstraint("block_id", "date_workout")
@@ -75,7 +90,8 @@ class Workout(Base):
     day = Column(Integer, CheckConstraint("day > 0"))
 
     block = relationship("Block", back_populates="workouts")
-    workout_sets = relationship("Workout_set", cascade="all, delete-orphan", back_populates="workout")
+    workout_sets = relationship("Workout_set", cascade="all, delete-orphan", back_populates="workout",
+                                order_by="Workout_set.workout_set_id")
     log_workout = relationship("Log_workout", cascade="all, delete-orphan", back_populates="workout",
                                uselist=False)
 
@@ -91,12 +107,17 @@ class Workout(Base):
 
 class Exercise(Base):
     __tablename__ = "exercise"
+    __table_args__ = (
+        Index("ix_exercise_exercise_desc", "exercise_desc", unique=True),
+    )
 
     exercise_id = Column(Integer, primary_key=True)
     exercise_desc = Column(String, nullable=False)
 
     historic_prs = relationship("Historic_pr", back_populates="exercise")
     workout_sets = relationship("Workout_set", back_populates="exercise")
+    aliases = relationship("Exercise_alias", cascade="all, delete-orphan",
+                           back_populates="exercise")
     # This is defined for the case of using Table() class
     # as association table for Exercises-Muscles
     muscles = relationship("Muscle", secondary=exercise_muscle,
@@ -109,6 +130,30 @@ class Exercise(Base):
                 f"desc={self.exercise_desc})>")
 
 
+# Spelling variants of exercise names merged into their canonical exercise
+# (see exercise_matching.py)
+class Exercise_alias(Base):
+    __tablename__ = "exercise_alias"
+    __table_args__ = (
+        Index("ix_exercise_alias_alias_desc", "alias_desc", unique=True),
+    )
+
+    alias_id = Column(Integer, primary_key=True)
+    alias_desc = Column(String, nullable=False)
+    exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"),
+                         nullable=False)
+    similarity = Column(Float)
+    date_reg = Column(Date, nullable=False, server_default=now())
+
+    exercise = relationship("Exercise", back_populates="aliases")
+
+    def __repr__(self):
+        return (f"<Exercise_alias(id={self.alias_id}," +
+                f"desc={self.alias_desc}," +
+                f"exercise={self.exercise.exercise_desc}," +
+                f"similarity={self.similarity})>")
+
+
 # # Many-to-many association Exercises-Muscles via Association Object
 # class Exercise_muscle(Base):
 #     __tablename__ = "exercise_muscle"
@@ -147,6 +192,8 @@ class Workout_set(Base):
         CheckConstraint("""min_rpe <= max_rpe
                            OR
                            (min_rpe IS NULL OR max_rpe IS NULL)"""),
+        Index("ix_workout_set_workout_id", "workout_id"),
+        Index("ix_workout_set_exercise_id", "exercise_id"),
     )
 
     workout_set_id = Column(Integer, primary_key=True)
@@ -168,7 +215,8 @@ class Workout_set(Base):
     log_set = relationship("Log_set", cascade="all, delete-orphan", back_populates="workout_set",
                            uselist=False)
     workout = relationship("Workout", back_populates="workout_sets")
-    exercise = relationship("Exercise", back_populates="workout_sets")
+    exercise = relationship("Exercise", back_populates="workout_sets", lazy="joined",
+                            innerjoin=True)
 
     def __repr__(self):
         return (f"<Workout_set(id={self.workout_set_id}," +
@@ -198,7 +246,8 @@ class Log_workout(Base):
     date_reg = Column(Date, nullable=False, onupdate=current_timestamp(),
                       server_default=now(), server_onupdate=now())
 
-    log_sets = relationship("Log_set", cascade="all, delete-orphan", back_populates="log_workout")
+    log_sets = relationship("Log_set", cascade="all, delete-orphan", back_populates="log_workout",
+                            order_by="Log_set.workout_set_id")
     workout = relationship("Workout", back_populates="log_workout")
 
     def __repr__(self):
@@ -212,6 +261,9 @@ class Log_workout(Base):
 
 class Log_set(Base):
     __tablename__ = "log_set"
+    __table_args__ = (
+        Index("ix_log_set_log_workout_id", "log_workout_id"),
+    )
 
     log_set_id = Column(Integer, primary_key=True)
     workout_set_id = Column(Integer, ForeignKey("workout_set.workout_set_id"),
@@ -252,6 +304,7 @@ class Historic_pr(Base):
                         nullable=False)
     weight_pr = Column(Float, CheckConstraint("weight_pr > 0"),
                        nullable=False)
+    estimated_1rm = Column(Float)
     date_reg = Column(Date, nullable=False,
                       server_default=now(), server_onupdate=now())
 
@@ -262,4 +315,140 @@ class Historic_pr(Base):
                 f"exercise={self.exercise.exercise_desc}," +
                 f"date={self.date_pr}," +
                 f"no_reps={self.no_reps_pr}," +
-                f"weight={self.weight_pr})>")
+                f"weight={self.weight_pr}," +
+                f"e1rm={self.estimated_1rm})>")
+
+
+class Ingest_manifest(Base):
+    __tablename__ = "ingest_manifest"
+
+    manifest_id = Column(Integer, primary_key=True)
+    file_path = Column(String, unique=True, nullable=False)
+    content_hash = Column(String, nullable=False)
+    mtime = Column(Float, nullable=False)
+    block_id = Column(Integer, ForeignKey("block.block_id"))
+
+    block = relationship("Block", back_populates="ingest_manifest")
+
+    def __repr__(self):
+        return (f"<Ingest_manifest(id={self.manifest_id}," +
+                f"file={self.file_path}," +
+                f"hash={self.content_hash}," +
+                f"mtime={self.mtime}," +
+                f"block={self.block.block_desc if self.block else None})>")
+
+
+class Log_sheet_manifest(Base):
+    __tablename__ = "log_sheet_manifest"
+
+    sheet_manifest_id = Column(Integer, primary_key=True)
+    block_id = Column(Integer, ForeignKey("block.block_id"),
+                      unique=True, nullable=False)
+    sheet_crc = Column(Integer, nullable=False)
+    next_date = Column(Date)
+
+    block = relationship("Block", back_populates="log_sheet_manifest")
+
+    def __repr__(self):
+        return (f"<Log_sheet_manifest(id={self.sheet_manifest_id}," +
+                f"block={self.block.block_desc}," +
+                f"crc={self.sheet_crc}," +
+                f"next_date={self.next_date})>")
+
+
+# Change data capture: every change of a workout (its sets or its logs) is
+# recorded with a sequence number by triggers (see migrations.py), so
+# mirrors only have to read the workouts changed since their checkpoint
+class Change_log(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        CheckConstraint("operation IN ('I', 'U', 'D')"),
+        # Sequence numbers are never reused, even after pruning
+        {"sqlite_autoincrement": True},
+    )
+
+    change_id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    workout_id = Column(Integer)
+    operation = Column(String(1), nullable=False)
+
+    def __repr__(self):
+        return (f"<Change_log(id={self.change_id}," +
+                f"table={self.table_name}," +
+                f"row={self.row_id}," +
+                f"workout={self.workout_id}," +
+                f"operation={self.operation})>")
+
+
+# Training volume summaries (kept up to date by summaries.py), same
+# aggregates by exercise and week, by block and by muscle and week
+class Volume_mixin:
+    planned_sets = Column(Integer, nullable=False, default=0)
+    planned_reps = Column(Integer, nullable=False, default=0)
+    planned_tonnage = Column(Float, nullable=False, default=0)
+    done_sets = Column(Integer, nullable=False, default=0)
+    done_reps = Column(Integer, nullable=False, default=0)
+    done_tonnage = Column(Float, nullable=False, default=0)
+    done_rpe_sum = Column(Float, nullable=False, default=0)
+    done_rpe_count = Column(Integer, nullable=False, default=0)
+
+    @property
+    def avg_rpe(self):
+        return self.done_rpe_sum / self.done_rpe_count if self.done_rpe_count else None
+
+
+class Exercise_week_summary(Volume_mixin, Base):
+    __tablename__ = "exercise_week_summary"
+    __table_args__ = (
+        UniqueConstraint("exercise_id", "week_start"),
+    )
+
+    exercise_week_summary_id = Column(Integer, primary_key=True)
+    exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"),
+                         nullable=False)
+    week_start = Column(Date, nullable=False)
+
+    exercise = relationship("Exercise")
+
+    def __repr__(self):
+        return (f"<Exercise_week_summary(exercise={self.exercise.exercise_desc}," +
+                f"week_start={self.week_start}," +
+                f"sets={self.done_sets}/{self.planned_sets}," +
+                f"tonnage={self.done_tonnage}/{self.planned_tonnage})>")
+
+
+class Block_summary(Volume_mixin, Base):
+    __tablename__ = "block_summary"
+
+    block_summary_id = Column(Integer, primary_key=True)
+    block_id = Column(Integer, ForeignKey("block.block_id"),
+                      unique=True, nullable=False)
+
+    block = relationship("Block")
+
+    def __repr__(self):
+        return (f"<Block_summary(block={self.block.block_desc}," +
+                f"sets={self.done_sets}/{self.planned_sets}," +
+                f"tonnage={self.done_tonnage}/{self.planned_tonnage}," +
+                f"avg_rpe={self.avg_rpe})>")
+
+
+class Muscle_week_summary(Volume_mixin, Base):
+    __tablename__ = "muscle_week_summary"
+    __table_args__ = (
+        UniqueConstraint("muscle_id", "week_start"),
+    )
+
+    muscle_week_summary_id = Column(Integer, primary_key=True)
+    muscle_id = Column(Integer, ForeignKey("muscle.muscle_id"),
+                       nullable=False)
+    week_start = Column(Date, nullable=False)
+
+    muscle = relationship("Muscle")
+
+    def __repr__(self):
+        return (f"<Muscle_week_summary(muscle={self.muscle.muscle_desc}," +
+                f"week_start={self.week_start}," +
+                f"sets={self.done_sets}/{self.planned_sets}," +
+                f"tonnage={self.done_tonnage}/{self.planned_tonnage})>")
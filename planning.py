@@ -0,0 +1,452 @@
+"""
+Planning cube: the planned (workout_set) and done (log_set) sets of a
+program as dense NumPy arrays indexed by (workout, exercise, set), so
+planning questions (planned vs done volume by week and exercise, RPE
+drift, load progression across blocks) are vectorized reductions instead
+of ORM objects or pandas frames built row by row.
+
+    axis 0: workouts of the program, by date (cube.workout_ids)
+    axis 1: exercises of the program, dictionary-encoded (cube.exercise_ids)
+    axis 2: position of the set among the sets of its exercise in the
+            workout, by set_id (set_ids may repeat in a workout)
+
+Metrics are float32 arrays, NaN where no set is planned or logged, stored
+set-major (Fortran order) so reductions over the set axis add whole
+(workout, exercise) slabs instead of runs of a few values. Cubes are
+cached as uncompressed .npz files, whose arrays are memory-mapped on load
+(the OS pages in only what a query reads).
+"""
+from sqlalchemy import select, inspect
+
+from models import Block, Workout, Workout_set, Exercise, Log_set
+from database import DB_PATH, get_session
+from instrumentation import timed
+from summaries import METRICS as VOLUME_METRICS
+from prs import estimated_1rm
+from cdc import last_sequence
+import repository
+
+from pathlib import Path
+import argparse
+import os
+import struct
+import zipfile
+import numpy as np
+
+
+CACHE_DIR = "data/cubes"
+
+# Metrics of the cube: planned ones (workout_set) and done ones (log_set)
+PLANNED = {"no_reps": Workout_set.no_reps, "weight": Workout_set.weight,
+           "perc_rm": Workout_set.perc_rm, "min_rpe": Workout_set.min_rpe,
+           "max_rpe": Workout_set.max_rpe, "rest_min": Workout_set.rest_min}
+DONE = {"no_reps_done": Log_set.no_reps_done, "weight_done": Log_set.weight_done,
+        "rpe_done": Log_set.rpe_done}
+METRICS = {**PLANNED, **DONE}
+
+
+class PlanningCube:
+    """
+    Arrays of the sets of a program:
+        workout_ids, block_ids, dates (W): workouts, by date (datetime64[D])
+        exercise_ids, exercise_descs (E): exercise dictionary
+        workout_set_ids, log_set_ids (W, E, S): 0 if not planned / not logged
+        PLANNED and DONE metrics (W, E, S): float32, NaN if missing
+    """
+    AXES = ["workout_ids", "block_ids", "dates", "exercise_ids", "exercise_descs",
+            "workout_set_ids", "log_set_ids"]
+
+    def __init__(self, program_id: int, seq: int, arrays: dict):
+        """
+            Parameters:
+                program_id (int): program of the sets
+                seq (int): change_log sequence number the cube is up to
+                           date with (-1 if unknown)
+                arrays (dict): name --> array, for AXES and METRICS
+        """
+        self.program_id = program_id
+        self.seq = seq
+        self.arrays = arrays
+
+    def __getattr__(self, name):
+        if name in self.AXES or name in METRICS:
+            return self.arrays[name]
+        raise AttributeError(name)
+
+    @property
+    def shape(self):
+        return self.workout_set_ids.shape
+
+    @property
+    def planned(self):
+        """Mask of the planned sets (W, E, S)"""
+        return self.workout_set_ids > 0
+
+    @property
+    def logged(self):
+        """Mask of the logged sets (W, E, S)"""
+        return self.log_set_ids > 0
+
+    def weeks(self):
+        """Monday of the week of every workout (W), NaT if it has no date"""
+        days = self.dates.astype("datetime64[D]")
+        # 1970-01-01 was a Thursday
+        return days - (days.astype(np.int64) + 3) % 7
+
+    def exercise_index(self, exercise_desc: str):
+        """Position of an exercise on axis 1"""
+        positions = np.flatnonzero(self.exercise_descs == exercise_desc)
+        if not positions.size:
+            raise KeyError(f"No sets of exercise {exercise_desc} in the program!")
+
+        return int(positions[0])
+
+
+def _encode(values: np.ndarray):
+    """
+    Dictionary encoding of values in order of first appearance.
+
+        Returns:
+            dictionary (numpy.ndarray): distinct values
+            codes (numpy.ndarray): position of every value in dictionary
+    """
+    dictionary, first, codes = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+
+    return dictionary[order], rank[codes]
+
+
+@timed()
+def load_cube(session, program_id: int):
+    """
+    Builds the cube of a program from one query of its sets and logs.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): program id
+
+        Returns:
+            cube (PlanningCube)
+    """
+    # Read before the sets, so a later change is never missed by the cache
+    seq = _sequence(session)
+    rows = session.execute(
+        select(Workout.workout_id, Workout.block_id, Workout.date_workout,
+               Workout_set.exercise_id, Exercise.exercise_desc, Workout_set.set_id,
+               Workout_set.workout_set_id, Log_set.log_set_id, *METRICS.values())
+        .select_from(Workout_set)
+        .join(Workout, Workout.workout_id == Workout_set.workout_id)
+        .join(Block, Block.block_id == Workout.block_id)
+        .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .outerjoin(Log_set, Log_set.workout_set_id == Workout_set.workout_set_id)
+        .where(Block.program_id == program_id)
+        .order_by(Workout.date_workout, Workout.workout_id, Workout_set.workout_set_id)
+    ).all()
+    columns = list(zip(*rows)) if rows else [()] * (8 + len(METRICS))
+
+    workout_ids, workout_index = _encode(np.array(columns[0], dtype=np.int64))
+    exercise_ids, exercise_index = _encode(np.array(columns[3], dtype=np.int64))
+    # Block, date and description of the first row of every workout/exercise
+    first_workout = np.zeros(workout_ids.size, dtype=np.int64)
+    first_workout[workout_index[::-1]] = np.arange(len(rows))[::-1]
+    first_exercise = np.zeros(exercise_ids.size, dtype=np.int64)
+    first_exercise[exercise_index[::-1]] = np.arange(len(rows))[::-1]
+
+    # Set position: rank by set_id within its (workout, exercise) group
+    set_ids = np.array(columns[5], dtype=np.int64)
+    workout_set_ids = np.array(columns[6], dtype=np.int64)
+    order = np.lexsort((workout_set_ids, set_ids, exercise_index, workout_index))
+    group = (workout_index * exercise_ids.size + exercise_index)[order]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if rows else group
+    set_index = np.empty(len(rows), dtype=np.int64)
+    set_index[order] = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+
+    shape = (workout_ids.size, exercise_ids.size, int(set_index.max()) + 1 if rows else 0)
+    cells = (workout_index, exercise_index, set_index)
+    arrays = {
+        "workout_ids": workout_ids,
+        "block_ids": np.array(columns[1], dtype=np.int64)[first_workout],
+        "dates": np.array(columns[2], dtype="datetime64[D]")[first_workout],
+        "exercise_ids": exercise_ids,
+        "exercise_descs": np.array(columns[4], dtype=str)[first_exercise],
+    }
+    for name, values in [("workout_set_ids", workout_set_ids),
+                         ("log_set_ids", np.array(columns[7], dtype=float))]:
+        arrays[name] = np.zeros(shape, dtype=np.int64, order="F")
+        arrays[name][cells] = np.nan_to_num(values)
+    for i, name in enumerate(METRICS, start=8):
+        arrays[name] = np.full(shape, np.nan, dtype=np.float32, order="F")
+        arrays[name][cells] = np.array(columns[i], dtype=np.float32)
+
+    return PlanningCube(program_id, -1 if seq is None else seq, arrays)
+
+
+def _sequence(session):
+    """Last change_log sequence number, None if the db has no change log"""
+    if not inspect(session.get_bind()).has_table("change_log"):
+        return None
+
+    return last_sequence(session)
+
+
+def save_cube(cube: PlanningCube, path):
+    """Saves a cube as an uncompressed .npz file (through a temp file)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name("~" + path.name)
+    with open(tmp_path, "wb") as f:
+        np.savez(f, program_id=cube.program_id, seq=cube.seq, **cube.arrays)
+    os.replace(tmp_path, path)
+
+
+def _memmap_npz(path):
+    """
+    Memory-maps the arrays of an uncompressed .npz file (np.load() ignores
+    mmap_mode for them): every member is a .npy file stored as is in the
+    zip, so its data starts after the zip local header and the .npy header.
+
+        Returns:
+            arrays (dict): name --> read-only numpy.memmap (or ndarray for
+                           empty or compressed members)
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # Local header: 30 bytes, then file name and extra field
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                           else np.lib.format.read_array_header_2_0)
+            shape, fortran_order, dtype = read_header(f)
+            if not np.prod(shape, dtype=np.int64):
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                     order="F" if fortran_order else "C")
+
+    return arrays
+
+
+def read_cube(path, mmap: bool = True):
+    """
+    Reads a cube saved by save_cube().
+
+        Parameters:
+            path (str or path): .npz file
+            mmap (bool): memory-map the arrays instead of reading them
+
+        Returns:
+            cube (PlanningCube)
+    """
+    if mmap:
+        arrays = _memmap_npz(path)
+    else:
+        with np.load(path) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+
+    return PlanningCube(int(arrays.pop("program_id")), int(arrays.pop("seq")), arrays)
+
+
+def get_cube(session, program_id: int, cache_dir=CACHE_DIR):
+    """
+    Returns the cube of a program from the cache, or builds (and caches) it
+    if the database changed since it was cached: any change_log entry after
+    its sequence number invalidates it (without change log, it is always
+    rebuilt). change_log has the changes of workouts, sets and their logs,
+    and the renames of blocks, programs and exercises, i.e. everything the
+    cube holds; muscles (and exercise --> muscle links) aren't logged, as
+    they aren't in the cube. The key is only valid for the database the
+    cube was built from: use one cache_dir per database.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): program id
+            cache_dir (str or path): directory of the cached cubes
+
+        Returns:
+            cube (PlanningCube)
+    """
+    path = Path(cache_dir) / f"program_{program_id}.npz"
+    seq = _sequence(session)
+    if seq is not None and path.is_file():
+        cube = read_cube(path)
+        if cube.seq == seq:
+            return cube
+
+    cube = load_cube(session, program_id)
+    if cube.seq >= 0:
+        save_cube(cube, path)
+
+    return cube
+
+
+def _sum_sets(values: np.ndarray):
+    """Sum of the non-NaN values over the set axis, (W, E, S) --> (W, E)"""
+    return np.add.reduce(values, axis=2, where=~np.isnan(values)).astype(np.float64)
+
+
+def _group_reduce(values: np.ndarray, groups: np.ndarray, n_groups: int, ufunc=np.add):
+    """
+    Reduces (W, E) values by groups of workouts: sums (np.add) as a matrix
+    product with the group masks, maxima (np.fmax, ignoring NaN) over the
+    workouts sorted by group.
+
+        Parameters:
+            values (numpy.ndarray): (W, E) values
+            groups (numpy.ndarray): group of every workout (W), -1 for none
+            n_groups (int): number of groups
+            ufunc (numpy.ufunc): np.add or np.fmax
+
+        Returns:
+            reduced (numpy.ndarray): (n_groups, E), NaN for maxima of no value
+    """
+    if ufunc is np.add:
+        return (groups == np.arange(n_groups)[:, None]).astype(np.float64) @ values
+    if not n_groups:
+        return np.empty((0, values.shape[1]))
+
+    # Every group has some workout (-1 ones are sorted first and skipped)
+    order = np.argsort(groups, kind="stable")
+    starts = np.searchsorted(groups[order], np.arange(n_groups))
+
+    return ufunc.reduceat(values[order], starts, axis=0)
+
+
+def _week_groups(cube: PlanningCube):
+    """Weeks of the cube (K) and the week position of every workout (W, -1 if no date)"""
+    weeks = cube.weeks()
+    valid = ~np.isnat(weeks)
+    distinct, codes = np.unique(weeks[valid], return_inverse=True)
+    groups = np.full(weeks.size, -1, dtype=np.int64)
+    groups[valid] = codes
+
+    return distinct, groups
+
+
+def weekly_volume(cube: PlanningCube):
+    """
+    Planned and done volume by week and exercise (the same metrics as the
+    exercise week summaries, see summaries.py).
+
+        Returns:
+            weeks (numpy.ndarray): Mondays (K)
+            volume (dict): summaries.METRICS name --> (K, E) array
+    """
+    weeks, groups = _week_groups(cube)
+    per_workout = {
+        "planned_sets": cube.planned.sum(axis=2),
+        "planned_reps": _sum_sets(cube.no_reps),
+        # Sets without weight (NaN products) add no tonnage
+        "planned_tonnage": _sum_sets(cube.no_reps * cube.weight),
+        "done_sets": cube.logged.sum(axis=2),
+        "done_reps": _sum_sets(cube.no_reps_done),
+        "done_tonnage": _sum_sets(cube.no_reps_done * cube.weight_done),
+        "done_rpe_sum": _sum_sets(cube.rpe_done),
+        "done_rpe_count": (~np.isnan(cube.rpe_done)).sum(axis=2),
+    }
+
+    return weeks, {name: _group_reduce(per_workout[name], groups, weeks.size)
+                   for name in VOLUME_METRICS}
+
+
+def rpe_drift(cube: PlanningCube):
+    """
+    Mean difference between done and planned RPE (middle of the min/max
+    range, or the one given) by week and exercise: positive when sets are
+    harder than planned.
+
+        Returns:
+            weeks (numpy.ndarray): Mondays (K)
+            drift (numpy.ndarray): (K, E), NaN without logged RPE on planned RPE
+    """
+    target = np.where(np.isnan(cube.min_rpe), cube.max_rpe,
+                      np.where(np.isnan(cube.max_rpe), cube.min_rpe,
+                               (cube.min_rpe + cube.max_rpe) / 2))
+    difference = cube.rpe_done - target
+    weeks, groups = _week_groups(cube)
+    total = _group_reduce(_sum_sets(difference), groups, weeks.size)
+    count = _group_reduce((~np.isnan(difference)).sum(axis=2), groups, weeks.size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return weeks, np.where(count > 0, total / count, np.nan)
+
+
+def load_progression(cube: PlanningCube, formula: str = "epley"):
+    """
+    Top planned and done weight, and best estimated 1RM of the done sets,
+    of every exercise in every block of the program.
+
+        Returns:
+            block_ids (numpy.ndarray): blocks, in order of their first workout (B)
+            progression (dict): "planned_weight", "done_weight" and
+                                "done_e1rm" --> (B, E) arrays, NaN if none
+    """
+    block_ids, groups = _encode(cube.block_ids)
+    e1rm = estimated_1rm(cube.weight_done, cube.no_reps_done, formula)
+    e1rm[~(cube.no_reps_done > 0)] = np.nan
+    top = {"planned_weight": cube.weight, "done_weight": cube.weight_done, "done_e1rm": e1rm}
+
+    return block_ids, {name: _group_reduce(np.fmax.reduce(values, axis=2, initial=np.nan),
+                                           groups, block_ids.size, np.fmax)
+                       for name, values in top.items()}
+
+
+def main():
+    """Planning analytics of a program from its (cached) planning cube"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="directory of the cached cubes")
+    parser.add_argument("program", help="program description")
+    parser.add_argument("query", choices=["volume", "rpe", "progression"])
+    parser.add_argument("--exercise", help="only this exercise")
+    args = parser.parse_args()
+
+    session = get_session(args.db, "serving", read_only=True)
+    program_id = repository.program_id_by_desc(session, args.program)
+    if program_id is None:
+        raise KeyError(f"No program {args.program}!")
+    cube = get_cube(session, program_id, args.cache_dir)
+    exercises = (range(cube.exercise_ids.size) if args.exercise is None
+                 else [cube.exercise_index(args.exercise)])
+
+    if args.query == "volume":
+        weeks, volume = weekly_volume(cube)
+        print(f"{'week':>10} {'exercise':>32} {'sets':>9} {'reps':>11} {'tonnage':>17}")
+        for k, week in enumerate(weeks):
+            for e in exercises:
+                if volume["planned_sets"][k, e]:
+                    print(f"{str(week):>10} {cube.exercise_descs[e]:>32} "
+                          f"{volume['done_sets'][k, e]:>4.0f}/{volume['planned_sets'][k, e]:<4.0f} "
+                          f"{volume['done_reps'][k, e]:>5.0f}/{volume['planned_reps'][k, e]:<5.0f} "
+                          f"{volume['done_tonnage'][k, e]:>8.0f}/"
+                          f"{volume['planned_tonnage'][k, e]:<8.0f}")
+    elif args.query == "rpe":
+        weeks, drift = rpe_drift(cube)
+        print(f"{'week':>10} {'exercise':>32} {'drift':>6}")
+        for k, week in enumerate(weeks):
+            for e in exercises:
+                if not np.isnan(drift[k, e]):
+                    print(f"{str(week):>10} {cube.exercise_descs[e]:>32} {drift[k, e]:>+6.2f}")
+    else:
+        block_ids, progression = load_progression(cube)
+        print(f"{'block':>6} {'exercise':>32} {'planned':>8} {'done':>8} {'e1rm':>8}")
+        for e in exercises:
+            for b, block_id in enumerate(block_ids):
+                if not np.isnan(progression["planned_weight"][b, e]) or \
+                        not np.isnan(progression["done_weight"][b, e]):
+                    print(f"{block_id:>6} {cube.exercise_descs[e]:>32} "
+                          f"{progression['planned_weight'][b, e]:>8.1f} "
+                          f"{progression['done_weight'][b, e]:>8.1f} "
+                          f"{progression['done_e1rm'][b, e]:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
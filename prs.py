@@ -0,0 +1,163 @@
+from sqlalchemy import select, func
+
+from models import Workout_set, Log_workout, Log_set, Historic_pr
+from database import DB_PATH, get_session
+from instrumentation import timed
+
+import argparse
+import numpy as np
+
+
+def estimated_1rm(weight, reps, formula: str = "epley"):
+    """
+    Estimated one repetition maximum (vectorized).
+
+        Parameters:
+            weight (array-like): lifted weights
+            reps (array-like): repetitions done with each weight
+            formula (str): "epley" (w * (1 + r/30)) or "brzycki"
+                           (w * 36 / (37 - r), NaN from 37 reps on)
+
+        Returns:
+            e1rm (numpy.ndarray): estimated 1RM for every set
+    """
+    weight = np.asarray(weight, dtype=float)
+    reps = np.asarray(reps, dtype=float)
+
+    if formula == "epley":
+        # A single rep is the 1RM itself
+        return np.where(reps == 1, weight, weight * (1 + reps / 30))
+    if formula == "brzycki":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(reps < 37, weight * 36 / (37 - reps), np.nan)
+
+    raise KeyError(f"Unknown 1RM formula ({formula})! Use 'epley' or 'brzycki'")
+
+
+def load_done_sets(session, since=None):
+    """
+    Loads every done set with weight and reps (and its exercise and date)
+    in one query, as columnar numpy arrays.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            since (str or datetime): only sets of log workouts registered
+                                     (or updated) from this moment on
+
+        Returns:
+            sets (dict): "exercise_id", "no_reps", "weight" and "date" arrays
+    """
+    stmt = (
+        select(Workout_set.exercise_id, Log_set.no_reps_done, Log_set.weight_done,
+               Log_workout.date_workout_done)
+        .select_from(Log_set)
+        .join(Workout_set, Workout_set.workout_set_id == Log_set.workout_set_id)
+        .join(Log_workout, Log_workout.log_workout_id == Log_set.log_workout_id)
+        .where(Log_set.no_reps_done > 0, Log_set.weight_done > 0)
+    )
+    if since is not None:
+        stmt = stmt.where(Log_workout.date_reg >= since)
+
+    rows = session.execute(stmt).all()
+    columns = list(zip(*rows)) if rows else [(), (), (), ()]
+
+    return {"exercise_id": np.array(columns[0], dtype=np.int64),
+            "no_reps": np.array(columns[1], dtype=np.int64),
+            "weight": np.array(columns[2], dtype=float),
+            "date": np.array(columns[3], dtype=object)}
+
+
+def best_sets(sets: dict):
+    """
+    Heaviest set of every (exercise, reps) group, the earliest one on ties,
+    using a lexsort instead of python loops.
+
+        Parameters:
+            sets (dict): columnar sets as returned by load_done_sets()
+
+        Returns:
+            bests (dict): same arrays, one element per (exercise, reps)
+    """
+    if not len(sets["weight"]):
+        return sets
+
+    dates = np.array([d.toordinal() if d is not None else np.iinfo(np.int64).max
+                      for d in sets["date"]], dtype=np.int64)
+    # Last key is the primary one: exercise, reps, weight (desc), date
+    order = np.lexsort((dates, -sets["weight"], sets["no_reps"], sets["exercise_id"]))
+    exercise_id = sets["exercise_id"][order]
+    no_reps = sets["no_reps"][order]
+    # First element of every group
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (exercise_id[1:] != exercise_id[:-1]) | (no_reps[1:] != no_reps[:-1])
+
+    return {column: values[order][first] for column, values in sets.items()}
+
+
+@timed()
+def update_prs(session, incremental: bool = True, formula: str = "epley"):
+    """
+    Inserts into historic_pr the new personal records (heaviest weight for
+    an exercise and number of reps) found in the logs, with their estimated
+    1RM, and commits.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            incremental (bool): only look at log sets registered since the
+                                last date_reg of historic_pr
+            formula (str): estimated 1RM formula (see estimated_1rm())
+
+        Returns:
+            new_prs (int): number of records inserted
+    """
+    since = None
+    if incremental:
+        since = session.query(func.max(Historic_pr.date_reg)).scalar()
+
+    bests = best_sets(load_done_sets(session, since))
+    if not len(bests["weight"]):
+        return 0
+
+    # Current records, to keep only the new ones
+    current = dict(
+        ((exercise_id, no_reps), weight) for exercise_id, no_reps, weight in
+        session.query(Historic_pr.exercise_id, Historic_pr.no_reps_pr,
+                      func.max(Historic_pr.weight_pr))
+        .filter(Historic_pr.exercise_id.in_(np.unique(bests["exercise_id"]).tolist()))
+        .group_by(Historic_pr.exercise_id, Historic_pr.no_reps_pr)
+    )
+    current_weight = np.array([current.get(key, 0.0) for key in
+                               zip(bests["exercise_id"].tolist(), bests["no_reps"].tolist())])
+    is_new = bests["weight"] > current_weight
+    e1rm = estimated_1rm(bests["weight"], bests["no_reps"], formula)
+
+    new_prs = [
+        {"exercise_id": exercise_id, "no_reps_pr": no_reps, "weight_pr": weight,
+         "date_pr": date, "estimated_1rm": None if np.isnan(rm) else rm}
+        for exercise_id, no_reps, weight, date, rm in zip(
+            bests["exercise_id"][is_new].tolist(), bests["no_reps"][is_new].tolist(),
+            bests["weight"][is_new].tolist(), bests["date"][is_new], e1rm[is_new].tolist()
+        )
+    ]
+    if new_prs:
+        session.execute(Historic_pr.__table__.insert(), new_prs)
+    session.commit()
+
+    return len(new_prs)
+
+
+def main():
+    """Updates personal records (historic_pr) from the logged sets"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--full", action="store_true",
+                        help="look at every log set, not only the new ones")
+    parser.add_argument("--formula", default="epley", choices=["epley", "brzycki"])
+    args = parser.parse_args()
+
+    new_prs = update_prs(get_session(args.db), not args.full, args.formula)
+    print(f"{new_prs} new personal records")
+
+
+if __name__ == "__main__":
+    main()
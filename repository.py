@@ -0,0 +1,161 @@
+"""
+Common reads over the models, as lambda statements: each statement is
+built and compiled once (cached by the engine, keyed by the code of the
+lambda) and later calls only bind their parameters, so repeated API-style
+reads don't pay query construction and compilation again.
+"""
+from sqlalchemy import select, lambda_stmt
+
+from models import (Program, Block, Workout, Workout_set, Exercise,
+                    Log_workout, Log_set, Historic_pr, Exercise_alias)
+
+
+# Labels of the set columns of the Excel log (main.LOG_SET_COLS)
+SET_COLUMNS = [
+    Workout_set.workout_set_id.label("ID"),
+    Exercise.exercise_desc.label("Ejercicio"),
+    Workout_set.set_id.label("Serie"),
+    Workout_set.no_reps.label("Repeticiones"),
+    Workout_set.weight.label("Peso (kg)"),
+    Workout_set.perc_rm.label("% 1RM"),
+    Workout_set.min_rpe.label("RPE mín."),
+    Workout_set.max_rpe.label("RPE máx."),
+    Workout_set.rest_min.label("Descanso (min)"),
+]
+
+
+def program_id_by_desc(session, program_desc: str):
+    """Returns id of the (first) program with the given description (None if not found)"""
+    return session.execute(lambda_stmt(
+        lambda: select(Program.program_id)
+        .where(Program.program_desc == program_desc)
+        .order_by(Program.program_id)
+        .limit(1)
+    )).scalar()
+
+
+def block_id_by_desc(session, program_id: int, block_desc: str):
+    """Returns id of the (first) block of a program with the given description"""
+    return session.execute(lambda_stmt(
+        lambda: select(Block.block_id)
+        .where(Block.program_id == program_id, Block.block_desc == block_desc)
+        .order_by(Block.block_id)
+        .limit(1)
+    )).scalar()
+
+
+def exercise_ids_by_desc(session, exercise_descs: list):
+    """Returns (exercise_desc, exercise_id) rows of the given descriptions"""
+    exercise_descs = list(exercise_descs)
+    return session.execute(lambda_stmt(
+        lambda: select(Exercise.exercise_desc, Exercise.exercise_id)
+        .where(Exercise.exercise_desc.in_(exercise_descs))
+    )).all()
+
+
+def exercise_ids_by_alias(session, alias_descs: list):
+    """Returns (alias_desc, exercise_id) rows of the given aliases"""
+    alias_descs = list(alias_descs)
+    return session.execute(lambda_stmt(
+        lambda: select(Exercise_alias.alias_desc, Exercise_alias.exercise_id)
+        .where(Exercise_alias.alias_desc.in_(alias_descs))
+    )).all()
+
+
+def program_plan(session, program_id: int):
+    """
+    Plan of a program: one row per set with its block, workout and exercise,
+    in block, workout and set order.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            program_id (int): program id
+
+        Returns:
+            rows (list): rows with block_id, block_desc, workout_id,
+                         date_workout, workout_desc and SET_COLUMNS
+    """
+    return session.execute(lambda_stmt(
+        lambda: select(Block.block_id, Block.block_desc, Workout.workout_id,
+                       Workout.date_workout, Workout.workout_desc, *SET_COLUMNS)
+        .join(Workout, Workout.block_id == Block.block_id)
+        .join(Workout_set, Workout_set.workout_id == Workout.workout_id)
+        .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .where(Block.program_id == program_id)
+        .order_by(Block.block_id, Workout.workout_id, Workout_set.workout_set_id)
+    )).all()
+
+
+def workout_sets(session, workout_id: int):
+    """Sets of a workout, labeled as in the Excel log (SET_COLUMNS), in set order"""
+    return session.execute(lambda_stmt(
+        lambda: select(*SET_COLUMNS)
+        .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .where(Workout_set.workout_id == workout_id)
+        .order_by(Workout_set.workout_set_id)
+    )).all()
+
+
+def logs_by_date_range(session, date_from, date_to, program_id: int = None):
+    """
+    Logged sets done between two dates (both included), with their plan.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            date_from, date_to (date): date_workout_done range
+            program_id (int): only logs of this program
+
+        Returns:
+            rows (list): rows with date_workout_done, workout_id, exercise_desc,
+                         set_id, planned no_reps and weight, and no_reps_done,
+                         weight_done, rpe_done and comment_set, by date and set
+    """
+    stmt = lambda_stmt(
+        lambda: select(Log_workout.date_workout_done, Log_workout.workout_id,
+                       Exercise.exercise_desc, Workout_set.set_id, Workout_set.no_reps,
+                       Workout_set.weight, Log_set.no_reps_done, Log_set.weight_done,
+                       Log_set.rpe_done, Log_set.comment_set)
+        .join(Log_workout, Log_workout.log_workout_id == Log_set.log_workout_id)
+        .join(Workout_set, Workout_set.workout_set_id == Log_set.workout_set_id)
+        .join(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .where(Log_workout.date_workout_done.between(date_from, date_to))
+        .order_by(Log_workout.date_workout_done, Workout_set.workout_set_id)
+    )
+    # Each variant of the statement is cached on its own
+    if program_id is not None:
+        stmt += lambda s: (s.join(Workout, Workout.workout_id == Log_workout.workout_id)
+                            .join(Block, Block.block_id == Workout.block_id)
+                            .where(Block.program_id == program_id))
+
+    return session.execute(stmt).all()
+
+
+def report(session):
+    """
+    The denormalized report of data/db/select_statements.sql: every set
+    with its exercise, program, block, week and day.
+    """
+    return session.execute(lambda_stmt(
+        lambda: select(Exercise.exercise_desc, Workout_set.set_id, Workout_set.no_reps,
+                       Workout_set.perc_rm, Workout_set.min_rpe, Workout_set.max_rpe,
+                       Program.program_desc, Block.block_desc, Workout.week, Workout.day)
+        .select_from(Workout_set)
+        .outerjoin(Exercise, Workout_set.exercise_id == Exercise.exercise_id)
+        .outerjoin(Workout, Workout_set.workout_id == Workout.workout_id)
+        .outerjoin(Block, Workout.block_id == Block.block_id)
+        .outerjoin(Program, Block.program_id == Program.program_id)
+    )).all()
+
+
+def personal_records(session):
+    """
+    Personal records history (historic_pr) with their exercise: rows with
+    exercise_desc, date_pr, no_reps_pr, weight_pr and estimated_1rm, by
+    exercise and date.
+    """
+    return session.execute(lambda_stmt(
+        lambda: select(Exercise.exercise_desc, Historic_pr.date_pr, Historic_pr.no_reps_pr,
+                       Historic_pr.weight_pr, Historic_pr.estimated_1rm)
+        .join(Exercise, Exercise.exercise_id == Historic_pr.exercise_id)
+        .order_by(Exercise.exercise_desc, Historic_pr.date_pr, Historic_pr.pr_id)
+    )).all()
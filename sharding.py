@@ -0,0 +1,211 @@
+"""
+Sharding mode: every athlete has a SQLite database of their own
+(SHARDS_DIR/<athlete>.db), with the same tables as the shared one, so the
+writers of different athletes never wait on the same write lock.
+
+ShardRouter maps athletes to their shard file and keeps a bounded pool of
+engines. Aggregate reads (the report, personal records...) are fanned out
+over the shards in a thread pool (sqlite3 releases the GIL while a
+statement runs) and their rows merged, tagged with the athlete.
+"""
+from sqlalchemy.orm import sessionmaker
+
+from database import create_sqlite_engine
+from migrations import create_indexes
+import repository
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import re
+import threading
+
+
+SHARDS_DIR = "data/db/shards"
+# Athlete names are used as file names
+ATHLETE_PATTERN = re.compile(r"^\w[\w.-]*$")
+
+
+class ShardRouter:
+    """Athlete --> shard database file, engine and sessions"""
+
+    def __init__(self, shards_dir=SHARDS_DIR, profile: str = "serving",
+                 max_engines: int = 32):
+        """
+            Parameters:
+                shards_dir (str or path): directory of the shard files
+                profile (str): engine profile (see database.PROFILES)
+                max_engines (int): engines kept open (least recently used
+                                   ones are disposed beyond it)
+        """
+        self.shards_dir = Path(shards_dir)
+        self.profile = profile
+        self.max_engines = max_engines
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def shard_path(self, athlete: str):
+        """Database file of the athlete (it may not exist yet)"""
+        if not ATHLETE_PATTERN.match(athlete):
+            raise ValueError(f"Invalid athlete name ({athlete})! Use letters, digits, "
+                             f"'_', '-' and '.'")
+
+        return self.shards_dir / f"{athlete}.db"
+
+    def athletes(self):
+        """Athletes with a shard, sorted"""
+        return sorted(file.stem for file in self.shards_dir.glob("*.db"))
+
+    def create_shard(self, athlete: str):
+        """
+        Creates the database of an athlete, or the missing tables, columns
+        and indexes of an existing one (see migrations.create_indexes()).
+
+            Returns:
+                db_path (path): shard file
+        """
+        db_path = self.shard_path(athlete)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        create_indexes(self.engine(athlete, must_exist=False))
+
+        return db_path
+
+    def engine(self, athlete: str, read_only: bool = False, must_exist: bool = True):
+        """
+        Returns the engine of the shard of an athlete, from the pool.
+
+            Parameters:
+                athlete (str): athlete name
+                read_only (bool): read-only connections
+                must_exist (bool): raise KeyError if the athlete has no shard
+                                   (instead of creating an empty file)
+
+            Returns:
+                engine (SQLAlchemy.engine object)
+        """
+        key = (athlete, read_only)
+        with self._lock:
+            if key in self._engines:
+                self._engines.move_to_end(key)
+                return self._engines[key]
+
+            db_path = self.shard_path(athlete)
+            if must_exist and not db_path.is_file():
+                raise KeyError(f"No shard for athlete {athlete}!")
+            engine = create_sqlite_engine(str(db_path), self.profile, read_only)
+            self._engines[key] = engine
+            if len(self._engines) > self.max_engines:
+                _, evicted = self._engines.popitem(last=False)
+                evicted.dispose()
+
+        return engine
+
+    def session(self, athlete: str, read_only: bool = False):
+        """Returns a new session bound to the shard of an athlete"""
+        return sessionmaker(bind=self.engine(athlete, read_only))()
+
+    def dispose(self):
+        """Disposes every engine of the pool"""
+        with self._lock:
+            while self._engines:
+                _, engine = self._engines.popitem()
+                engine.dispose()
+
+
+def fan_out(router: ShardRouter, function, *args, athletes: list = None, workers: int = None):
+    """
+    Runs a read function on the shard of every athlete in a thread pool,
+    each one with its own read-only session.
+
+        Parameters:
+            router (ShardRouter)
+            function (callable): function(session, *args)
+            athletes (list): shards to read (all of them by default)
+            workers (int): threads (ThreadPoolExecutor default if None)
+
+        Returns:
+            results (dict): athlete --> result of function, in athlete order
+    """
+    athletes = router.athletes() if athletes is None else list(athletes)
+
+    def run(athlete):
+        session = router.session(athlete, read_only=True)
+        try:
+            return function(session, *args)
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(athletes, executor.map(run, athletes)))
+
+
+def merge_rows(results: dict):
+    """Rows of every shard in one list, with the athlete as first column"""
+    return [(athlete, *row) for athlete, rows in results.items() for row in rows]
+
+
+def report(router: ShardRouter, athletes: list = None, workers: int = None):
+    """
+    repository.report() of every shard.
+
+        Returns:
+            rows (list): athlete and the columns of repository.report()
+    """
+    return merge_rows(fan_out(router, repository.report, athletes=athletes, workers=workers))
+
+
+def personal_records(router: ShardRouter, athletes: list = None, workers: int = None):
+    """
+    Best personal record (highest estimated 1RM) of every athlete on every
+    exercise, as a ranking by exercise.
+
+        Returns:
+            rows (list): athlete and the columns of repository.personal_records(),
+                         by exercise and estimated 1RM (descending)
+    """
+    best = {}
+    for athlete, exercise_desc, *pr in merge_rows(fan_out(router, repository.personal_records,
+                                                          athletes=athletes, workers=workers)):
+        key = (athlete, exercise_desc)
+        if key not in best or (pr[-1] or 0) > (best[key][-1] or 0):
+            best[key] = pr
+
+    return sorted(((athlete, exercise_desc, *pr) for (athlete, exercise_desc), pr in best.items()),
+                  key=lambda row: (row[1], -(row[-1] or 0), row[0]))
+
+
+def main():
+    """Per-athlete shards: create them and read aggregates across them"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--shards-dir", default=SHARDS_DIR, help="directory of the shard files")
+    parser.add_argument("--workers", type=int, help="threads to read the shards with")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="create (or migrate) athlete shards")
+    create.add_argument("athletes", nargs="+")
+    commands.add_parser("list", help="list athletes with a shard")
+    commands.add_parser("report", help="report of every shard (as csv)")
+    commands.add_parser("prs", help="best personal records of every athlete")
+    args = parser.parse_args()
+
+    router = ShardRouter(args.shards_dir)
+    if args.command == "create":
+        for athlete in args.athletes:
+            print(router.create_shard(athlete))
+    elif args.command == "list":
+        print("\n".join(router.athletes()))
+    elif args.command == "report":
+        for row in report(router, workers=args.workers):
+            print(",".join("" if value is None else str(value) for value in row))
+    else:
+        print(f"{'athlete':>16} {'exercise':>32} {'date':>10} {'reps':>4} "
+              f"{'weight':>7} {'e1rm':>7}")
+        for athlete, exercise_desc, date_pr, no_reps, weight, e1rm in personal_records(
+                router, workers=args.workers):
+            print(f"{athlete:>16} {exercise_desc:>32} {str(date_pr):>10} {no_reps:>4} "
+                  f"{weight:>7.1f} {e1rm or 0:>7.1f}")
+    router.dispose()
+
+
+if __name__ == "__main__":
+    main()
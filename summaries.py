@@ -0,0 +1,167 @@
+from sqlalchemy import select, func
+
+from models import (Workout, Workout_set, Log_set, exercise_muscle,
+                    Exercise_week_summary, Block_summary, Muscle_week_summary)
+from database import DB_PATH, get_session
+from instrumentation import timed
+
+import argparse
+
+
+# Monday of the week of the (planned) workout, also used for done volume
+WEEK_START = func.date(Workout.date_workout, "weekday 0", "-6 days")
+
+METRICS = ["planned_sets", "planned_reps", "planned_tonnage",
+           "done_sets", "done_reps", "done_tonnage",
+           "done_rpe_sum", "done_rpe_count"]
+
+
+def _volume_select(*group_columns):
+    """Planned (workout_set) and done (log_set) volume grouped by the columns"""
+    return (
+        select(*group_columns,
+               func.count(Workout_set.workout_set_id),
+               func.coalesce(func.sum(Workout_set.no_reps), 0),
+               func.coalesce(func.sum(Workout_set.no_reps
+                                      * func.coalesce(Workout_set.weight, 0)), 0),
+               func.count(Log_set.log_set_id),
+               func.coalesce(func.sum(Log_set.no_reps_done), 0),
+               func.coalesce(func.sum(Log_set.no_reps_done
+                                      * func.coalesce(Log_set.weight_done, 0)), 0),
+               func.coalesce(func.sum(Log_set.rpe_done), 0),
+               func.count(Log_set.rpe_done))
+        .select_from(Workout_set)
+        .join(Workout, Workout.workout_id == Workout_set.workout_id)
+        .outerjoin(Log_set, Log_set.workout_set_id == Workout_set.workout_set_id)
+        .group_by(*group_columns)
+    )
+
+
+def summary_keys(session, block_ids):
+    """
+    Returns exercise ids and week starts of the sets of the given blocks
+    (the exercise/week summary rows that depend on them).
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            block_ids (iterable): block ids
+
+        Returns:
+            exercise_ids (set), weeks (set)
+    """
+    rows = session.execute(
+        select(Workout_set.exercise_id, WEEK_START).distinct()
+        .join(Workout, Workout.workout_id == Workout_set.workout_id)
+        .where(Workout.block_id.in_(set(block_ids)))
+    ).all()
+
+    return {row[0] for row in rows}, {row[1] for row in rows}
+
+
+@timed()
+def refresh_summaries(session, block_ids, old_keys: tuple = None):
+    """
+    Recomputes only the summary rows depending on the given blocks: the
+    block rows and the exercise and muscle rows of their weeks. Without
+    committing.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+            block_ids (iterable): blocks whose sets or logs have changed
+            old_keys (tuple): summary_keys() of the blocks before the change,
+                              so that rows of deleted sets are refreshed too
+    """
+    block_ids = set(block_ids)
+    if not block_ids:
+        return
+    exercise_ids, weeks = summary_keys(session, block_ids)
+    if old_keys:
+        exercise_ids |= old_keys[0]
+        weeks |= old_keys[1]
+
+    block_summary = Block_summary.__table__
+    session.execute(block_summary.delete().where(block_summary.c.block_id.in_(block_ids)))
+    session.execute(block_summary.insert().from_select(
+        ["block_id"] + METRICS,
+        _volume_select(Workout.block_id).where(Workout.block_id.in_(block_ids))
+    ))
+
+    if not exercise_ids:
+        return
+
+    exercise_summary = Exercise_week_summary.__table__
+    session.execute(exercise_summary.delete().where(
+        exercise_summary.c.exercise_id.in_(exercise_ids),
+        exercise_summary.c.week_start.in_(weeks)
+    ))
+    session.execute(exercise_summary.insert().from_select(
+        ["exercise_id", "week_start"] + METRICS,
+        _volume_select(Workout_set.exercise_id, WEEK_START)
+        .where(Workout_set.exercise_id.in_(exercise_ids), WEEK_START.in_(weeks))
+    ))
+
+    # Muscle rows add up every exercise of the muscle, not only the touched ones
+    muscle_ids = select(exercise_muscle.c.muscle_id).where(
+        exercise_muscle.c.exercise_id.in_(exercise_ids)
+    )
+    muscle_summary = Muscle_week_summary.__table__
+    session.execute(muscle_summary.delete().where(
+        muscle_summary.c.muscle_id.in_(muscle_ids),
+        muscle_summary.c.week_start.in_(weeks)
+    ))
+    session.execute(muscle_summary.insert().from_select(
+        ["muscle_id", "week_start"] + METRICS,
+        _volume_select(exercise_muscle.c.muscle_id, WEEK_START)
+        .join(exercise_muscle, exercise_muscle.c.exercise_id == Workout_set.exercise_id)
+        .where(exercise_muscle.c.muscle_id.in_(muscle_ids), WEEK_START.in_(weeks))
+    ))
+
+
+def refresh_workout_summaries(session, workout_ids):
+    """refresh_summaries() for the blocks of the given workouts (e.g. logged ones)"""
+    block_ids = {
+        row[0] for row in
+        session.query(Workout.block_id).filter(Workout.workout_id.in_(set(workout_ids)))
+    }
+    refresh_summaries(session, block_ids)
+
+
+@timed()
+def rebuild_summaries(session):
+    """
+    Recomputes all summary tables from scratch (e.g. for a database loaded
+    before they existed) and commits.
+
+        Parameters:
+            session (SQLAlchemy.session object)
+    """
+    for table in (Block_summary.__table__, Exercise_week_summary.__table__,
+                  Muscle_week_summary.__table__):
+        session.execute(table.delete())
+
+    session.execute(Block_summary.__table__.insert().from_select(
+        ["block_id"] + METRICS, _volume_select(Workout.block_id)
+    ))
+    session.execute(Exercise_week_summary.__table__.insert().from_select(
+        ["exercise_id", "week_start"] + METRICS,
+        _volume_select(Workout_set.exercise_id, WEEK_START)
+    ))
+    session.execute(Muscle_week_summary.__table__.insert().from_select(
+        ["muscle_id", "week_start"] + METRICS,
+        _volume_select(exercise_muscle.c.muscle_id, WEEK_START)
+        .join(exercise_muscle, exercise_muscle.c.exercise_id == Workout_set.exercise_id)
+    ))
+    session.commit()
+
+
+def main():
+    """Rebuilds the training volume summary tables"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    args = parser.parse_args()
+
+    rebuild_summaries(get_session(args.db, "bulk_load"))
+
+
+if __name__ == "__main__":
+    main()
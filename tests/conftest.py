@@ -0,0 +1,51 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+# Modules of the repo are imported as top-level modules (as in the scripts)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main as gym  # noqa: E402
+from database import get_session  # noqa: E402
+from benchmarks.synthetic import write_program_html, fill_log_workbook  # noqa: E402
+
+
+PROGRAM = "Synthetic"
+
+
+@pytest.fixture(scope="session")
+def reference_db(tmp_path_factory):
+    """
+    Small database (every table, index and trigger) with a synthetic program
+    of 2 blocks of 4 workouts, and the logs of its Excel file synced.
+    """
+    tmp_dir = tmp_path_factory.mktemp("reference")
+    db = tmp_dir / "reference.db"
+    gym.prepare_database(str(db))
+    session = get_session(str(db))
+    for file in write_program_html(tmp_dir / "html", 2, 4):
+        gym.bulk_add_block(session, file, PROGRAM)
+    gym.generate_program_excel(session, PROGRAM, str(tmp_dir) + "/", write_only=True)
+    fill_log_workbook(tmp_dir / f"{PROGRAM}.xlsx")
+    gym.sync_log_data(session, tmp_dir / f"{PROGRAM}.xlsx", streaming=True)
+    session.close()
+
+    return db
+
+
+@pytest.fixture
+def db_path(reference_db, tmp_path):
+    """Copy of the reference database for one test"""
+    db = tmp_path / "gym.db"
+    shutil.copy(reference_db, db)
+
+    return str(db)
+
+
+@pytest.fixture
+def session(db_path):
+    session = get_session(db_path)
+    yield session
+    session.close()
@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import select, func
+
+import cdc
+from models import Workout, Workout_set, Exercise, Log_set
+
+
+@pytest.fixture(params=sorted(cdc.STORES))
+def store(request, tmp_path):
+    return cdc.STORES[request.param](tmp_path / f"mirror.{request.param}")
+
+
+def _workout_ids(session):
+    return sorted(row[0] for row in session.execute(select(Workout.workout_id)))
+
+
+def _change_weight(session, workout_id):
+    workout_set = session.execute(
+        select(Workout_set).where(Workout_set.workout_id == workout_id).limit(1)).scalar()
+    workout_set.weight = (workout_set.weight or 0) + 2.5
+    session.commit()
+
+
+def test_full_then_delta(session, store):
+    workout_ids = _workout_ids(session)
+    stats = cdc.export_changes(session, store)
+    assert stats["written"] == len(workout_ids)
+    assert store.checkpoint() == cdc.last_sequence(session) > 0
+
+    _change_weight(session, workout_ids[0])
+    stats = cdc.export_changes(session, store)
+    assert (stats["written"], stats["deleted"]) == (1, 0)
+    assert store.checkpoint() == cdc.last_sequence(session)
+    # Nothing changed since
+    assert cdc.export_changes(session, store)["written"] == 0
+    assert len(store.documents()) == len(workout_ids)
+
+
+def test_failed_full_export_keeps_no_checkpoint(session, store, monkeypatch):
+    workout_ids = _workout_ids(session)
+    write = store.write
+    calls = []
+
+    def failing_write(documents, seq=None):
+        calls.append(seq)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        write(documents, seq)
+
+    monkeypatch.setattr(store, "write", failing_write)
+    with pytest.raises(OSError):
+        cdc.export_changes(session, store, full=True, chunk_size=2)
+    # The first chunk is written but the checkpoint doesn't move
+    assert calls[0] is None
+    assert store.checkpoint() is None
+
+    monkeypatch.undo()
+    stats = cdc.export_changes(session, store, chunk_size=2)
+    assert stats["from"] is None
+    assert sorted(store.documents()) == sorted(cdc._document_id(i) for i in workout_ids)
+    assert store.checkpoint() == cdc.last_sequence(session)
+
+
+def test_checkpoint_survives_prune(session, store):
+    workout_ids = _workout_ids(session)
+    cdc.export_changes(session, store)
+    checkpoint = store.checkpoint()
+
+    assert cdc.prune_changes(session, checkpoint) > 0
+    assert cdc.last_sequence(session) == checkpoint
+    assert cdc.export_changes(session, store)["written"] == 0
+    assert store.checkpoint() == checkpoint
+
+    _change_weight(session, workout_ids[-1])
+    stats = cdc.export_changes(session, store)
+    assert (stats["from"], stats["written"]) == (checkpoint, 1)
+    assert store.checkpoint() > checkpoint
+
+
+def test_deleted_workout(session, store):
+    workout_id = _workout_ids(session)[0]
+    cdc.export_changes(session, store)
+
+    session.delete(session.get(Workout, workout_id))
+    session.commit()
+    stats = cdc.export_changes(session, store)
+    assert (stats["written"], stats["deleted"]) == (0, 1)
+    assert cdc._document_id(workout_id) not in store.documents()
+    assert session.execute(select(func.count(Log_set.log_set_id))).scalar() > 0
+
+
+def test_exercise_rename(session, store):
+    cdc.export_changes(session, store)
+    exercise = session.execute(select(Exercise).join(Workout_set).limit(1)).scalar()
+    workout_ids = sorted(row[0] for row in session.execute(
+        select(Workout_set.workout_id).distinct()
+        .where(Workout_set.exercise_id == exercise.exercise_id)))
+
+    exercise.exercise_desc += " (renamed)"
+    session.commit()
+    stats = cdc.export_changes(session, store)
+    assert stats["written"] == len(workout_ids)
+    documents = store.documents()
+    for workout_id in workout_ids:
+        sets = documents[cdc._document_id(workout_id)]["block"]["workout"]["sets"]
+        assert exercise.exercise_desc in {workout_set["exercise_desc"] for workout_set in sets}
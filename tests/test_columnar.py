@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from sqlalchemy import select, func
+
+import columnar
+from models import Workout_set, Block
+
+
+def _n_sets(session):
+    return session.execute(select(func.count(Workout_set.workout_set_id))).scalar()
+
+
+def test_export_and_load(session, tmp_path):
+    stats = columnar.export_view(session, tmp_path / "view")
+    table = columnar.load_view(tmp_path / "view")
+
+    assert stats["written"] == 2
+    assert table.num_rows == stats["rows"] == _n_sets(session)
+    assert table.column_names == [name for name, _, _ in columnar.VIEW_COLUMNS]
+
+
+@pytest.mark.parametrize("formats", [("parquet", "arrow"), ("arrow", "parquet")])
+def test_format_switch_replaces_partitions(session, tmp_path, formats):
+    for file_format in formats:
+        columnar.export_view(session, tmp_path / "view", file_format)
+
+    files = list((tmp_path / "view").glob("program_id=*/block_id=*/part-0.*"))
+    assert {file.suffix for file in files} == {columnar.FORMATS[formats[-1]]}
+    assert columnar.load_view(tmp_path / "view").num_rows == _n_sets(session)
+
+
+def test_incremental_rewrites_changed_blocks_only(session, tmp_path):
+    columnar.export_view(session, tmp_path / "view", "arrow")
+    assert columnar.export_view(session, tmp_path / "view", "arrow", incremental=True) == {
+        "written": 0, "unchanged": 2, "removed": 0, "rows": 0}
+
+    block_id = session.execute(select(func.min(Block.block_id))).scalar()
+    session.execute(Block.__table__.update().where(Block.block_id == block_id)
+                    .values(block_desc="Renamed"))
+    session.commit()
+    stats = columnar.export_view(session, tmp_path / "view", "arrow", incremental=True)
+    assert (stats["written"], stats["unchanged"]) == (1, 1)
+
+    table = columnar.load_view(tmp_path / "view", block_ids=[block_id])
+    assert set(table.column("block_desc").to_pylist()) == {"Renamed"}
@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import select, func
+
+import main as gym
+import exercise_matching as matching
+from models import Exercise, Exercise_alias, Workout_set, Exercise_week_summary
+
+
+def _exercise_id(session, exercise_desc):
+    return session.execute(select(Exercise.exercise_id)
+                           .where(Exercise.exercise_desc == exercise_desc)).scalar()
+
+
+@pytest.mark.parametrize("name, other, merged", [
+    ("aperturas de mancuernas en banco inclinado",
+     "apertura de mancuernas en banco inclinado", True),
+    ("extension de cuadriceps", "extensión de cuadriceps", True),
+    ("press militar ", "press militar", True),
+    # Different exercises, one word apart
+    ("hiperextensiones libres 15º", "hiperextensiones 15º", False),
+    ("peso muerto", "peso muerto sumo", False),
+    # Variants too far apart to tell from those (left as two exercises)
+    ("gemelo multipower", "gemelo en multipower", False),
+    # Different numbers
+    ("dominadas +10kg", "dominadas +15kg", False),
+    ('plancha abd 30"', 'plancha abd 40"', False),
+])
+def test_threshold(name, other, merged):
+    assert (matching.similarity(name, other) >= matching.MATCH_THRESHOLD) is merged
+
+
+def test_ingest_doesnt_merge_by_default(session):
+    exercise_id = _exercise_id(session, 'sentadilla excéntrica 3"')
+    variant = 'sentadilla  excentrica 3"'
+
+    assert gym.get_exercise_ids(session, [variant])[variant] != exercise_id
+    assert not session.info.get("exercise_aliases")
+    session.rollback()
+
+    session.info["match_threshold"] = matching.MATCH_THRESHOLD
+    assert gym.get_exercise_ids(session, [variant])[variant] == exercise_id
+    assert session.info["exercise_aliases"] == [
+        (variant, exercise_id, 'sentadilla excéntrica 3"', 1.0)]
+    assert session.execute(select(Exercise_alias.exercise_id)
+                           .where(Exercise_alias.alias_desc == variant)).scalar() == exercise_id
+
+
+def test_merge_exercises(session):
+    exercise_id = _exercise_id(session, "peso muerto rumano")
+    n_sets = session.execute(select(func.count()).where(
+        Workout_set.exercise_id == exercise_id)).scalar()
+    planned_sets = session.execute(select(func.sum(Exercise_week_summary.planned_sets))).scalar()
+    # Half of its sets under a spelling variant
+    variant_id = session.execute(Exercise.__table__.insert().values(
+        exercise_desc="peso muerto rumano ")).inserted_primary_key[0]
+    set_ids = session.execute(select(Workout_set.workout_set_id)
+                              .where(Workout_set.exercise_id == exercise_id)).scalars().all()
+    session.execute(Workout_set.__table__.update()
+                    .where(Workout_set.workout_set_id.in_(set_ids[::2]))
+                    .values(exercise_id=variant_id))
+    session.commit()
+
+    merges = matching.find_variants(session)
+    assert [merge[:3] for merge in merges] in (
+        [(variant_id, "peso muerto rumano ", exercise_id)],
+        [(exercise_id, "peso muerto rumano", variant_id)])
+    assert matching.merge_exercises(session, merges) == 1
+
+    kept_id = merges[0][2]
+    assert session.get(Exercise, merges[0][0]) is None
+    assert session.execute(select(func.count()).where(
+        Workout_set.exercise_id == kept_id)).scalar() == n_sets
+    # No set, alias or summary left pointing to the merged exercise
+    assert not session.execute(
+        select(func.count(Workout_set.workout_set_id))
+        .outerjoin(Exercise, Exercise.exercise_id == Workout_set.exercise_id)
+        .where(Exercise.exercise_id.is_(None))).scalar()
+    assert session.execute(select(Exercise_alias.exercise_id)
+                           .where(Exercise_alias.alias_desc == merges[0][1])).scalar() == kept_id
+    assert session.execute(
+        select(func.sum(Exercise_week_summary.planned_sets))).scalar() == planned_sets
@@ -0,0 +1,75 @@
+import re
+import zipfile
+
+from sqlalchemy import select
+
+import main as gym
+from models import Log_workout
+from benchmarks.synthetic import fill_log_workbook
+
+from conftest import PROGRAM
+
+
+SHARED_STRINGS = "xl/sharedStrings.xml"
+INLINE_STRING = re.compile(rb'<c ([^>]*)t="inlineStr"><is><t[^>]*>(.*?)</t></is></c>')
+
+
+def _rewrite_parts(log_file, rewrite):
+    """Rewrites the parts of an .xlsx file: rewrite(parts) edits the name --> bytes dict"""
+    with zipfile.ZipFile(log_file) as archive:
+        parts = {info.filename: archive.read(info) for info in archive.infolist()}
+    rewrite(parts)
+    with zipfile.ZipFile(log_file, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts.items():
+            archive.writestr(name, data)
+
+
+def _use_shared_strings(parts):
+    """
+    Moves the inline strings of the sheets (as openpyxl writes them) to a
+    shared strings part, where Excel and LibreOffice keep them.
+    """
+    strings = {}
+
+    def shared(match):
+        index = strings.setdefault(match.group(2), len(strings))
+        return b'<c ' + match.group(1) + b't="s"><v>%d</v></c>' % index
+
+    for name in [name for name in parts if name.startswith("xl/worksheets/")]:
+        parts[name] = INLINE_STRING.sub(shared, parts[name])
+    parts[SHARED_STRINGS] = (
+        b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        + b"".join(b"<si><t>%s</t></si>" % text for text in strings) + b"</sst>")
+    parts["xl/_rels/workbook.xml.rels"] = parts["xl/_rels/workbook.xml.rels"].replace(
+        b"</Relationships>",
+        b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+        b'relationships/sharedStrings" Target="sharedStrings.xml" Id="rIdStrings"/>'
+        b"</Relationships>")
+    parts["[Content_Types].xml"] = parts["[Content_Types].xml"].replace(
+        b"</Types>",
+        b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+
+
+def test_shared_strings_change_is_synced(session, tmp_path):
+    gym.generate_program_excel(session, PROGRAM, str(tmp_path) + "/", write_only=True)
+    log_file = tmp_path / f"{PROGRAM}.xlsx"
+    fill_log_workbook(log_file, seed=1)
+    _rewrite_parts(log_file, _use_shared_strings)
+    n_sheets = len(gym.sheet_checksums(log_file))
+    gym.sync_log_data(session, log_file, streaming=True, skip_unchanged=True)
+    assert gym.sync_log_data(session, log_file, streaming=True,
+                             skip_unchanged=True)["skipped_sheets"] == n_sheets
+
+    # A comment edited in place: only the shared strings part changes
+    def edit_comment(parts):
+        assert b"<t>Cansado</t>" in parts[SHARED_STRINGS]
+        parts[SHARED_STRINGS] = parts[SHARED_STRINGS].replace(b"<t>Cansado</t>",
+                                                              b"<t>Agotado</t>")
+
+    _rewrite_parts(log_file, edit_comment)
+
+    stats = gym.sync_log_data(session, log_file, streaming=True, skip_unchanged=True)
+    assert stats["skipped_sheets"] == 0
+    comments = set(session.execute(select(Log_workout.comment_workout)).scalars())
+    assert "Agotado" in comments and "Cansado" not in comments
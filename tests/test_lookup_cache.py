@@ -0,0 +1,59 @@
+from sqlalchemy import select
+
+import exercise_matching as matching
+from lookup_cache import (LookupCache, get_lookup_cache, lookup_program_id,
+                          lookup_block_id, lookup_exercise_id)
+from models import Program, Block, Exercise, Workout_set
+
+from conftest import PROGRAM
+
+
+def test_lru_bound():
+    cache = LookupCache(maxsize=2)
+    cache.put(("exercise", "a"), 1)
+    cache.put(("exercise", "b"), 2)
+    assert cache.get(("exercise", "a")) == 1
+    cache.put(("exercise", "c"), 3)
+
+    assert cache.get(("exercise", "b")) is None
+    assert cache.stats()["size"] == 2
+
+
+def test_rollback_drops_new_entries(session):
+    program_id = lookup_program_id(session, PROGRAM)
+    session.commit()
+    session.add(Program(program_desc="Rolled back"))
+    session.flush()
+    assert get_lookup_cache(session).get(("program", "Rolled back")) is not None
+
+    session.rollback()
+    assert get_lookup_cache(session).get(("program", "Rolled back")) is None
+    assert lookup_program_id(session, "Rolled back") is None
+    # Entries committed before are kept
+    assert get_lookup_cache(session).get(("program", PROGRAM)) == program_id
+
+
+def test_rename_evicts(session):
+    block = session.execute(select(Block)).scalars().first()
+    old_desc = block.block_desc
+    assert lookup_block_id(session, block.program_id, old_desc) == block.block_id
+
+    block.block_desc = old_desc + " (renamed)"
+    session.commit()
+    assert lookup_block_id(session, block.program_id, old_desc) is None
+    assert lookup_block_id(session, block.program_id, block.block_desc) == block.block_id
+
+
+def test_bulk_statements_evict(session):
+    exercise_id = session.execute(select(Workout_set.exercise_id)).scalar()
+    exercise_desc = session.get(Exercise, exercise_id).exercise_desc
+    variant_id = session.execute(Exercise.__table__.insert().values(
+        exercise_desc=exercise_desc + " ")).inserted_primary_key[0]
+    session.commit()
+    assert lookup_exercise_id(session, exercise_desc + " ") == variant_id
+
+    # merge_exercises() deletes the variant with a bulk DELETE
+    matching.merge_exercises(session, [(variant_id, exercise_desc + " ", exercise_id,
+                                        exercise_desc, 1.0)])
+    assert lookup_exercise_id(session, exercise_desc + " ") is None
+    assert lookup_exercise_id(session, exercise_desc) == exercise_id
@@ -0,0 +1,83 @@
+"""
+Benchmark of every stage of the pipeline on its own (see
+benchmarks/pipeline.py), over a synthetic program, checking the results of
+the last round of each one.
+
+    python -m pytest tests/test_pipeline_benchmark.py [--benchmark-autosave]
+
+BENCHMARK_BLOCKS, BENCHMARK_SESSIONS_PER_BLOCK and BENCHMARK_ROUNDS set the
+scale (small by default, so the suite runs on every change).
+"""
+import os
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import select, func
+
+pytest.importorskip("pytest_benchmark")
+
+import main as gym
+from models import Workout_set, Log_set
+from benchmarks.pipeline import Fixture, PROGRAM, STAGES
+
+
+N_BLOCKS = int(os.environ.get("BENCHMARK_BLOCKS", 3))
+SESSIONS_PER_BLOCK = int(os.environ.get("BENCHMARK_SESSIONS_PER_BLOCK", 12))
+ROUNDS = int(os.environ.get("BENCHMARK_ROUNDS", 3))
+
+
+@pytest.fixture(scope="module")
+def pipeline(tmp_path_factory):
+    return Fixture(tmp_path_factory.mktemp("pipeline"), N_BLOCKS, SESSIONS_PER_BLOCK)
+
+
+def _count(session, column):
+    return session.execute(select(func.count(column))).scalar()
+
+
+def check_parse(fixture, result):
+    assert len(result) == len(fixture.files)
+    assert sum(len(workouts) for micro_dict in result
+               for workouts in micro_dict.values()) == N_BLOCKS * SESSIONS_PER_BLOCK
+
+
+def check_curate(fixture, result):
+    assert len(result) == N_BLOCKS * SESSIONS_PER_BLOCK
+
+
+def check_sets(fixture, result):
+    assert _count(fixture.session, Workout_set.workout_set_id) == fixture.n_sets
+
+
+def check_export(fixture, result):
+    book = load_workbook(fixture.export_dir / f"{PROGRAM}.xlsx", read_only=True)
+    assert len(book.sheetnames) == N_BLOCKS
+    book.close()
+
+
+def check_logs(fixture, result):
+    done_sets = sum(len(sets) for *_, sets in gym.stream_log_workouts(fixture.log_file))
+    assert done_sets
+    assert _count(fixture.session, Log_set.log_set_id) == done_sets
+
+
+CHECKS = {
+    "get_data_from_html": check_parse,
+    "curate_exercises_data": check_curate,
+    "add_block": check_sets,
+    "bulk_add_block": check_sets,
+    "generate_program_excel": check_export,
+    "generate_program_excel (write_only)": check_export,
+    "load_log_data": check_logs,
+    "sync_log_data (streaming)": check_logs,
+}
+
+
+@pytest.mark.parametrize("stage", list(STAGES))
+def test_stage(benchmark, pipeline, stage):
+    benchmark.group = "pipeline"
+    # Every round times a function with fresh inputs (a new db copy...)
+    result = benchmark.pedantic(lambda function: function(),
+                                setup=lambda: ((STAGES[stage](pipeline),), {}),
+                                rounds=ROUNDS)
+    CHECKS[stage](pipeline, result)
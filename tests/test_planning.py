@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+import cdc
+import planning
+import summaries
+from models import Program, Exercise, Exercise_week_summary, Workout_set
+
+
+def _program_id(session):
+    return session.execute(select(Program.program_id)).scalar()
+
+
+def test_weekly_volume_matches_summaries(session):
+    cube = planning.load_cube(session, _program_id(session))
+    weeks, volume = planning.weekly_volume(cube)
+
+    expected = {(row.exercise_id, np.datetime64(row.week_start, "D")): row
+                for row in session.execute(select(Exercise_week_summary)).scalars()}
+    computed = {}
+    for k, week in enumerate(weeks):
+        for e, exercise_id in enumerate(cube.exercise_ids):
+            if volume["planned_sets"][k, e]:
+                computed[(int(exercise_id), week)] = k, e
+    assert expected and computed.keys() == expected.keys()
+    for key, (k, e) in computed.items():
+        for metric in summaries.METRICS:
+            expected_value = getattr(expected[key], metric)
+            assert volume[metric][k, e] == pytest.approx(expected_value, rel=1e-5)
+
+
+def test_saved_cube_round_trip(session, tmp_path):
+    cube = planning.load_cube(session, _program_id(session))
+    planning.save_cube(cube, tmp_path / "cube.npz")
+
+    for mmap in (True, False):
+        loaded = planning.read_cube(tmp_path / "cube.npz", mmap=mmap)
+        assert (loaded.program_id, loaded.seq) == (cube.program_id, cube.seq)
+        for name in planning.PlanningCube.AXES + list(planning.METRICS):
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(cube, name))
+
+
+def test_cache_invalidation(session, tmp_path):
+    program_id = _program_id(session)
+    cube = planning.get_cube(session, program_id, tmp_path)
+    assert cube.seq == cdc.last_sequence(session)
+    assert planning.get_cube(session, program_id, tmp_path).seq == cube.seq
+
+    # Exercise renames are logged for the workouts of its sets
+    exercise = session.get(Exercise, int(cube.exercise_ids[0]))
+    exercise.exercise_desc += " (renamed)"
+    session.commit()
+    renamed = planning.get_cube(session, program_id, tmp_path)
+    assert renamed.seq > cube.seq
+    assert renamed.exercise_descs[0] == exercise.exercise_desc
+
+    # Pruning the change log doesn't move the sequence back, the cache holds
+    cdc.prune_changes(session, renamed.seq)
+    assert planning.get_cube(session, program_id, tmp_path).seq == renamed.seq
+
+    workout_set = session.get(Workout_set, int(cube.workout_set_ids[0, 0, 0]))
+    workout_set.weight = (workout_set.weight or 0) + 2.5
+    session.commit()
+    changed = planning.get_cube(session, program_id, tmp_path)
+    assert changed.seq > renamed.seq
+    assert changed.weight[0, 0, 0] == np.float32(workout_set.weight)